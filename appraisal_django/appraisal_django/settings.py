@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -27,6 +28,8 @@ DEBUG = True
 
 ALLOWED_HOSTS = []
 
+TESTING = sys.argv[1:2] == ['test']
+
 
 # Application definition
 
@@ -49,7 +52,7 @@ CORS_ALLOWED_ORIGINS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'core.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -58,6 +61,7 @@ REST_FRAMEWORK = {
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -65,6 +69,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'appraisal_django.urls'
@@ -135,6 +140,41 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Token cache of core.authentication.CachedTokenAuthentication
+AUTH_TOKEN_CACHE_SIZE = 10000  # Tokens kept per process
+AUTH_TOKEN_CACHE_TTL = 300  # Seconds before a cached token is loaded again
+AUTH_TOKEN_SHARED_CACHE = 'default'  # Alias in CACHES shared by every process, e.g. Redis; with a per-process backend, other processes' changes wait for the TTL
+
+# Background exports (see core.exports)
+EXPORT_JOBS_DIR = BASE_DIR / 'exports'
+EXPORT_JOBS_IN_PROCESS = DEBUG  # Run jobs on a thread pool in the web process; otherwise run `manage.py run_export_jobs`
+EXPORT_JOBS_WORKERS = 2  # Jobs run at once per process
+EXPORT_JOBS_PER_DEALERSHIP = 2  # Queued or running jobs allowed per dealership
+EXPORT_JOBS_RETENTION_HOURS = 24
+EXPORT_JOBS_TIMEOUT_MINUTES = 60
+
+# Query counting and per-action budgets (see core.middleware)
+QUERY_BUDGET_ENABLED = DEBUG or TESTING  # Removes the middleware when off
+QUERY_BUDGET_STRICT = TESTING  # Raise on a request over its budget instead of logging a warning
+
+# Opt-in request profiles for staff (see core.profiling)
+PROFILING_ENABLED = False  # Removes the middleware when off
+PROFILING_SAMPLE_RATE = 1.0  # Fraction of the requests asking to be profiled that are
+PROFILING_DIR = BASE_DIR / 'profiles'
+PROFILING_MAX_PROFILES = 500  # Older profiles are deleted
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # One line per request; the test suite only reports requests over budget
+        'core.queries': {'handlers': ['console'], 'level': 'WARNING' if TESTING else 'INFO', 'propagate': False},
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
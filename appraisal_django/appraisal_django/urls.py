@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from core import viewsets
+from core import admin as core_admin, viewsets
 from django.contrib import admin
 
 # Define the router for standard CRUD endpoints
@@ -12,10 +12,14 @@ api_router.register(r'wholesaler-profile', viewsets.WholesalerProfileViewSet, ba
 api_router.register(r'appraisals', viewsets.AppraisalViewSet)  # Add this line for appraisals
 api_router.register(r'friend-requests', viewsets.RequestViewSet, basename='friend-request')
 api_router.register(r'offer', viewsets.OfferViewSet, basename='offer')
+api_router.register(r'export-jobs', viewsets.ExportJobViewSet, basename='export-job')
 
 
 
 urlpatterns = [
+    path('admin/profiles/', admin.site.admin_view(core_admin.profile_list_view), name='profiles'),
+    path('admin/profiles/<str:profile_id>/', admin.site.admin_view(core_admin.profile_detail_view), name='profile-detail'),
+    path('admin/profiles/<str:profile_id>/download/', admin.site.admin_view(core_admin.profile_download_view), name='profile-download'),
     path('admin/', admin.site.urls),
     path('api/', include(api_router.urls)),
 ]
@@ -1,8 +1,10 @@
 from typing import Any
 from django.contrib import admin
 from django.db.models.query import QuerySet
-from django.http import HttpRequest
+from django.http import FileResponse, Http404, HttpRequest
+from django.template.response import TemplateResponse
 from core.models import *
+from core.profiling import load_profile, profile_path, profiling_settings, slowest_by_action
 
 # Register your models here.
 
@@ -136,4 +138,35 @@ class FriendRequestAdmin(admin.ModelAdmin):
     # Optional: Add list per page
     list_per_page = 20
 
-# admin.site.register(AppraisalInvite)
\ No newline at end of file
+# admin.site.register(AppraisalInvite)
+
+# Request profiles (see core.profiling), under the admin site's login and staff check in urls.py
+
+def profile_list_view(request):
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Slowest profiled requests',
+        'enabled': profiling_settings()['enabled'],
+        'actions': slowest_by_action(),
+    }
+    return TemplateResponse(request, 'admin/core/profiles.html', context)
+
+
+def profile_detail_view(request, profile_id):
+    summary = load_profile(profile_id)
+    if summary is None:
+        raise Http404('No such profile')
+    context = {
+        **admin.site.each_context(request),
+        'title': f'Profile of {summary["method"]} {summary["path"]}',
+        'profile': summary,
+    }
+    return TemplateResponse(request, 'admin/core/profile_detail.html', context)
+
+
+def profile_download_view(request, profile_id):
+    try:
+        path = profile_path(profile_id, 'prof')
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{profile_id}.prof')
+    except (ValueError, FileNotFoundError):
+        raise Http404('No such profile')
@@ -0,0 +1,202 @@
+"""
+Daily analytics rollups.
+
+DailyAppraisalRollup, DailyVehicleRollup and DailyWholesalerRollup hold totals per (dealership, initiating dealer, day),
+so the dashboard actions read a handful of rows per day instead of scanning every appraisal and offer.
+The rows for a key are recomputed from the appraisals under it whenever one of them or its offers change,
+and `manage.py rebuild_analytics_rollups` recomputes everything in date batches.
+
+WholesalerLeaderboard holds the all-time win counts, adjusted by one whenever make-winner picks or replaces a winner,
+or a winning offer or won appraisal is deleted.
+"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Min, Max, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import Appraisal, DailyAppraisalRollup, DailyVehicleRollup, DailyWholesalerRollup, WholesalerLeaderboard
+
+ROLLUP_MODELS = (DailyAppraisalRollup, DailyVehicleRollup, DailyWholesalerRollup)
+
+# Columns of the rollup key, as annotated on an appraisal queryset by aggregate_rollups()
+ROLLUP_KEY = ('dealership_id', 'initiating_dealer_id', 'day')
+
+# Beyond this many keys, refresh_rollups() recomputes the span covering them instead of matching each key
+MAX_ROLLUP_KEY_CONDITIONS = 50
+
+# DailyAppraisalRollup column counting each dealer status
+STATUS_COUNT_FIELDS = {
+    'Pending - Sales': 'pending_sales_count',
+    'Pending - Management': 'pending_management_count',
+    'Active': 'active_count',
+    'Complete': 'complete_count',
+    'Trashed': 'trashed_count',
+}
+
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def aggregate_rollups(appraisals):
+    """
+    Group an appraisal queryset into unsaved rows for the three rollup tables, one grouped query each.
+    """
+    appraisals = appraisals.filter(start_date__isnull=False).annotate(day=TruncDate('start_date')).order_by()
+
+    margin = ExpressionWrapper(
+        Coalesce('winner__adjusted_amount', 'winner__amount') - F('reserve_price'),
+        output_field=DecimalField(max_digits=14, decimal_places=2),
+    )
+    status_counts = {field: Count('id', filter=Q(dealer_status=status)) for status, field in STATUS_COUNT_FIELDS.items()}
+    appraisal_rows = (appraisals
+                      .values(*ROLLUP_KEY)
+                      .annotate(appraisal_count=Count('id'),
+                                won_count=Count('id', filter=Q(winner__isnull=False)),
+                                margin=Coalesce(Sum(margin), Value(Decimal('0')), output_field=DecimalField()),
+                                **status_counts))
+
+    vehicle_rows = (appraisals
+                    .values(*ROLLUP_KEY, 'vehicle_make', 'vehicle_model')
+                    .annotate(appraisal_count=Count('id')))
+
+    wholesaler_rows = (appraisals
+                       .filter(winner__user__isnull=False)
+                       .values(*ROLLUP_KEY, wholesaler_id=F('winner__user_id'))
+                       .annotate(win_count=Count('id')))
+
+    return (
+        [DailyAppraisalRollup(**row) for row in appraisal_rows],
+        [DailyVehicleRollup(**row) for row in vehicle_rows],
+        [DailyWholesalerRollup(**row) for row in wholesaler_rows],
+    )
+
+
+def write_rollups(appraisals, rollup_filter):
+    """
+    Replace the rollup rows matching rollup_filter with fresh aggregates of the given appraisals.
+    """
+    with transaction.atomic():
+        for model in ROLLUP_MODELS:
+            model.objects.filter(rollup_filter).delete()
+        for model, rows in zip(ROLLUP_MODELS, aggregate_rollups(appraisals)):
+            model.objects.bulk_create(rows)
+
+
+def refresh_rollups(keys):
+    """
+    Recompute the rollup rows for a set of (dealership_id, initiating_dealer_id, day) keys.
+    """
+    keys = {key for key in keys if key is not None}
+    if not keys:
+        return
+
+    if len(keys) > MAX_ROLLUP_KEY_CONDITIONS:
+        # Recompute every row in the span of the keys, which costs less than matching each key separately
+        dealership_ids = {dealership_id for dealership_id, _, _ in keys}
+        dealer_ids = {dealer_id for _, dealer_id, _ in keys}
+        first_day = min(day for _, _, day in keys)
+        last_day = max(day for _, _, day in keys)
+        write_rollups(
+            Appraisal.objects.filter(dealership_id__in=dealership_ids, initiating_dealer_id__in=dealer_ids,
+                                     start_date__gte=day_bounds(first_day)[0], start_date__lt=day_bounds(last_day)[1]),
+            Q(dealership_id__in=dealership_ids, initiating_dealer_id__in=dealer_ids, day__gte=first_day, day__lte=last_day),
+        )
+        return
+
+    rollup_filter = Q()
+    appraisal_filter = Q()
+    for dealership_id, dealer_id, day in keys:
+        rollup_filter |= Q(dealership_id=dealership_id, initiating_dealer_id=dealer_id, day=day)
+        day_start, day_end = day_bounds(day)
+        appraisal_filter |= Q(dealership_id=dealership_id, initiating_dealer_id=dealer_id,
+                              start_date__gte=day_start, start_date__lt=day_end)
+
+    write_rollups(Appraisal.objects.filter(appraisal_filter), rollup_filter)
+
+
+def refresh_appraisal_rollups(appraisal_ids):
+    """
+    Recompute the rollup rows the given appraisals are counted under.
+    """
+    rows = Appraisal.objects.filter(pk__in=appraisal_ids, start_date__isnull=False).values_list(
+        'dealership_id', 'initiating_dealer_id', 'start_date')
+    refresh_rollups({(dealership_id, dealer_id, timezone.localdate(start_date)) for dealership_id, dealer_id, start_date in rows})
+
+
+def rebuild_rollups(batch_days=31):
+    """
+    Recompute every rollup row, one transaction per batch_days of appraisal start dates.
+    Yields the (first_day, last_day) of each batch once it is written.
+    """
+    bounds = Appraisal.objects.filter(start_date__isnull=False).aggregate(first=Min('start_date'), last=Max('start_date'))
+    if bounds['first'] is None:
+        for model in ROLLUP_MODELS:
+            model.objects.all().delete()
+        return
+
+    first_day = timezone.localdate(bounds['first'])
+    last_day = timezone.localdate(bounds['last'])
+
+    # Rows outside the appraisal date range belong to appraisals that no longer exist
+    for model in ROLLUP_MODELS:
+        model.objects.filter(Q(day__lt=first_day) | Q(day__gt=last_day)).delete()
+
+    batch_start = first_day
+    while batch_start <= last_day:
+        batch_end = min(batch_start + timedelta(days=batch_days - 1), last_day)
+        appraisals = Appraisal.objects.filter(
+            start_date__gte=day_bounds(batch_start)[0], start_date__lt=day_bounds(batch_end)[1])
+        write_rollups(appraisals, Q(day__gte=batch_start, day__lte=batch_end))
+        yield batch_start, batch_end
+        batch_start = batch_end + timedelta(days=1)
+
+
+def adjust_leaderboard(dealership_id, dealer_id, wholesaler_id, delta):
+    """
+    Add delta wins to the wholesaler on both the dealership's and the initiating dealer's leaderboard.
+    """
+    for initiating_dealer_id in (None, dealer_id):
+        entry, _ = WholesalerLeaderboard.objects.get_or_create(
+            dealership_id=dealership_id, initiating_dealer_id=initiating_dealer_id, wholesaler_id=wholesaler_id)
+        entries = WholesalerLeaderboard.objects.filter(pk=entry.pk)
+        if delta < 0:
+            entries = entries.filter(win_count__gte=-delta)
+        entries.update(win_count=F('win_count') + delta)
+
+
+def record_winner_change(appraisal, previous_winner, winner):
+    """
+    Move an appraisal's win on the leaderboards from previous_winner's wholesaler to winner's. Either offer may be None.
+    """
+    previous_wholesaler_id = previous_winner.user_id if previous_winner else None
+    wholesaler_id = winner.user_id if winner else None
+    if previous_wholesaler_id == wholesaler_id:
+        return
+
+    with transaction.atomic():
+        if previous_wholesaler_id:
+            adjust_leaderboard(appraisal.dealership_id, appraisal.initiating_dealer_id, previous_wholesaler_id, -1)
+        if wholesaler_id:
+            adjust_leaderboard(appraisal.dealership_id, appraisal.initiating_dealer_id, wholesaler_id, 1)
+
+
+def rebuild_leaderboard(batch_size=1000):
+    """
+    Recount every leaderboard row from the appraisal winners. Returns the number of rows written.
+    """
+    winners = Appraisal.objects.filter(winner__user__isnull=False).order_by()
+    wholesaler = F('winner__user_id')
+    dealership_rows = winners.values('dealership_id', wholesaler_id=wholesaler).annotate(win_count=Count('id'))
+    dealer_rows = winners.values('dealership_id', 'initiating_dealer_id', wholesaler_id=wholesaler).annotate(win_count=Count('id'))
+
+    entries = [WholesalerLeaderboard(**row) for row in dealership_rows]
+    entries += [WholesalerLeaderboard(**row) for row in dealer_rows]
+    with transaction.atomic():
+        WholesalerLeaderboard.objects.all().delete()
+        WholesalerLeaderboard.objects.bulk_create(entries, batch_size=batch_size)
+    return len(entries)
@@ -0,0 +1,355 @@
+"""
+Token authentication with cached users.
+
+DRF's TokenAuthentication looks up the token and its user on every request, and the permission classes then
+load the user's dealer or wholesaler profile and dealership ids lazily. CachedTokenAuthentication loads all of
+that in one step and keeps a snapshot per token in a bounded in-process LRU with a TTL, so requests with a warm
+token run no authentication queries. Each request gets fresh model instances built from the snapshot, with the
+user's RoleContext attached.
+
+AUTH_TOKEN_SHARED_CACHE names a cache shared by every process (the `default` alias unless set), which adds a
+second tier. Invalidation bumps a per-user generation number in that cache, and entries from an older generation
+are ignored, so a change made in one process is seen by the others on their next request. A process-local backend
+(locmem or dummy) cannot carry that signal, so without a shared cache the in-process entry is trusted until it
+expires: changes made in this process are seen at once through the signals below, and changes made in other
+processes within AUTH_TOKEN_CACHE_TTL.
+
+Logins, token changes, and saves of users, profiles and dealer dealerships invalidate the user's entries
+(see connect_signals).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .models import DealerProfile, WholesalerProfile
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_CACHE_TTL = 300  # Seconds
+
+# Loaded into the snapshot; the password hash is left out and stays deferred on the rebuilt user
+USER_FIELDS = tuple(field.attname for field in User._meta.concrete_fields if field.attname != 'password')
+TOKEN_FIELDS = tuple(field.attname for field in Token._meta.concrete_fields)
+DEALER_FIELDS = tuple(field.attname for field in DealerProfile._meta.concrete_fields)
+WHOLESALER_FIELDS = tuple(field.attname for field in WholesalerProfile._meta.concrete_fields)
+
+
+def get_dealership_ids(dealer_profile):
+    """
+    The ids of a dealer's dealerships: preloaded by CachedTokenAuthentication, or fetched once per profile instance.
+    """
+    if not hasattr(dealer_profile, 'dealership_ids'):
+        dealer_profile.dealership_ids = frozenset(dealer_profile.dealerships.values_list('id', flat=True))
+    return dealer_profile.dealership_ids
+
+
+class RoleContext:
+    """
+    What a request needs to know about its user's role, worked out once: the role, the profile ids and the
+    dealership ids. Permissions, viewsets and serializers read it through get_role_context() instead of
+    probing the profiles themselves, so their checks are attribute reads and set lookups with no queries.
+    """
+    MANAGEMENT = 'M'
+    SALES = 'S'
+    WHOLESALER = 'wholesaler'
+
+    def __init__(self, user):
+        self.user = user
+        authenticated = user is not None and user.is_authenticated
+        self.dealer_profile = getattr(user, 'dealerprofile', None) if authenticated else None
+        self.wholesaler_profile = getattr(user, 'wholesalerprofile', None) if authenticated else None
+
+        if self.dealer_profile is not None:
+            self.role = self.dealer_profile.role
+            self.dealership_ids = get_dealership_ids(self.dealer_profile)
+        else:
+            self.role = self.WHOLESALER if self.wholesaler_profile is not None else None
+            self.dealership_ids = frozenset()
+
+        self.dealer_profile_id = self.dealer_profile.id if self.dealer_profile is not None else None
+        self.wholesaler_profile_id = self.wholesaler_profile.id if self.wholesaler_profile is not None else None
+
+    @property
+    def is_dealer(self):
+        return self.dealer_profile is not None
+
+    @property
+    def is_wholesaler(self):
+        return self.wholesaler_profile is not None
+
+    @property
+    def is_management(self):
+        return self.is_dealer and self.role == self.MANAGEMENT
+
+    @property
+    def is_sales(self):
+        return self.is_dealer and self.role == self.SALES
+
+    @property
+    def status_field(self):
+        # The appraisal status the user sees: annotated for wholesalers, stored for dealers
+        if self.is_wholesaler:
+            return 'wholesaler_status'
+        if self.is_dealer:
+            return 'dealer_status'
+        return None
+
+    def in_dealership(self, dealership_id):
+        try:
+            return int(dealership_id) in self.dealership_ids
+        except (TypeError, ValueError):
+            return False
+
+
+def get_role_context(user):
+    """
+    The user's RoleContext. CachedTokenAuthentication attaches it; for any other user it is built on first use.
+    A missing user (e.g. a serializer used without a request) gets an empty context.
+    """
+    if user is None:
+        return RoleContext(None)
+    context = getattr(user, 'role_context', None)
+    if context is None:
+        context = user.role_context = RoleContext(user)
+    return context
+
+
+class TokenCache:
+    """
+    Thread-safe LRU of token snapshots that expire ttl seconds after being stored.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, snapshot = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return snapshot
+
+    def set(self, key, snapshot):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, snapshot)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def discard_user(self, user_id):
+        with self.lock:
+            for key in [key for key, (_, snapshot) in self.entries.items() if snapshot['user']['id'] == user_id]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache(
+    getattr(settings, 'AUTH_TOKEN_CACHE_SIZE', DEFAULT_CACHE_SIZE),
+    getattr(settings, 'AUTH_TOKEN_CACHE_TTL', DEFAULT_CACHE_TTL),
+)
+
+
+def shared_cache():
+    """
+    The cache shared by every process, or None if AUTH_TOKEN_SHARED_CACHE is unset or names a process-local backend.
+    """
+    alias = getattr(settings, 'AUTH_TOKEN_SHARED_CACHE', 'default')
+    if not alias:
+        return None
+    cache = caches[alias]
+    return None if isinstance(cache, (LocMemCache, DummyCache)) else cache
+
+
+def snapshot_cache_key(key):
+    return f'auth-token:{key}'
+
+
+def generation_cache_key(user_id):
+    return f'auth-token:generation:{user_id}'
+
+
+def current_generation(user_id):
+    cache = shared_cache()
+    return cache.get(generation_cache_key(user_id), 0) if cache else 0
+
+
+def invalidate_token(key):
+    token_cache.discard(key)
+    cache = shared_cache()
+    if cache:
+        cache.delete(snapshot_cache_key(key))
+
+
+def invalidate_user(user_id):
+    """
+    Drop every cached token of a user, in this process and (through the generation number) in all others.
+    """
+    token_cache.discard_user(user_id)
+    cache = shared_cache()
+    if cache:
+        generation_key = generation_cache_key(user_id)
+        try:
+            cache.incr(generation_key)
+        except ValueError:
+            cache.set(generation_key, 1, timeout=None)
+
+
+def load_snapshot(key):
+    """
+    The token, user, role profile and dealership ids for a token key as plain values, in at most two queries.
+    """
+    token = Token.objects.select_related('user__dealerprofile', 'user__wholesalerprofile').get(key=key)
+    user = token.user
+    snapshot = {
+        'token': {name: getattr(token, name) for name in TOKEN_FIELDS},
+        'user': {name: getattr(user, name) for name in USER_FIELDS},
+        'dealer_profile': None,
+        'dealership_ids': None,
+        'wholesaler_profile': None,
+        'generation': current_generation(user.id),
+    }
+    if hasattr(user, 'dealerprofile'):
+        snapshot['dealer_profile'] = {name: getattr(user.dealerprofile, name) for name in DEALER_FIELDS}
+        snapshot['dealership_ids'] = sorted(get_dealership_ids(user.dealerprofile))
+    if hasattr(user, 'wholesalerprofile'):
+        snapshot['wholesaler_profile'] = {name: getattr(user.wholesalerprofile, name) for name in WHOLESALER_FIELDS}
+    return snapshot
+
+
+def build_instance(model, values):
+    return model.from_db(DEFAULT_DB_ALIAS, list(values), list(values.values()))
+
+
+def build_user(snapshot):
+    """
+    Fresh Token and User instances from a snapshot, with the user's profiles already attached.
+    """
+    user = build_instance(User, snapshot['user'])
+    token = build_instance(Token, snapshot['token'])
+    token.user = user
+
+    for descriptor, model, values in (
+        (User.dealerprofile, DealerProfile, snapshot['dealer_profile']),
+        (User.wholesalerprofile, WholesalerProfile, snapshot['wholesaler_profile']),
+    ):
+        profile = None
+        if values is not None:
+            profile = build_instance(model, values)
+            profile.user = user
+        # Caching None makes hasattr(user, ...) False without a query
+        descriptor.related.set_cached_value(user, profile)
+
+    if snapshot['dealer_profile'] is not None:
+        user.dealerprofile.dealership_ids = frozenset(snapshot['dealership_ids'])
+    return user, token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that resolves tokens from the two-tier cache and preloads the user's role profile.
+    """
+
+    def get_snapshot(self, key):
+        cache = shared_cache()
+        snapshot = token_cache.get(key)
+        if snapshot is not None:
+            # Signals drop entries changed in this process; other processes can only report changes through a shared cache
+            if cache is None or snapshot['generation'] == current_generation(snapshot['user']['id']):
+                return snapshot
+            token_cache.discard(key)
+
+        if cache is not None:
+            snapshot = cache.get(snapshot_cache_key(key))
+            if snapshot is not None and snapshot['generation'] == current_generation(snapshot['user']['id']):
+                token_cache.set(key, snapshot)
+                return snapshot
+
+        try:
+            snapshot = load_snapshot(key)
+        except Token.DoesNotExist:
+            return None
+        token_cache.set(key, snapshot)
+        if cache is not None:
+            cache.set(snapshot_cache_key(key), snapshot, timeout=token_cache.ttl)
+        return snapshot
+
+    def authenticate_credentials(self, key):
+        snapshot = self.get_snapshot(key)
+        if snapshot is None:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+
+        user, token = build_user(snapshot)
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        user.role_context = RoleContext(user)
+        return user, token
+
+
+def invalidate_instance_user(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
+
+
+def invalidate_saved_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+def invalidate_saved_token(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+    invalidate_user(instance.user_id)
+
+
+def invalidate_logged_in_user(sender, request, user, **kwargs):
+    if user is not None:
+        invalidate_user(user.pk)
+
+
+def invalidate_dealer_dealerships(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate_user(instance.user_id)
+        return
+    # Changed from the dealership side: pk_set holds dealer profile ids, or is None when clearing
+    dealers = DealerProfile.objects.filter(dealerships=instance) if pk_set is None else DealerProfile.objects.filter(pk__in=pk_set)
+    for user_id in dealers.values_list('user_id', flat=True):
+        invalidate_user(user_id)
+
+
+def connect_signals():
+    """
+    Invalidate cached tokens whenever what they hold changes. Called from CoreConfig.ready().
+    """
+    for signal in (post_save, post_delete):
+        signal.connect(invalidate_saved_user, sender=User, dispatch_uid='auth_cache_user')
+        signal.connect(invalidate_saved_token, sender=Token, dispatch_uid='auth_cache_token')
+        signal.connect(invalidate_instance_user, sender=DealerProfile, dispatch_uid='auth_cache_dealer')
+        signal.connect(invalidate_instance_user, sender=WholesalerProfile, dispatch_uid='auth_cache_wholesaler')
+    m2m_changed.connect(invalidate_dealer_dealerships, sender=DealerProfile.dealerships.through, dispatch_uid='auth_cache_dealerships')
+    user_logged_in.connect(invalidate_logged_in_user, dispatch_uid='auth_cache_login')
+    user_logged_out.connect(invalidate_logged_in_user, dispatch_uid='auth_cache_logout')
@@ -0,0 +1,249 @@
+"""
+In-process endpoint benchmarks.
+
+run_benchmarks() drives the DRF endpoints through APIClient against the configured database, typically one filled
+by `manage.py seed_synthetic_data`. It times every scenario as a management dealer, a sales dealer and a
+wholesaler, each authenticating with an API token, and records latency percentiles, the SQL queries each request
+ran, their database time and the peak Python memory it allocated, keyed by viewset and action like the core.queries
+log lines. Memory is traced in a separate pass after the timed requests, since tracemalloc slows everything it watches. The report is plain JSON so two branches can
+be compared with compare_reports().
+"""
+import logging
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import Count
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .middleware import QueryCounter, resolve_action
+from .models import Appraisal, DealerProfile, Offer, WholesalerProfile
+
+
+@dataclass
+class Scenario:
+    name: str
+    role: str  # Whose client runs it: 'management', 'sales' or 'wholesaler'
+    path: str
+    params: dict = field(default_factory=dict)
+
+
+def default_scenarios(fixtures):
+    """
+    The read endpoints the web and mobile clients hit most, with the fixtures chosen by benchmark_fixtures().
+    """
+    appraisal_id = fixtures['appraisal_id']
+    year_ago = (timezone.now() - timedelta(days=365)).isoformat()
+    now = timezone.now().isoformat()
+    return [
+        Scenario('appraisal list', 'management', '/api/appraisals/'),
+        Scenario('appraisal list', 'sales', '/api/appraisals/'),
+        Scenario('appraisal list', 'wholesaler', '/api/appraisals/'),
+        Scenario('appraisal list, keyword filter', 'management', '/api/appraisals/', {'filter': 'toyota'}),
+        Scenario('appraisal list, market stats', 'management', '/api/appraisals/', {'market': 'true'}),
+        Scenario('appraisal list, sparse fields', 'management', '/api/appraisals/', {'fields': 'id,status,vehicle_make,vehicle_model'}),
+        Scenario('appraisal detail', 'management', f'/api/appraisals/{appraisal_id}/'),
+        Scenario('appraisal offers', 'management', f'/api/appraisals/{appraisal_id}/offers/'),
+        Scenario('status counts', 'management', '/api/appraisals/status-list/'),
+        Scenario('status counts', 'wholesaler', '/api/appraisals/status-list/'),
+        Scenario('change feed', 'management', '/api/appraisals/changes/'),
+        Scenario('dashboard', 'management', '/api/appraisals/dashboard/', {'from': year_ago, 'to': now}),
+        Scenario('profit and loss', 'management', '/api/appraisals/profit-loss/'),
+        Scenario('best wholesalers', 'management', '/api/appraisals/best-performing-wholesalers/'),
+        Scenario('top car', 'management', '/api/appraisals/top-car/'),
+        Scenario('price guidance', 'management', '/api/appraisals/price-guidance/', fixtures['vehicle']),
+        Scenario('csv export', 'management', '/api/appraisals/csv/', {'start_date': year_ago, 'end_date': now}),
+        Scenario('invites', 'wholesaler', '/api/appraisals/list_invites/'),
+        Scenario('offer analytics', 'wholesaler', '/api/offer/analytics/'),
+        Scenario('friend requests', 'management', '/api/friend-requests/'),
+        Scenario('dealerships', 'management', '/api/dealerships/'),
+    ]
+
+
+def benchmark_fixtures():
+    """
+    Users and objects to benchmark with: the busiest dealership's manager and a sales dealer there, the most active
+    wholesaler, and that dealership's appraisal with the most offers. Returns None when the database has no data.
+    """
+    busiest = (Appraisal.objects.values('dealership_id').annotate(count=Count('id')).order_by('-count').first())
+    wholesaler = WholesalerProfile.objects.annotate(count=Count('offer')).order_by('-count').select_related('user').first()
+    if busiest is None or wholesaler is None:
+        return None
+
+    dealers = DealerProfile.objects.filter(dealerships=busiest['dealership_id']).select_related('user')
+    manager = dealers.filter(role='M').first()
+    sales = dealers.filter(role='S').first()
+    appraisal = (Appraisal.objects.filter(dealership_id=busiest['dealership_id'])
+                 .annotate(count=Count('offers')).order_by('-count').first())
+    if manager is None or sales is None:
+        return None
+    return {
+        'users': {'management': manager.user, 'sales': sales.user, 'wholesaler': wholesaler.user},
+        'appraisal_id': appraisal.id,
+        'vehicle': {'vehicle_make': appraisal.vehicle_make, 'vehicle_model': appraisal.vehicle_model,
+                    'vehicle_year': appraisal.vehicle_year, 'odometer_reading': appraisal.odometer_reading},
+    }
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of a non-empty list
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered) + 0.5) - 1))]
+
+
+def request(client, scenario):
+    response = client.get(scenario.path, scenario.params)
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    return response
+
+
+def measure(client, scenario):
+    """
+    Run one request, reading any streamed body, and return its latency and queries.
+    """
+    counter = QueryCounter()
+    with ExitStack() as stack:
+        for each in connections.all():
+            stack.enter_context(each.execute_wrapper(counter))
+        started = time.perf_counter()
+        response = request(client, scenario)
+        elapsed = time.perf_counter() - started
+    view_class, action = resolve_action(response.wsgi_request)
+    return {
+        'action': f'{view_class.__name__}.{action}' if view_class else action,
+        'status': response.status_code,
+        'latency_ms': elapsed * 1000,
+        'queries': counter.count,
+        'db_time_ms': counter.duration * 1000,
+    }
+
+
+def peak_memory(client, scenario):
+    """
+    KB of Python memory allocated at the peak of one request.
+    """
+    tracemalloc.start()
+    try:
+        request(client, scenario)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024
+
+
+def summarise(scenario, samples, memory):
+    latencies = [sample['latency_ms'] for sample in samples]
+    queries = [sample['queries'] for sample in samples]
+    return {
+        'scenario': scenario.name,
+        'role': scenario.role,
+        'action': samples[-1]['action'],
+        'path': scenario.path,
+        'params': scenario.params,
+        'statuses': sorted({sample['status'] for sample in samples}),
+        'requests': len(samples),
+        'p50_ms': round(percentile(latencies, 0.5), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'mean_ms': round(statistics.fmean(latencies), 2),
+        'max_ms': round(max(latencies), 2),
+        'queries': max(queries),
+        'queries_min': min(queries),
+        'db_time_p50_ms': round(percentile([sample['db_time_ms'] for sample in samples], 0.5), 2),
+        'peak_memory_kb': round(memory, 1),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=settings.BASE_DIR).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(iterations=20, warmup=2, only=None, progress=None):
+    """
+    Time every default scenario (or those whose name or path contains `only`) and return the report.
+    """
+    fixtures = benchmark_fixtures()
+    if fixtures is None:
+        raise ValueError('The database has no appraisals, dealers or wholesalers to benchmark. Run seed_synthetic_data first.')
+
+    clients = {}
+    for role, user in fixtures['users'].items():
+        # Token credentials, so authentication is measured as in production
+        token, _ = Token.objects.get_or_create(user=user)
+        clients[role] = APIClient(raise_request_exception=False)
+        clients[role].credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    results = []
+    # The per-request log lines of QueryBudgetMiddleware would drown the progress output
+    query_log = logging.getLogger('core.queries')
+    log_level = query_log.level
+    query_log.setLevel(logging.WARNING)
+    try:
+        # The test client's host name has to be allowed whatever the settings say
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for scenario in default_scenarios(fixtures):
+                if only and only not in scenario.name and only not in scenario.path:
+                    continue
+                client = clients[scenario.role]
+                for _ in range(warmup):
+                    request(client, scenario)
+                samples = [measure(client, scenario) for _ in range(iterations)]
+                result = summarise(scenario, samples, peak_memory(client, scenario))
+                results.append(result)
+                if progress:
+                    progress(result)
+    finally:
+        query_log.setLevel(log_level)
+
+    return {
+        'revision': git_revision(),
+        'created_at': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'iterations': iterations,
+        'dataset': {
+            'appraisals': Appraisal.objects.count(),
+            'offers': Offer.objects.count(),
+            'dealers': DealerProfile.objects.count(),
+            'wholesalers': WholesalerProfile.objects.count(),
+        },
+        'results': results,
+    }
+
+
+def compare_reports(baseline, report):
+    """
+    Per scenario and role in both reports: the change in p50, p95, queries and peak memory from baseline to report.
+    """
+    before = {(result['scenario'], result['role']): result for result in baseline['results']}
+    changes = []
+    for result in report['results']:
+        previous = before.get((result['scenario'], result['role']))
+        if previous is None:
+            continue
+        changes.append({
+            'scenario': result['scenario'],
+            'role': result['role'],
+            'p50_ms': round(result['p50_ms'] - previous['p50_ms'], 2),
+            'p95_ms': round(result['p95_ms'] - previous['p95_ms'], 2),
+            'queries': result['queries'] - previous['queries'],
+            'peak_memory_kb': round(result['peak_memory_kb'] - previous['peak_memory_kb'], 1),
+        })
+    return changes
@@ -0,0 +1,105 @@
+"""
+Appraisal change feed.
+
+Every write to an appraisal, or to one of its offers (including picking a winner), moves the appraisal to the end
+of the feed by giving it the next value of a single counter row as its `change_seq`. The counter is bumped inside
+the writing transaction, so its row lock orders concurrent writers and sequence numbers become visible in order.
+A client that remembers the last change_seq it saw can ask for everything after it and receive only the delta.
+
+Trashed appraisals (is_active=False) stay in the feed as tombstones. Hard deletes are not recorded.
+"""
+from django.db import transaction
+from django.db.models import Case, F, Prefetch, Value, When
+from django.utils import timezone
+
+from .authentication import get_role_context
+from .exports import APPRAISAL_CSV_HEADERS, appraisal_csv_row, json_keys
+from .models import Appraisal, ChangeCounter, Offer
+
+APPRAISAL_RECORD_KEYS = json_keys(APPRAISAL_CSV_HEADERS)
+
+DEFAULT_CHANGE_LIMIT = 500
+MAX_CHANGE_LIMIT = 5000
+
+
+def next_change_seq(count=1):
+    """
+    Reserve count sequence numbers and return the last of them.
+    """
+    with transaction.atomic():
+        if not ChangeCounter.objects.filter(pk=1).update(value=F('value') + count):
+            ChangeCounter.objects.get_or_create(pk=1)
+            ChangeCounter.objects.filter(pk=1).update(value=F('value') + count)
+        return ChangeCounter.objects.values_list('value', flat=True).get(pk=1)
+
+
+def record_changes(appraisal_ids):
+    """
+    Move the given appraisals to the end of the feed, for writes that do not go through Appraisal.save().
+    """
+    appraisal_ids = sorted(set(appraisal_ids))
+    if not appraisal_ids:
+        return
+    with transaction.atomic():
+        first = next_change_seq(len(appraisal_ids)) - len(appraisal_ids) + 1
+        change_seq = Case(*(When(pk=pk, then=Value(first + offset)) for offset, pk in enumerate(appraisal_ids)))
+        Appraisal.objects.filter(pk__in=appraisal_ids).update(change_seq=change_seq, last_updated=timezone.now())
+
+
+def changed_appraisals(queryset, user, cursor=0, limit=DEFAULT_CHANGE_LIMIT):
+    """
+    Up to limit appraisals of a queryset changed after cursor, oldest change first, with what change_record() reads loaded.
+    """
+    context = get_role_context(user)
+    offers = None
+    if context.is_wholesaler:
+        offers = Offer.objects.filter(user_id=context.wholesaler_profile_id)
+    elif context.is_management:
+        offers = Offer.objects.all()
+
+    queryset = (queryset
+                .filter(change_seq__gt=cursor)
+                .select_related('dealership', 'initiating_dealer__user', 'last_updating_dealer__user')
+                .order_by('change_seq'))
+    if offers is not None:
+        queryset = queryset.prefetch_related(Prefetch('offers', queryset=offers.select_related('user').order_by('id'), to_attr='offer_list'))
+    return list(queryset[:limit])
+
+
+def offer_record(offer):
+    return {
+        'id': offer.id,
+        'wholesaler_id': offer.user_id,
+        'wholesaler': offer.user.wholesaler_name if offer.user else None,
+        'amount': offer.amount,
+        'adjusted_amount': offer.adjusted_amount,
+        'passed': offer.passed,
+        'created_at': offer.created_at,
+        'offer_made_at': offer.offer_made_at,
+        'updated_at': offer.updated_at,
+    }
+
+
+def change_record(appraisal, user):
+    """
+    The feed entry for an appraisal: a tombstone when it is trashed, otherwise its export columns,
+    status, winner and the offers the user may see.
+    """
+    if not appraisal.is_active:
+        return {'id': appraisal.id, 'change_seq': appraisal.change_seq, 'last_updated': appraisal.last_updated, 'deleted': True}
+
+    record = {
+        'id': appraisal.id,
+        'change_seq': appraisal.change_seq,
+        'last_updated': appraisal.last_updated,
+        'deleted': False,
+        'appraisal': dict(zip(APPRAISAL_RECORD_KEYS, appraisal_csv_row(appraisal))),
+    }
+    if get_role_context(user).is_wholesaler:
+        record['status'] = appraisal.wholesaler_status
+    else:
+        record['status'] = appraisal.dealer_status
+        record['winner_offer_id'] = appraisal.winner_id
+    if hasattr(appraisal, 'offer_list'):
+        record['offers'] = [offer_record(offer) for offer in appraisal.offer_list]
+    return record
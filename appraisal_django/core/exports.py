@@ -0,0 +1,375 @@
+"""
+Streaming CSV exports and background export jobs.
+
+Rows are read from the database in chunks and written to the response as they are produced,
+so memory use stays flat however many appraisals are exported and the first bytes go out immediately.
+
+Exports too large for a request are queued as an ExportJob instead. A worker (`manage.py run_export_jobs`,
+or a thread pool in the web process when EXPORT_JOBS_IN_PROCESS is set) writes the file to EXPORT_JOBS_DIR
+in the same chunks, and the client polls the job until it can download the file.
+"""
+import csv
+import json
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q, Subquery
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Appraisal, Comment, ExportJob, Offer
+from .search import filter_appraisals
+
+# Rows fetched from the database per round trip
+EXPORT_CHUNK_SIZE = 2000
+
+APPRAISAL_CSV_HEADERS = [
+    'ID', 'Start Date', 'Last Updated', 'Is Active', 'Dealership', 'Initiating Dealer',
+    'Last Updating Dealer', 'Customer First Name', 'Customer Last Name', 'Customer Email',
+    'Customer Phone', 'Make', 'Model', 'Year', 'VIN', 'Registration', 'Color',
+    'Odometer Reading', 'Engine Type', 'Transmission', 'Body Type', 'Fuel Type',
+    'Reserve Price',
+]
+
+
+class Echo:
+    """
+    File-like object whose write() hands the line back, so csv.writer can produce strings for a generator.
+    """
+
+    def write(self, value):
+        return value
+
+
+def dealer_name(dealer):
+    if dealer is None:
+        return ''
+    return f"{dealer.user.first_name} {dealer.user.last_name}"
+
+
+def appraisal_csv_row(appraisal):
+    return [
+        appraisal.id,
+        appraisal.start_date.isoformat() if appraisal.start_date else '',
+        appraisal.last_updated.isoformat() if appraisal.last_updated else '',
+        appraisal.is_active,
+        appraisal.dealership.dealership_name if appraisal.dealership else '',
+        dealer_name(appraisal.initiating_dealer),
+        dealer_name(appraisal.last_updating_dealer),
+        appraisal.customer_first_name,
+        appraisal.customer_last_name,
+        appraisal.customer_email,
+        appraisal.customer_phone,
+        appraisal.vehicle_make,
+        appraisal.vehicle_model,
+        appraisal.vehicle_year,
+        appraisal.vehicle_vin,
+        appraisal.vehicle_registration,
+        appraisal.color,
+        appraisal.odometer_reading,
+        appraisal.engine_type,
+        appraisal.transmission,
+        appraisal.body_type,
+        appraisal.fuel_type,
+        appraisal.reserve_price,
+    ]
+
+
+def iter_appraisal_csv(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    writer = csv.writer(Echo())
+    yield writer.writerow(APPRAISAL_CSV_HEADERS)
+
+    queryset = queryset.select_related('dealership', 'initiating_dealer__user', 'last_updating_dealer__user')
+    for appraisal in queryset.iterator(chunk_size=chunk_size):
+        yield writer.writerow(appraisal_csv_row(appraisal))
+
+
+def gzip_stream(chunks, batch_size=64 * 1024):
+    """
+    Gzip a stream of text chunks, emitting compressed bytes roughly every batch_size bytes of input.
+    """
+    compressor = zlib.compressobj(wbits=31)  # 31 selects the gzip container
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        pending.append(data)
+        pending_size += len(data)
+        if pending_size >= batch_size:
+            compressed = compressor.compress(b''.join(pending))
+            pending, pending_size = [], 0
+            if compressed:
+                yield compressed
+    yield compressor.compress(b''.join(pending)) + compressor.flush()
+
+
+def stream_appraisal_csv(queryset, filename='appraisals.csv', compress=False):
+    rows = iter_appraisal_csv(queryset)
+    if compress:
+        response = StreamingHttpResponse(gzip_stream(rows), content_type='application/gzip')
+        filename = f'{filename}.gz'
+    else:
+        response = StreamingHttpResponse(rows, content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+OFFER_CSV_HEADERS = [
+    'ID', 'Appraisal ID', 'Dealership', 'Make', 'Model', 'Year', 'Wholesaler', 'Amount',
+    'Adjusted Amount', 'Passed', 'Winner', 'Created At', 'Offer Made At',
+]
+
+COMMENT_CSV_HEADERS = [
+    'ID', 'Appraisal ID', 'Dealership', 'Username', 'Comment', 'Is Private', 'Posted At',
+]
+
+
+def isoformat(value):
+    # None is written as an empty CSV field and as null in NDJSON
+    return value.isoformat() if value else None
+
+
+def offer_csv_row(offer):
+    appraisal = offer.appraisal
+    return [
+        offer.id,
+        appraisal.id,
+        appraisal.dealership.dealership_name if appraisal.dealership else '',
+        appraisal.vehicle_make,
+        appraisal.vehicle_model,
+        appraisal.vehicle_year,
+        offer.user.wholesaler_name if offer.user else '',
+        offer.amount,
+        offer.adjusted_amount,
+        offer.passed,
+        appraisal.winner_id == offer.id,
+        isoformat(offer.created_at),
+        isoformat(offer.offer_made_at),
+    ]
+
+
+def comment_csv_row(comment):
+    return [
+        comment.id,
+        comment.appraisal_id,
+        comment.appraisal.dealership.dealership_name if comment.appraisal.dealership else '',
+        comment.user.username,
+        comment.comment,
+        comment.is_private,
+        isoformat(comment.comment_date_time),
+    ]
+
+
+def json_keys(headers):
+    # NDJSON and change feed keys for the CSV headers, e.g. 'Start Date' -> 'start_date'
+    return [header.lower().replace(' ', '_') for header in headers]
+
+
+def export_settings():
+    return {
+        'directory': getattr(settings, 'EXPORT_JOBS_DIR', os.path.join(settings.BASE_DIR, 'exports')),
+        'workers': getattr(settings, 'EXPORT_JOBS_WORKERS', 2),
+        'per_dealership': getattr(settings, 'EXPORT_JOBS_PER_DEALERSHIP', 2),
+        'retention': timedelta(hours=getattr(settings, 'EXPORT_JOBS_RETENTION_HOURS', 24)),
+        'timeout': timedelta(minutes=getattr(settings, 'EXPORT_JOBS_TIMEOUT_MINUTES', 60)),
+    }
+
+
+def export_slots_taken(dealership_ids):
+    """
+    Queued or running export jobs covering each of the given dealerships.
+    """
+    taken = dict.fromkeys(dealership_ids, 0)
+    jobs = (ExportJob.dealerships.through.objects
+            .filter(dealership_id__in=dealership_ids, exportjob__status__in=ExportJob.ACTIVE_STATUSES)
+            .values_list('dealership_id', flat=True))
+    for dealership_id in jobs:
+        taken[dealership_id] += 1
+    return taken
+
+
+def job_appraisals(job):
+    """
+    The appraisals an export job covers: what download_csv returns to the requester with the job's filters.
+    """
+    user = job.requested_by
+    filters = job.filters
+
+    if hasattr(user, 'wholesalerprofile'):
+        appraisals = Appraisal.objects.with_wholesaler_status(user.wholesalerprofile).filter(own_offer_id__isnull=False)
+        status_field = 'wholesaler_status'
+    elif hasattr(user, 'dealerprofile'):
+        # The dealerships picked when the job was created, less any the dealer has since left
+        appraisals = Appraisal.objects.filter(
+            dealership_id__in=Subquery(job.dealerships.values('id')),
+        ).filter(dealership_id__in=Subquery(user.dealerprofile.dealerships.values('id')))
+        status_field = 'dealer_status'
+    else:
+        return Appraisal.objects.none()
+
+    if filters.get('dealership_id'):
+        appraisals = appraisals.filter(dealership_id=filters['dealership_id'])
+    if filters.get('user_id'):
+        appraisals = appraisals.filter(Q(initiating_dealer__user__id=filters['user_id']) | Q(last_updating_dealer__user__id=filters['user_id']))
+
+    appraisals = filter_appraisals(appraisals, filters.get('filter', []), status_field)
+
+    start_date = parse_datetime(filters['start_date']) if filters.get('start_date') else None
+    end_date = parse_datetime(filters['end_date']) if filters.get('end_date') else None
+    if start_date and end_date:
+        appraisals = appraisals.filter(start_date__range=(start_date, end_date))
+    return appraisals
+
+
+def iter_appraisal_id_chunks(appraisals, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    The ids of an appraisal queryset in lists of up to chunk_size.
+    The ids are read rather than used as a subquery, since search annotations are raw SQL on the outer table.
+    """
+    chunk = []
+    for appraisal_id in appraisals.order_by('id').values_list('id', flat=True).iterator(chunk_size=chunk_size):
+        chunk.append(appraisal_id)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_job_rows(job, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    The header and row lists of an export job, read in chunks.
+    """
+    user = job.requested_by
+    appraisals = job_appraisals(job)
+
+    if job.kind == 'appraisals':
+        yield APPRAISAL_CSV_HEADERS
+        queryset = appraisals.select_related('dealership', 'initiating_dealer__user', 'last_updating_dealer__user')
+        if 'search_rank' not in queryset.query.annotations:
+            queryset = queryset.order_by('-start_date', '-id')
+        for appraisal in queryset.iterator(chunk_size=chunk_size):
+            yield appraisal_csv_row(appraisal)
+        return
+
+    if job.kind == 'offers':
+        headers, row = OFFER_CSV_HEADERS, offer_csv_row
+        queryset = Offer.objects.select_related('appraisal__dealership', 'user')
+        if hasattr(user, 'wholesalerprofile'):
+            queryset = queryset.filter(user=user.wholesalerprofile)
+        elif not (hasattr(user, 'dealerprofile') and user.dealerprofile.role == 'M'):
+            # Offers are only shown to management
+            queryset = queryset.none()
+    else:
+        headers, row = COMMENT_CSV_HEADERS, comment_csv_row
+        queryset = Comment.objects.select_related('appraisal__dealership', 'user')
+        if hasattr(user, 'wholesalerprofile'):
+            queryset = queryset.filter(is_private=False)
+
+    yield headers
+    for appraisal_ids in iter_appraisal_id_chunks(appraisals, chunk_size):
+        for instance in queryset.filter(appraisal_id__in=appraisal_ids).order_by('appraisal_id', 'id'):
+            yield row(instance)
+
+
+def write_job_file(job, file, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Write an export job's rows to an open text file, recording progress on the job after every chunk.
+    Returns the number of rows written.
+    """
+    rows = iter_job_rows(job, chunk_size)
+    headers = next(rows)
+    if job.format == 'ndjson':
+        keys = json_keys(headers)
+
+        def write(row):
+            file.write(json.dumps(dict(zip(keys, row)), default=str) + '\n')
+    else:
+        writer = csv.writer(file)
+        writer.writerow(headers)
+        write = writer.writerow
+
+    count = 0
+    for row in rows:
+        write(row)
+        count += 1
+        if count % chunk_size == 0:
+            ExportJob.objects.filter(pk=job.pk).update(row_count=count)
+    return count
+
+
+def run_export_job(job_id):
+    """
+    Claim a queued export job and write its file. Returns False when the job was not queued (e.g. another worker took it).
+    """
+    claimed = ExportJob.objects.filter(pk=job_id, status='queued').update(status='running', started_at=timezone.now())
+    if not claimed:
+        return False
+
+    job = ExportJob.objects.select_related('requested_by').get(pk=job_id)
+    directory = export_settings()['directory']
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, job.filename)
+    partial_path = f'{path}.part'  # Renamed into place once complete, so a download never sees half a file
+
+    try:
+        with open(partial_path, 'w', newline='', encoding='utf-8') as file:
+            count = write_job_file(job, file)
+        os.replace(partial_path, path)
+    except Exception as error:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        ExportJob.objects.filter(pk=job.pk).update(status='failed', error=str(error) or error.__class__.__name__, finished_at=timezone.now())
+        return True
+
+    ExportJob.objects.filter(pk=job.pk).update(
+        status='complete', row_count=count, file_path=path, file_size=os.path.getsize(path), finished_at=timezone.now())
+    return True
+
+
+def expire_export_jobs():
+    """
+    Delete the files of exports finished longer ago than the retention period, and fail jobs running past the timeout.
+    """
+    options = export_settings()
+    now = timezone.now()
+
+    expired = ExportJob.objects.filter(status='complete', finished_at__lt=now - options['retention'])
+    for job in expired:
+        if job.file_path and os.path.exists(job.file_path):
+            os.remove(job.file_path)
+    expired.update(status='expired', file_path='')
+
+    ExportJob.objects.filter(status='running', started_at__lt=now - options['timeout']).update(
+        status='failed', error='The export timed out.', finished_at=now)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def run_in_thread(job_id):
+    try:
+        run_export_job(job_id)
+        expire_export_jobs()
+    finally:
+        connections.close_all()
+
+
+def submit_export_job(job):
+    """
+    Run a job on the web process's thread pool when EXPORT_JOBS_IN_PROCESS is set; otherwise a worker picks it up.
+    """
+    global _executor
+    if not getattr(settings, 'EXPORT_JOBS_IN_PROCESS', False):
+        return
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=export_settings()['workers'], thread_name_prefix='export')
+    _executor.submit(run_in_thread, job.id)
@@ -0,0 +1,192 @@
+"""
+Bulk appraisal imports.
+
+An uploaded CSV or NDJSON file is read a row at a time and handled in batches. Each batch is validated with a
+single AppraisalImportSerializer, then its valid rows are written in one transaction with bulk_create for the
+appraisals and their damages, which also updates the search index and change feed. The daily rollups are
+recomputed once, after the last batch.
+Invalid rows are skipped and reported by row number, so one bad line does not hold up the rest of the file.
+A file that is not UTF-8 is imported up to the undecodable bytes and reported with a file-level error (row None).
+
+CSV files may use the headers of the appraisal export ('Customer First Name', 'Make', ...) or the field names,
+with damages as a JSON list in a `damages` column.
+"""
+import csv
+import io
+import json
+
+from django.db import transaction
+from rest_framework import serializers
+
+from .analytics import refresh_rollups
+from .changes import next_change_seq
+from .exports import json_keys
+from .models import Appraisal, Damage
+from .search import get_search_backend
+from .serializers import AppraisalImportSerializer
+
+IMPORT_BATCH_SIZE = 1000
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+# Export column names that differ from the field they hold
+COLUMN_ALIASES = {
+    'make': 'vehicle_make',
+    'model': 'vehicle_model',
+    'year': 'vehicle_year',
+    'vin': 'vehicle_vin',
+    'registration': 'vehicle_registration',
+}
+
+
+def detect_format(filename):
+    return 'ndjson' if filename.lower().endswith(('.ndjson', '.jsonl')) else 'csv'
+
+
+def iter_rows(file, file_format):
+    """
+    (row_number, dict) for each row of a binary file, numbered from 1 after any header. Unparseable rows yield an error string.
+    A file that is not UTF-8 ends with a file-level error, numbered None.
+    """
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    rows = iter_ndjson_rows(text) if file_format == 'ndjson' else iter_csv_rows(text)
+    row_number = 0
+    try:
+        for row_number, row in rows:
+            yield row_number, row
+    except UnicodeDecodeError:
+        # Text is decoded a chunk at a time, so the bad bytes are somewhere after the last row read
+        yield None, f'The file is not UTF-8 encoded, so the rows after row {row_number} could not be read. Save it as UTF-8 and import them again.'
+
+
+def iter_ndjson_rows(text):
+    row_number = 0
+    for line in text:
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield row_number, f'Invalid JSON: {error}'
+            continue
+        yield row_number, row if isinstance(row, dict) else 'Each line must be a JSON object.'
+
+
+def iter_csv_rows(text):
+    reader = csv.reader(text)
+    header = next(reader, None)
+    if header is None:
+        return
+    keys = json_keys(header)
+    for row_number, values in enumerate(reader, start=1):
+        yield row_number, dict(zip(keys, values))
+
+
+def normalise_row(row):
+    """
+    Map export column names onto field names, drop blank cells and decode a JSON damages cell.
+    """
+    data = {}
+    for key, value in row.items():
+        key = COLUMN_ALIASES.get(key, key)
+        if value is None or value == '':
+            continue
+        if key == 'damages' and isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                raise serializers.ValidationError({'damages': ['Must be a JSON list of damages.']})
+        data[key] = value
+    return data
+
+
+class AppraisalImport:
+    """
+    Imports appraisals into one dealership on behalf of one dealer and collects a report of the rows that failed.
+    """
+
+    def __init__(self, dealership, dealer, batch_size=IMPORT_BATCH_SIZE):
+        self.dealership = dealership
+        self.dealer = dealer
+        self.batch_size = batch_size
+        self.validator = AppraisalImportSerializer()
+        self.imported = 0
+        self.errors = []
+        self.rollup_keys = set()
+
+    def validate(self, row_number, row):
+        if isinstance(row, str):
+            self.errors.append({'row': row_number, 'errors': {'non_field_errors': [row]}})
+            return None
+        try:
+            return self.validator.run_validation(normalise_row(row))
+        except serializers.ValidationError as error:
+            self.errors.append({'row': row_number, 'errors': error.detail})
+            return None
+
+    def write(self, rows):
+        """
+        Insert a batch of validated rows in one transaction.
+        """
+        appraisals = []
+        damages = []
+        for data in rows:
+            damages.append(data.pop('damages', []))
+            appraisal = Appraisal(dealership=self.dealership, initiating_dealer=self.dealer, last_updating_dealer=self.dealer, **data)
+            appraisal.dealer_status = appraisal.compute_dealer_status()
+            appraisals.append(appraisal)
+
+        with transaction.atomic():
+            first_seq = next_change_seq(len(appraisals)) - len(appraisals) + 1
+            for offset, appraisal in enumerate(appraisals):
+                appraisal.change_seq = first_seq + offset
+            start_dates = [appraisal.start_date for appraisal in appraisals]
+
+            # start_date is auto_now_add, so bulk_create stamps every row with now; put back the imported dates after
+            Appraisal.objects.bulk_create(appraisals, batch_size=self.batch_size)
+            restored = []
+            for appraisal, start_date in zip(appraisals, start_dates):
+                if start_date is not None:
+                    appraisal.start_date = start_date
+                    restored.append(appraisal)
+            if restored:
+                # Small batches keep the CASE expression bulk_update builds cheap to evaluate
+                Appraisal.objects.bulk_update(restored, ['start_date'], batch_size=100)
+
+            Damage.objects.bulk_create(
+                [Damage(appraisal=appraisal, **damage) for appraisal, appraisal_damages in zip(appraisals, damages) for damage in appraisal_damages],
+                batch_size=self.batch_size,
+            )
+            get_search_backend().index(appraisals)
+
+        self.rollup_keys.update(appraisal.get_rollup_key() for appraisal in appraisals)
+
+        self.imported += len(appraisals)
+
+    def run(self, rows):
+        """
+        Import an iterable of (row_number, row) pairs. Returns the report.
+        """
+        batch = []
+        try:
+            for row_number, row in rows:
+                data = self.validate(row_number, row)
+                if data is not None:
+                    batch.append(data)
+                if len(batch) >= self.batch_size:
+                    self.write(batch)
+                    batch = []
+            if batch:
+                self.write(batch)
+        finally:
+            # Cover every batch written, even if a later one failed
+            refresh_rollups(self.rollup_keys)
+        return self.report()
+
+    def report(self):
+        return {'imported': self.imported, 'failed': len(self.errors), 'errors': self.errors}
+
+
+def import_appraisals(file, dealership, dealer, file_format='csv', batch_size=IMPORT_BATCH_SIZE):
+    return AppraisalImport(dealership, dealer, batch_size).run(iter_rows(file, file_format))
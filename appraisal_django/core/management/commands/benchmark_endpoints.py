@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from core.benchmarks import compare_reports, run_benchmarks
+
+class Command(BaseCommand):
+    help = 'Benchmarks the API endpoints in-process, reporting latency, queries and peak memory per action as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per scenario.')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per scenario before timing.')
+        parser.add_argument('--only', help='Run only the scenarios whose name or path contains this text.')
+        parser.add_argument('--output', default='benchmark.json', help='File the JSON report is written to.')
+        parser.add_argument('--compare', help='Earlier report to compare against, e.g. from another branch.')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1.')
+
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as file:
+                baseline = json.load(file)
+
+        def progress(result):
+            self.stdout.write(
+                f"{result['scenario']} [{result['role']}] {result['action']}: p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, "
+                f"{result['queries']} queries, {result['peak_memory_kb']} KB peak"
+            )
+
+        try:
+            report = run_benchmarks(options['iterations'], options['warmup'], options['only'], progress)
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        if baseline is not None:
+            report['compared_to'] = baseline.get('revision')
+            report['changes'] = compare_reports(baseline, report)
+            for change in report['changes']:
+                self.stdout.write(
+                    f"{change['scenario']} [{change['role']}]: p50 {change['p50_ms']:+} ms, p95 {change['p95_ms']:+} ms, "
+                    f"queries {change['queries']:+}, peak memory {change['peak_memory_kb']:+} KB"
+                )
+
+        with open(options['output'], 'w') as file:
+            json.dump(report, file, indent=2)
+
+        self.stdout.write(self.style.SUCCESS(f"Successfully benchmarked {len(report['results'])} scenarios into {options['output']}."))
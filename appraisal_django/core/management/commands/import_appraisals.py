@@ -0,0 +1,40 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from core.imports import IMPORT_BATCH_SIZE, IMPORT_FORMATS, detect_format, import_appraisals
+from core.models import DealerProfile, Dealership
+
+class Command(BaseCommand):
+    help = 'Imports appraisals in bulk from a CSV or NDJSON file into a dealership.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or NDJSON file to import.')
+        parser.add_argument('--dealership', type=int, required=True, help='ID of the dealership to import into.')
+        parser.add_argument('--dealer', required=True, help='Username of the dealer recorded as initiating the appraisals.')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='File format (default: from the file extension).')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='Rows validated and written per transaction.')
+        parser.add_argument('--errors', help='Write the per-row error report to this file as NDJSON.')
+
+    def handle(self, *args, **options):
+        try:
+            dealership = Dealership.objects.get(id=options['dealership'])
+            dealer = DealerProfile.objects.get(user__username=options['dealer'])
+        except (Dealership.DoesNotExist, DealerProfile.DoesNotExist) as error:
+            raise CommandError(str(error))
+        if not dealer.dealerships.filter(id=dealership.id).exists():
+            raise CommandError(f"Dealer {options['dealer']} does not belong to dealership {dealership.id}.")
+
+        file_format = options['format'] or detect_format(options['path'])
+        with open(options['path'], 'rb') as file:
+            report = import_appraisals(file, dealership, dealer, file_format, options['batch_size'])
+
+        if options['errors']:
+            with open(options['errors'], 'w') as errors:
+                for error in report['errors']:
+                    errors.write(json.dumps(error) + '\n')
+        else:
+            for error in report['errors']:
+                where = f"Row {error['row']}" if error['row'] is not None else 'File'
+                self.stderr.write(f"{where}: {json.dumps(error['errors'])}")
+
+        self.stdout.write(self.style.SUCCESS(f"Successfully imported {report['imported']} appraisals ({report['failed']} rows failed)."))
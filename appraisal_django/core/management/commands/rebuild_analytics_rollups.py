@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from core.analytics import rebuild_rollups
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily analytics rollup tables from the appraisal and offer tables, in batches of days.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-days', type=int, default=31, help='Number of days of appraisals to rebuild per transaction.')
+
+    def handle(self, *args, **options):
+        batches = 0
+        for first_day, last_day in rebuild_rollups(batch_days=options['batch_days']):
+            batches += 1
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Rebuilt {first_day} to {last_day}')
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt the analytics rollups ({batches} batches).'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from core.search import get_search_backend
+
+class Command(BaseCommand):
+    help = 'Rebuilds the appraisal keyword search index from the appraisal table.'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.rebuild()
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt the search index ({type(backend).__name__}).'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from core.analytics import rebuild_leaderboard
+
+class Command(BaseCommand):
+    help = 'Recounts the wholesaler leaderboard from the winning offers of every appraisal.'
+
+    def handle(self, *args, **options):
+        count = rebuild_leaderboard()
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt the wholesaler leaderboard ({count} rows).'))
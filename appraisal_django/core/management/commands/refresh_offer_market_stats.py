@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from core.market import refresh_market_stats
+
+class Command(BaseCommand):
+    help = 'Recomputes the offer market statistics for buckets with offers updated since the last run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every bucket instead of only the changed ones.')
+
+    def handle(self, *args, **options):
+        count = refresh_market_stats(full=options['full'])
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully refreshed the offer market statistics ({count} buckets).'))
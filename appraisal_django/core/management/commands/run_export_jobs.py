@@ -0,0 +1,46 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from core.exports import expire_export_jobs, export_settings, run_export_job
+from core.models import ExportJob
+
+class Command(BaseCommand):
+    help = 'Runs queued export jobs, writing their files to EXPORT_JOBS_DIR.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Jobs to run at once (default: EXPORT_JOBS_WORKERS).')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to wait between checks for new jobs.')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty instead of waiting for new jobs.')
+
+    def run(self, job_id):
+        try:
+            return run_export_job(job_id)
+        finally:
+            connections.close_all()
+
+    def handle(self, *args, **options):
+        workers = options['workers'] or export_settings()['workers']
+        completed = 0
+        running = set()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                expire_export_jobs()
+
+                # Oldest first, only as many as there are free workers
+                free = workers - len(running)
+                job_ids = list(ExportJob.objects.filter(status='queued').order_by('created_at').values_list('id', flat=True)[:free]) if free else []
+                running.update(executor.submit(self.run, job_id) for job_id in job_ids)
+
+                if not running:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                done, running = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                completed += sum(1 for future in done if future.result())
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully ran {completed} export jobs.'))
@@ -0,0 +1,39 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from core.seeding import SEED_PASSWORD, seed_synthetic_data
+
+class Command(BaseCommand):
+    help = 'Bulk-creates a synthetic dataset with skewed, production-like distributions for local load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dealerships', type=int, default=20, help='Dealerships to create.')
+        parser.add_argument('--dealers', type=int, default=8, help='Dealers per dealership, one of them in management.')
+        parser.add_argument('--wholesalers', type=int, default=200, help='Wholesalers to create.')
+        parser.add_argument('--appraisals', type=int, default=20000, help='Appraisals to create.')
+        parser.add_argument('--offers', type=float, default=4.0, help='Mean offers and invites per appraisal.')
+        parser.add_argument('--comments', type=float, default=1.5, help='Mean comments per appraisal.')
+        parser.add_argument('--damages', type=float, default=1.0, help='Mean damages per appraisal.')
+        parser.add_argument('--friend-requests', type=int, default=500, help='Friend requests to create.')
+        parser.add_argument('--days', type=int, default=365, help='Days of history the appraisals are spread over.')
+        parser.add_argument('--prefix', default='synthetic', help='Prefix of the usernames and dealership names created.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; the same options and seed give the same data.')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Appraisals written per transaction.')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=f"{options['prefix']}_").exists():
+            raise CommandError(f"Synthetic users with the prefix '{options['prefix']}' already exist. Use another --prefix.")
+        if min(options['dealerships'], options['dealers'], options['wholesalers'], options['batch_size']) < 1 or options['days'] < 1:
+            raise CommandError('--dealerships, --dealers, --wholesalers, --days and --batch-size must be at least 1.')
+        if min(options['offers'], options['comments'], options['damages']) < 0:
+            raise CommandError('--offers, --comments and --damages cannot be negative.')
+
+        counts = seed_synthetic_data(
+            progress=self.stdout.write,
+            dealerships=options['dealerships'], dealers=options['dealers'], wholesalers=options['wholesalers'],
+            appraisals=options['appraisals'], offers=options['offers'], comments=options['comments'],
+            damages=options['damages'], friend_requests=options['friend_requests'], days=options['days'],
+            prefix=options['prefix'], seed=options['seed'], batch_size=options['batch_size'],
+        )
+
+        summary = ', '.join(f'{count} {name.replace("_", " ")}' for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Successfully seeded {summary}. Users log in with the password '{SEED_PASSWORD}'."))
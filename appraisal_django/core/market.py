@@ -0,0 +1,190 @@
+"""
+Offer market statistics.
+
+OfferMarketStats holds the distribution of offer amounts per make, model, year and odometer band.
+`manage.py refresh_offer_market_stats` recomputes only the buckets with offers or appraisals updated since its last run,
+so requests compare an offer against the market with a single indexed lookup. Deleted offers and appraisals that
+change make, model, year or odometer are only reflected by a --full run.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import JSONField, Max, OuterRef, Q, Subquery, Value
+from django.db.models.functions import JSONObject, Least, Lower
+from django.utils import timezone
+
+from .models import Offer, OfferMarketStats
+
+STATS_FIELDS = (
+    'submitted_count', 'submitted_mean', 'submitted_p25', 'submitted_p50', 'submitted_p75',
+    'winning_count', 'winning_mean', 'winning_p50', 'trend',
+)
+
+# Window of recent offers compared against older ones for the trend
+TREND_WINDOW = timedelta(days=90)
+MIN_TREND_SAMPLE = 3
+
+OFFER_BUCKET_COLUMNS = (
+    'appraisal__vehicle_make', 'appraisal__vehicle_model', 'appraisal__vehicle_year', 'appraisal__odometer_reading',
+)
+
+
+def odometer_band(odometer):
+    return min(max(odometer or 0, 0) // OfferMarketStats.ODOMETER_BAND_SIZE, OfferMarketStats.MAX_ODOMETER_BAND)
+
+
+def bucket_key(make, model, year, odometer):
+    return ((make or '').lower(), (model or '').lower(), year, odometer_band(odometer))
+
+
+def bucket_filter(key, prefix='appraisal__'):
+    make, model, year, band = key
+    condition = Q(**{
+        f'{prefix}vehicle_make__iexact': make,
+        f'{prefix}vehicle_model__iexact': model,
+        f'{prefix}vehicle_year': year,
+        f'{prefix}odometer_reading__gte': band * OfferMarketStats.ODOMETER_BAND_SIZE,
+    })
+    if band < OfferMarketStats.MAX_ODOMETER_BAND:
+        condition &= Q(**{f'{prefix}odometer_reading__lt': (band + 1) * OfferMarketStats.ODOMETER_BAND_SIZE})
+    return condition
+
+
+def percentile(values, fraction):
+    # Linear interpolation between the closest ranks of a sorted list
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * Decimal(position - lower)
+
+
+def mean(values):
+    return sum(values) / len(values) if values else None
+
+
+def money(value):
+    return value.quantize(Decimal('0.01')) if value is not None else None
+
+
+def compute_stats(offers, offers_as_of):
+    """
+    Unsaved OfferMarketStats rows for every bucket the offers fall into.
+    """
+    buckets = {}
+    recent_since = offers_as_of - TREND_WINDOW
+    rows = offers.values_list(*OFFER_BUCKET_COLUMNS, 'amount', 'adjusted_amount', 'appraisal__winner_id', 'id', 'created_at')
+    for make, model, year, odometer, amount, adjusted_amount, winner_id, offer_id, created_at in rows.iterator(chunk_size=2000):
+        bucket = buckets.setdefault(bucket_key(make, model, year, odometer), {'submitted': [], 'winning': [], 'recent': [], 'earlier': []})
+        value = adjusted_amount if adjusted_amount is not None else amount
+        bucket['submitted'].append(value)
+        if winner_id == offer_id:
+            bucket['winning'].append(value)
+        bucket['recent' if created_at >= recent_since else 'earlier'].append(value)
+
+    stats = []
+    for (make, model, year, band), bucket in buckets.items():
+        submitted = sorted(bucket['submitted'])
+        trend = None
+        if len(bucket['recent']) >= MIN_TREND_SAMPLE and len(bucket['earlier']) >= MIN_TREND_SAMPLE:
+            earlier = mean(bucket['earlier'])
+            if earlier:
+                trend = round(float(mean(bucket['recent']) / earlier - 1), 4)
+        stats.append(OfferMarketStats(
+            vehicle_make=make, vehicle_model=model, vehicle_year=year, odometer_band=band,
+            submitted_count=len(submitted),
+            submitted_mean=money(mean(submitted)),
+            submitted_p25=money(percentile(submitted, 0.25)),
+            submitted_p50=money(percentile(submitted, 0.5)),
+            submitted_p75=money(percentile(submitted, 0.75)),
+            winning_count=len(bucket['winning']),
+            winning_mean=money(mean(bucket['winning'])),
+            winning_p50=money(percentile(sorted(bucket['winning']), 0.5)) if bucket['winning'] else None,
+            trend=trend,
+            offers_as_of=offers_as_of,
+        ))
+    return stats
+
+
+def refresh_market_stats(full=False, batch_size=200):
+    """
+    Recompute the buckets with offers updated since the previous run, or every bucket when full.
+    Returns the number of buckets recomputed.
+    """
+    offers_as_of = timezone.now()
+    priced = Offer.objects.filter(amount__isnull=False, appraisal__is_active=True)
+
+    watermark = None if full else OfferMarketStats.objects.aggregate(watermark=Max('offers_as_of'))['watermark']
+    if watermark is None:
+        with transaction.atomic():
+            OfferMarketStats.objects.all().delete()
+            stats = compute_stats(priced.filter(updated_at__lt=offers_as_of), offers_as_of)
+            OfferMarketStats.objects.bulk_create(stats, batch_size=1000)
+        return len(stats)
+
+    # Offers edited since the last run, and offers on appraisals saved since (e.g. a new winner)
+    changed = (Offer.objects
+               .filter(Q(updated_at__gte=watermark) | Q(appraisal__last_updated__gte=watermark))
+               .values_list(*OFFER_BUCKET_COLUMNS)
+               .distinct())
+    keys = sorted({bucket_key(*row) for row in changed})
+    for start in range(0, len(keys), batch_size):
+        batch = keys[start:start + batch_size]
+        stats_filter = Q()
+        offers_filter = Q()
+        for key in batch:
+            make, model, year, band = key
+            stats_filter |= Q(vehicle_make=make, vehicle_model=model, vehicle_year=year, odometer_band=band)
+            offers_filter |= bucket_filter(key)
+        with transaction.atomic():
+            OfferMarketStats.objects.filter(stats_filter).delete()
+            OfferMarketStats.objects.bulk_create(compute_stats(priced.filter(offers_filter, updated_at__lt=offers_as_of), offers_as_of))
+    return len(keys)
+
+
+def market_stats_subquery():
+    """
+    Annotation for an Appraisal queryset holding its bucket's statistics as a dict, or None.
+    """
+    band = Least(OuterRef('odometer_reading') / OfferMarketStats.ODOMETER_BAND_SIZE, Value(OfferMarketStats.MAX_ODOMETER_BAND))
+    stats = OfferMarketStats.objects.filter(
+        vehicle_make=Lower(OuterRef('vehicle_make')),
+        vehicle_model=Lower(OuterRef('vehicle_model')),
+        vehicle_year=OuterRef('vehicle_year'),
+        odometer_band=band,
+    ).values(data=JSONObject(**{field: field for field in STATS_FIELDS}))[:1]
+    return Subquery(stats, output_field=JSONField())
+
+
+def market_stats_for(appraisal):
+    """
+    The statistics of one appraisal's bucket as a dict, or None.
+    """
+    make, model, year, band = bucket_key(appraisal.vehicle_make, appraisal.vehicle_model, appraisal.vehicle_year, appraisal.odometer_reading)
+    return (OfferMarketStats.objects
+            .filter(vehicle_make=make, vehicle_model=model, vehicle_year=year, odometer_band=band)
+            .values(*STATS_FIELDS)
+            .first())
+
+
+def compare_to_market(amount, stats):
+    """
+    Where an offer amount sits in its bucket's distribution of offers.
+    """
+    if amount is None or not stats or not stats['submitted_count']:
+        return None
+
+    amount = float(amount)
+    p25, p50, p75 = (float(stats[field]) for field in ('submitted_p25', 'submitted_p50', 'submitted_p75'))
+    if amount < p25:
+        position = 'below'
+    elif amount > p75:
+        position = 'above'
+    else:
+        position = 'within'
+    return {
+        'position': position,  # Against the middle half of offers on comparable vehicles
+        'difference_from_median': round(amount - p50, 2),
+        'percent_from_median': round((amount / p50 - 1) * 100, 1) if p50 else None,
+        'sample_size': stats['submitted_count'],
+    }
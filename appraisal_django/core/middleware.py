@@ -0,0 +1,178 @@
+"""
+Request instrumentation: per-request SQL query budgets, and opt-in profiling (see core.profiling).
+
+QueryBudgetMiddleware counts the queries each request runs and the time spent in the database, returns them in the
+X-DB-Query-Count and X-DB-Time-Ms headers, and logs one JSON line per request to the `core.queries` logger keyed by
+viewset and action (e.g. `AppraisalViewSet.list`). A viewset declares what its actions may cost:
+
+    query_budgets = {'list': 8, 'retrieve': 7}
+
+A request over its action's budget logs a warning, or raises QueryBudgetExceeded when QUERY_BUDGET_STRICT is set,
+so a regression fails the test suite instead of surfacing under load. Queries run while a streaming response is
+iterated happen after the middleware returns and are not counted. Queries of the worker threads started by
+run_concurrently (core.viewsets) are, since it installs the request's wrappers on their connections.
+"""
+import cProfile
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils import timezone
+from rest_framework import exceptions
+
+from .authentication import CachedTokenAuthentication
+from .profiling import QueryTimeline, profiling_settings, save_profile
+
+logger = logging.getLogger('core.queries')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryCounter:
+    """
+    Execute wrapper counting the queries run on a connection and the seconds spent running them.
+    Safe to share between threads.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self.lock:
+                self.duration += time.perf_counter() - started
+                self.count += 1
+
+
+def resolve_action(request):
+    """
+    The viewset class and action name that handled a request, or (None, view name) for a plain Django view.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None, None
+    view_class = getattr(match.func, 'cls', None)
+    actions = getattr(match.func, 'actions', None)
+    if view_class is None or not actions:
+        return None, match.view_name
+    return view_class, actions.get(request.method.lower())
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_BUDGET_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+
+        view_class, action = resolve_action(request)
+        key = f'{view_class.__name__}.{action}' if view_class else action
+        budget = getattr(view_class, 'query_budgets', {}).get(action) if view_class else None
+
+        response['X-DB-Query-Count'] = str(counter.count)
+        response['X-DB-Time-Ms'] = f'{counter.duration * 1000:.2f}'
+
+        record = {
+            'action': key,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': counter.count,
+            'db_time_ms': round(counter.duration * 1000, 2),
+            'budget': budget,
+        }
+        if budget is not None and counter.count > budget:
+            message = f'{key} ran {counter.count} queries, over its budget of {budget}'
+            if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(json.dumps({**record, 'over_budget': True}))
+        else:
+            logger.info(json.dumps(record))
+        return response
+
+
+def request_user(request):
+    """
+    The user making a request before the view has run: the session user, or the owner of its API token.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user
+    try:
+        # Tokens are cached, so the view authenticates this one again for free
+        credentials = CachedTokenAuthentication().authenticate(request)
+    except exceptions.AuthenticationFailed:
+        return None
+    return credentials[0] if credentials else None
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the requests staff ask for with an `X-Profile: 1` header or `profile=1` query parameter.
+    The response carries the stored profile's id in X-Profile-Id.
+    """
+    def __init__(self, get_response):
+        if not profiling_settings()['enabled']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def wants_profile(self, request):
+        if request.headers.get('X-Profile') != '1' and request.GET.get('profile') != '1':
+            return False
+        if random.random() >= profiling_settings()['sample_rate']:
+            return False
+        user = request_user(request)
+        return user is not None and user.is_staff
+
+    def __call__(self, request):
+        if not self.wants_profile(request):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        timeline = QueryTimeline(started)
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timeline))
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        duration = time.perf_counter() - started
+
+        view_class, action = resolve_action(request)
+        user = getattr(request, 'user', None)
+        profile_id = save_profile(profiler, {
+            'action': f'{view_class.__name__}.{action}' if view_class else action,
+            'method': request.method,
+            'path': request.path,
+            'query_string': request.META.get('QUERY_STRING', ''),
+            'status': response.status_code,
+            'user': user.get_username() if user is not None and user.is_authenticated else None,
+            'created_at': timezone.now().isoformat(),
+            'duration_ms': round(duration * 1000, 3),
+            'queries': len(timeline.queries),
+            'db_time_ms': round(sum(query['duration_ms'] for query in timeline.queries), 3),
+            'sql': timeline.queries,
+        })
+        response['X-Profile-Id'] = profile_id
+        return response
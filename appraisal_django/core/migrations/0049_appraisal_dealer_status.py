@@ -0,0 +1,36 @@
+# Generated by Django 5.0.14 on 2026-10-18 10:15
+
+from django.db import migrations, models
+from django.db.models import Case, When, Value, Exists, OuterRef
+
+
+def backfill_dealer_status(apps, schema_editor):
+    Appraisal = apps.get_model('core', 'Appraisal')
+    Offer = apps.get_model('core', 'Offer')
+    Appraisal.objects.update(dealer_status=Case(
+        When(is_active=False, then=Value('Trashed')),
+        When(winner__isnull=False, then=Value('Complete')),
+        When(Exists(Offer.objects.filter(appraisal=OuterRef('pk'))), then=Value('Active')),
+        When(ready_for_management=True, then=Value('Pending - Management')),
+        default=Value('Pending - Sales'),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0048_offer_offer_made_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appraisal',
+            name='dealer_status',
+            field=models.CharField(choices=[('Trashed', 'Trashed'), ('Complete', 'Complete'), ('Active', 'Active'), ('Pending - Management', 'Pending - Management'), ('Pending - Sales', 'Pending - Sales')], default='Pending - Sales', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='appraisal',
+            index=models.Index(fields=['dealership', 'dealer_status', 'start_date'], name='appraisal_dealer_status_idx'),
+        ),
+        migrations.RunPython(backfill_dealer_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.14 on 2026-10-18 10:40
+
+from django.db import migrations
+
+SEARCH_COLUMNS = 'customer_first_name, customer_last_name, customer_email, vehicle_make, vehicle_model, vehicle_vin, vehicle_registration, vehicle_year'
+
+
+def create_search_index(apps, schema_editor):
+    # Only SQLite keeps a separate index; Postgres gets a generated tsvector column in 0057
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE core_appraisal_search USING fts5({SEARCH_COLUMNS}, prefix='2 3', tokenize='unicode61')"
+    )
+    schema_editor.execute(
+        f"INSERT INTO core_appraisal_search (rowid, {SEARCH_COLUMNS}) SELECT id, {SEARCH_COLUMNS} FROM core_appraisal"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS core_appraisal_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0049_appraisal_dealer_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
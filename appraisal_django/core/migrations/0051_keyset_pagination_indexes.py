@@ -0,0 +1,25 @@
+# Generated by Django 5.0.14 on 2026-10-18 10:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0050_appraisal_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appraisal',
+            index=models.Index(fields=['start_date', 'id'], name='appraisal_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='friendrequest',
+            index=models.Index(fields=['created_at', 'id'], name='friendrequest_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='offer_keyset_idx'),
+        ),
+    ]
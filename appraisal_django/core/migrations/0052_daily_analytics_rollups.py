@@ -0,0 +1,64 @@
+# Generated by Django 5.0.14 on 2026-10-18 10:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0051_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyAppraisalRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('appraisal_count', models.PositiveIntegerField(default=0)),
+                ('pending_sales_count', models.PositiveIntegerField(default=0)),
+                ('pending_management_count', models.PositiveIntegerField(default=0)),
+                ('active_count', models.PositiveIntegerField(default=0)),
+                ('complete_count', models.PositiveIntegerField(default=0)),
+                ('trashed_count', models.PositiveIntegerField(default=0)),
+                ('won_count', models.PositiveIntegerField(default=0)),
+                ('margin', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('dealership', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.dealership')),
+                ('initiating_dealer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.dealerprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['dealership', 'day'], name='rollup_dealership_day_idx')],
+                'unique_together': {('initiating_dealer', 'day', 'dealership')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyVehicleRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('vehicle_make', models.CharField(max_length=50)),
+                ('vehicle_model', models.CharField(max_length=50)),
+                ('appraisal_count', models.PositiveIntegerField(default=0)),
+                ('dealership', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.dealership')),
+                ('initiating_dealer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.dealerprofile')),
+            ],
+            options={
+                'unique_together': {('initiating_dealer', 'day', 'dealership', 'vehicle_make', 'vehicle_model')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyWholesalerRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('win_count', models.PositiveIntegerField(default=0)),
+                ('dealership', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.dealership')),
+                ('initiating_dealer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.dealerprofile')),
+                ('wholesaler', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.wholesalerprofile')),
+            ],
+            options={
+                'unique_together': {('initiating_dealer', 'day', 'dealership', 'wholesaler')},
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.0.14 on 2026-10-18 10:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F
+
+
+def backfill_leaderboard(apps, schema_editor):
+    Appraisal = apps.get_model('core', 'Appraisal')
+    WholesalerLeaderboard = apps.get_model('core', 'WholesalerLeaderboard')
+    winners = Appraisal.objects.filter(winner__user__isnull=False).order_by()
+    dealership_rows = winners.values('dealership_id', wholesaler_id=F('winner__user_id')).annotate(win_count=Count('id'))
+    dealer_rows = winners.values('dealership_id', 'initiating_dealer_id', wholesaler_id=F('winner__user_id')).annotate(win_count=Count('id'))
+    WholesalerLeaderboard.objects.bulk_create(
+        [WholesalerLeaderboard(**row) for row in dealership_rows] + [WholesalerLeaderboard(**row) for row in dealer_rows],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0052_daily_analytics_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WholesalerLeaderboard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('win_count', models.PositiveIntegerField(default=0)),
+                ('dealership', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.dealership')),
+                ('initiating_dealer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.dealerprofile')),
+                ('wholesaler', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.wholesalerprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['dealership', '-win_count'], name='leaderboard_dealership_idx'), models.Index(fields=['initiating_dealer', '-win_count'], name='leaderboard_dealer_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='wholesalerleaderboard',
+            constraint=models.UniqueConstraint(condition=models.Q(('initiating_dealer__isnull', True)), fields=('dealership', 'wholesaler'), name='leaderboard_dealership_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='wholesalerleaderboard',
+            constraint=models.UniqueConstraint(condition=models.Q(('initiating_dealer__isnull', False)), fields=('initiating_dealer', 'dealership', 'wholesaler'), name='leaderboard_dealer_key'),
+        ),
+        migrations.RunPython(backfill_leaderboard, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.0.14 on 2026-10-18 10:35
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_offer_updated_at(apps, schema_editor):
+    Offer = apps.get_model('core', 'Offer')
+    Offer.objects.update(updated_at=Coalesce('offer_made_at', 'created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0053_wholesaler_leaderboard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='offer',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+        migrations.RunPython(backfill_offer_updated_at, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='OfferMarketStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vehicle_make', models.CharField(max_length=50)),
+                ('vehicle_model', models.CharField(max_length=50)),
+                ('vehicle_year', models.IntegerField()),
+                ('odometer_band', models.PositiveSmallIntegerField()),
+                ('submitted_count', models.PositiveIntegerField(default=0)),
+                ('submitted_mean', models.DecimalField(decimal_places=2, max_digits=12, null=True)),
+                ('submitted_p25', models.DecimalField(decimal_places=2, max_digits=12, null=True)),
+                ('submitted_p50', models.DecimalField(decimal_places=2, max_digits=12, null=True)),
+                ('submitted_p75', models.DecimalField(decimal_places=2, max_digits=12, null=True)),
+                ('winning_count', models.PositiveIntegerField(default=0)),
+                ('winning_mean', models.DecimalField(decimal_places=2, max_digits=12, null=True)),
+                ('winning_p50', models.DecimalField(decimal_places=2, max_digits=12, null=True)),
+                ('trend', models.FloatField(null=True)),
+                ('offers_as_of', models.DateTimeField()),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('vehicle_make', 'vehicle_model', 'vehicle_year', 'odometer_band')},
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.14 on 2026-10-18 10:42
+
+from django.db import migrations, models
+
+
+def backfill_change_seq(apps, schema_editor):
+    # Number the existing appraisals in order of their last update, and start the counter after them
+    Appraisal = apps.get_model('core', 'Appraisal')
+    ChangeCounter = apps.get_model('core', 'ChangeCounter')
+    appraisals = list(Appraisal.objects.order_by('last_updated', 'id').only('id'))
+    for change_seq, appraisal in enumerate(appraisals, start=1):
+        appraisal.change_seq = change_seq
+    Appraisal.objects.bulk_update(appraisals, ['change_seq'], batch_size=1000)
+    ChangeCounter.objects.create(pk=1, value=len(appraisals))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0055_export_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='appraisal',
+            name='change_seq',
+            field=models.BigIntegerField(editable=False, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_change_seq, migrations.RunPython.noop),
+    ]
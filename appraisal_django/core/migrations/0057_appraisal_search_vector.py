@@ -0,0 +1,35 @@
+# Generated by Django 5.0.14 on 2026-10-18 12:05
+
+from django.db import migrations
+
+SEARCH_COLUMNS = ('customer_first_name', 'customer_last_name', 'customer_email', 'vehicle_make', 'vehicle_model',
+                  'vehicle_vin', 'vehicle_registration', 'vehicle_year')
+
+
+def create_search_vector(apps, schema_editor):
+    # SQLite searches the FTS5 table from 0050 instead
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    document = " || ' ' || ".join(f"coalesce({column}::text, '')" for column in SEARCH_COLUMNS)
+    schema_editor.execute(
+        "ALTER TABLE core_appraisal ADD COLUMN search_vector tsvector "
+        f"GENERATED ALWAYS AS (to_tsvector('simple'::regconfig, {document})) STORED"
+    )
+    schema_editor.execute("CREATE INDEX appraisal_search_vector_idx ON core_appraisal USING gin (search_vector)")
+
+
+def drop_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("ALTER TABLE core_appraisal DROP COLUMN IF EXISTS search_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0056_appraisal_change_feed'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_vector, drop_search_vector),
+    ]
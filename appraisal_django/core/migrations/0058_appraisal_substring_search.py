@@ -0,0 +1,40 @@
+# Generated by Django 5.0.14 on 2026-10-18 13:10
+
+from django.db import migrations
+
+SUBSTRING_COLUMNS = ('vehicle_vin', 'vehicle_registration')
+
+
+def create_substring_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        columns = ', '.join(SUBSTRING_COLUMNS)
+        schema_editor.execute(f"CREATE VIRTUAL TABLE core_appraisal_search_trigram USING fts5({columns}, tokenize='trigram')")
+        schema_editor.execute(f"INSERT INTO core_appraisal_search_trigram (rowid, {columns}) SELECT id, {columns} FROM core_appraisal")
+    elif vendor == 'postgresql':
+        # Match the UPPER(column::text) LIKE that icontains compiles to
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for column in SUBSTRING_COLUMNS:
+            schema_editor.execute(
+                f"CREATE INDEX appraisal_{column}_trgm_idx ON core_appraisal USING gin (UPPER({column}::text) gin_trgm_ops)"
+            )
+
+
+def drop_substring_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS core_appraisal_search_trigram")
+    elif vendor == 'postgresql':
+        for column in SUBSTRING_COLUMNS:
+            schema_editor.execute(f"DROP INDEX IF EXISTS appraisal_{column}_trgm_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0057_appraisal_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_substring_indexes, drop_substring_indexes),
+    ]
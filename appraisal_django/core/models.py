@@ -1,10 +1,22 @@
 from django.contrib.auth.models import User, AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, When, Value, Exists, OuterRef, F, Q, FilteredRelation
+from django.utils import timezone
 from rest_framework.authtoken.models import Token
+from .search import SEARCH_FIELDS, get_search_backend
 
 def default_wholesaler():
     return WholesalerProfile.objects.get(id=7).id
 
+# Appraisal columns the daily rollups are computed from (see core.analytics)
+ROLLUP_FIELDS = (
+    'dealership_id', 'initiating_dealer_id', 'start_date', 'dealer_status', 'winner_id', 'reserve_price',
+    'vehicle_make', 'vehicle_model',
+)
+
+# Appraisal columns whose changes save() looks for
+TRACKED_FIELDS = tuple(dict.fromkeys(ROLLUP_FIELDS + SEARCH_FIELDS))
+
 class Dealership(models.Model):
     AUSTRALIAN_STATES = [
         ('NSW', 'New South Wales'),
@@ -64,13 +76,55 @@ class WholesalerProfile(models.Model):
         return f"{self.user.get_full_name()} ({self.user.username}) - Wholesaler Name: {self.wholesaler_name}"
 
 
-class Appraisal(models.Model):    
+class AppraisalQuerySet(models.QuerySet):
+    def refresh_dealer_status(self):
+        """
+        Recompute the stored dealer_status of every appraisal in the queryset with a single UPDATE.
+        Used when offers change, since those writes do not go through Appraisal.save().
+        Only rows whose status changes are written; returns how many there were.
+        """
+        status = Case(
+            When(is_active=False, then=Value('Trashed')),
+            When(winner__isnull=False, then=Value('Complete')),
+            When(Exists(Offer.objects.filter(appraisal=OuterRef('pk'))), then=Value('Active')),
+            When(ready_for_management=True, then=Value('Pending - Management')),
+            default=Value('Pending - Sales'),
+        )
+        return self.exclude(dealer_status=status).update(dealer_status=status)
+
+    def with_wholesaler_status(self, wholesaler_profile):
+        """
+        Annotate each appraisal with `wholesaler_status`, computed in SQL from the wholesaler's own offer.
+        Mirrors Appraisal.get_wholesaler_status() and joins the offer through `own_offer`.
+        Filter on `own_offer_id` rather than `own_offer` so Django reuses the join instead of adding another.
+        """
+        return self.annotate(
+            own_offer=FilteredRelation('offers', condition=Q(offers__user=wholesaler_profile)),
+        ).annotate(own_offer_id=F('own_offer__id'), wholesaler_status=Case(
+            When(own_offer__amount__isnull=True, own_offer__passed=False, winner__isnull=False, then=Value('Complete - Missed')),
+            When(own_offer__amount__isnull=True, own_offer__passed=False, then=Value('Active')),
+            When(winner=F('own_offer__id'), then=Value('Complete - Won')),
+            When(winner__isnull=False, then=Value('Complete - Lost')),
+            default=Value('Complete - Priced'),
+        ))
+
+
+class Appraisal(models.Model):
+    DEALER_STATUS_CHOICES = (
+        ('Trashed', 'Trashed'),
+        ('Complete', 'Complete'),
+        ('Active', 'Active'),
+        ('Pending - Management', 'Pending - Management'),
+        ('Pending - Sales', 'Pending - Sales'),
+    )
+
     # Appraisal Information
     start_date = models.DateTimeField(auto_now_add=True, null=True)
     last_updated = models.DateTimeField(auto_now=True, null=True)
     is_active = models.BooleanField(default=True)  # Set to False if the appraisal is inactive/deleted
     invited_wholesalers = models.ManyToManyField('WholesalerProfile', through='Offer', related_name='invited_appraisals', blank=True)
     ready_for_management = models.BooleanField(default=False)
+    dealer_status = models.CharField(max_length=20, choices=DEALER_STATUS_CHOICES, default='Pending - Sales')  # Kept in sync by save() and Offer changes
 
     # Dealership Information
     dealership = models.ForeignKey(Dealership, on_delete=models.CASCADE, related_name='appraisals')
@@ -99,22 +153,116 @@ class Appraisal(models.Model):
     # Appraisal Details
     reserve_price = models.DecimalField(max_digits=10, decimal_places=2) 
     winner = models.OneToOneField('Offer', on_delete=models.SET_NULL, null=True, blank=True, related_name='winning_appraisal')
+    change_seq = models.BigIntegerField(unique=True, null=True, editable=False)  # Position in the change feed; see core.changes
+
+    objects = AppraisalQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['dealership', 'dealer_status', 'start_date'], name='appraisal_dealer_status_idx'),
+            models.Index(fields=['start_date', 'id'], name='appraisal_keyset_idx'),
+        ]
 
     def __str__(self):
         return f"{self.vehicle_registration} - {self.vehicle_vin}"
-    
-    def get_dealer_status(self):
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the values the rollups and search index were built from, so save() can tell what it changes
+        instance._loaded_values = {field: instance.__dict__[field] for field in TRACKED_FIELDS if field in instance.__dict__}
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        refreshed = TRACKED_FIELDS if fields is None else {self._meta.get_field(name).attname for name in fields}
+        self._loaded_values = {
+            **getattr(self, '_loaded_values', {}),
+            **{field: self.__dict__[field] for field in TRACKED_FIELDS if field in refreshed and field in self.__dict__},
+        }
+
+    def changed_fields(self, update_fields=None):
+        """
+        The TRACKED_FIELDS a save would write with a value other than the loaded one: all of them for a new row.
+        """
+        fields = TRACKED_FIELDS
+        if update_fields is not None:
+            written = {self._meta.get_field(name).attname for name in update_fields}
+            fields = [field for field in fields if field in written]
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None or self._state.adding or self.pk is None:
+            return set(fields)
+        missing = object()
+        return {field for field in fields if self.__dict__.get(field, missing) != loaded.get(field, missing)}
+
+    def save(self, *args, **kwargs):
+        from .analytics import refresh_appraisal_rollups, refresh_rollups
+        from .changes import next_change_seq
+
+        self.dealer_status = self.compute_dealer_status()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'dealer_status', 'change_seq'}
+        changed = self.changed_fields(kwargs.get('update_fields'))
+        loaded_values = getattr(self, '_loaded_values', {})
+
+        with transaction.atomic():
+            self.change_seq = next_change_seq()
+            super().save(*args, **kwargs)
+            # The rows it counted towards before and after, if anything they are computed from changed
+            if changed & set(ROLLUP_FIELDS):
+                refresh_rollups({self.get_rollup_key(loaded_values), self.get_rollup_key()})
+                if self.get_rollup_key() is None:
+                    # Deferred key fields: look the key up
+                    refresh_appraisal_rollups([self.pk])
+        self._loaded_values = {**loaded_values, **{field: self.__dict__[field] for field in changed if field in self.__dict__}}
+
+        if changed & set(SEARCH_FIELDS):
+            get_search_backend().index([self])
+
+    def delete(self, *args, **kwargs):
+        from .analytics import record_winner_change, refresh_rollups
+
+        appraisal_id = self.pk
+        rollup_key = self.get_rollup_key()
+        with transaction.atomic():
+            winner = self.winner
+            result = super().delete(*args, **kwargs)
+            refresh_rollups({rollup_key})
+            record_winner_change(self, winner, None)
+        get_search_backend().remove([appraisal_id])
+        return result
+
+    def get_rollup_key(self, values=None):
+        """
+        The (dealership_id, initiating_dealer_id, day) the appraisal is counted under in the daily rollups,
+        from its current values or the given ones.
+        """
+        # Read loaded values only, so deferred fields are not fetched
+        values = self.__dict__ if values is None else values
+        if values.get('start_date') is None or 'dealership_id' not in values or 'initiating_dealer_id' not in values:
+            return None
+        return (values['dealership_id'], values['initiating_dealer_id'], timezone.localdate(values['start_date']))
+
+    def compute_dealer_status(self):
         if not self.is_active:
             return 'Trashed'
-        if self.winner:
+        if self.winner_id:
             return 'Complete'
-        if self.offers.exists():
+        if self.pk and self.offers.exists():
             return 'Active'
         if self.ready_for_management:
             return 'Pending - Management'
         return 'Pending - Sales'
 
+    def get_dealer_status(self):
+        return self.dealer_status
+
     def get_wholesaler_status(self, wholesaler_profile):
+        # Querysets built with with_wholesaler_status() already carry the value
+        if hasattr(self, 'wholesaler_status'):
+            return self.wholesaler_status
+
         user_offer = self.offers.filter(user=wholesaler_profile).first()
 
         if user_offer.amount is None and not user_offer.passed:
@@ -173,12 +321,65 @@ class Offer(models.Model):
     passed = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     offer_made_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, null=True)
 
     class Meta:
         unique_together = ('appraisal', 'user')  # Ensure each user can only make one offer per appraisal
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='offer_keyset_idx'),
+        ]
 
     def __str__(self):
         return f"Offer by {self.user} on {self.appraisal.vehicle_registration}"
+
+    def save(self, *args, **kwargs):
+        from .analytics import refresh_appraisal_rollups
+        from .changes import record_changes
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            status_changed = Appraisal.objects.filter(pk=self.appraisal_id).refresh_dealer_status()
+            # The rollups only count the appraisal's status and its winning offer, so a plain bid leaves them as they are
+            if status_changed or self.is_winner():
+                refresh_appraisal_rollups([self.appraisal_id])
+            record_changes([self.appraisal_id])
+
+    def is_winner(self):
+        return Appraisal.objects.filter(pk=self.appraisal_id, winner_id=self.pk).exists()
+
+    @classmethod
+    def bulk_invite(cls, appraisal_ids, wholesaler_ids):
+        """
+        Invite every wholesaler to every appraisal with batched INSERTs, skipping pairs that are already invited.
+        bulk_create bypasses save(), so the appraisals' status, rollups and change feed are refreshed here in bulk.
+        """
+        from .analytics import refresh_appraisal_rollups
+        from .changes import record_changes
+
+        invites = [cls(appraisal_id=appraisal_id, user_id=wholesaler_id) for appraisal_id in appraisal_ids for wholesaler_id in wholesaler_ids]
+        with transaction.atomic():
+            cls.objects.bulk_create(invites, ignore_conflicts=True, batch_size=1000)
+            Appraisal.objects.filter(pk__in=appraisal_ids).refresh_dealer_status()
+            refresh_appraisal_rollups(appraisal_ids)
+            record_changes(appraisal_ids)
+
+    def delete(self, *args, **kwargs):
+        from .analytics import record_winner_change, refresh_appraisal_rollups
+        from .changes import record_changes
+
+        appraisal_id = self.appraisal_id
+        with transaction.atomic():
+            # The appraisal this offer won, if any; deleting the offer clears its winner
+            won_appraisal = Appraisal.objects.filter(pk=appraisal_id, winner_id=self.pk).first()
+            result = super().delete(*args, **kwargs)
+            status_changed = Appraisal.objects.filter(pk=appraisal_id).refresh_dealer_status()
+            # A trashed appraisal keeps its status when its winner goes, but not its rollup margin
+            if status_changed or won_appraisal is not None:
+                refresh_appraisal_rollups([appraisal_id])
+            if won_appraisal is not None:
+                record_winner_change(won_appraisal, self, None)
+            record_changes([appraisal_id])
+        return result
     
 
 def default_wholesaler():
@@ -192,9 +393,178 @@ class FriendRequest(models.Model):
     status = models.CharField(max_length=10, choices=[('pending', 'Pending'), ('accepted', 'Accepted'), ('rejected', 'Rejected')], default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='friendrequest_keyset_idx'),
+        ]
+
     def __str__(self):
         if self.dealership:
             return f"Friend Request from {self.sender.user.username if self.sender else 'Unknown'} to Dealership {self.dealership.dealership_name}"
         elif self.recipient_wholesaler:
             return f"Friend Request from {self.sender.user.username if self.sender else 'Unknown'} to Wholesaler {self.recipient_wholesaler.user.username}"
         return "Invalid Friend Request"
+
+
+class DailyAppraisalRollup(models.Model):
+    """
+    Appraisal totals per dealership, initiating dealer and day of start_date, maintained by core.analytics.
+    """
+    dealership = models.ForeignKey(Dealership, on_delete=models.CASCADE, related_name='+')
+    initiating_dealer = models.ForeignKey(DealerProfile, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+
+    appraisal_count = models.PositiveIntegerField(default=0)
+    pending_sales_count = models.PositiveIntegerField(default=0)
+    pending_management_count = models.PositiveIntegerField(default=0)
+    active_count = models.PositiveIntegerField(default=0)
+    complete_count = models.PositiveIntegerField(default=0)
+    trashed_count = models.PositiveIntegerField(default=0)
+    won_count = models.PositiveIntegerField(default=0)
+    margin = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # Winning price minus reserve, summed over won appraisals
+
+    class Meta:
+        unique_together = ('initiating_dealer', 'day', 'dealership')
+        indexes = [
+            models.Index(fields=['dealership', 'day'], name='rollup_dealership_day_idx'),
+        ]
+
+
+class DailyVehicleRollup(models.Model):
+    """
+    Appraisal counts per make and model within a DailyAppraisalRollup key.
+    """
+    dealership = models.ForeignKey(Dealership, on_delete=models.CASCADE, related_name='+')
+    initiating_dealer = models.ForeignKey(DealerProfile, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    vehicle_make = models.CharField(max_length=50)
+    vehicle_model = models.CharField(max_length=50)
+    appraisal_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('initiating_dealer', 'day', 'dealership', 'vehicle_make', 'vehicle_model')
+
+
+class DailyWholesalerRollup(models.Model):
+    """
+    Winning offers per wholesaler within a DailyAppraisalRollup key.
+    """
+    dealership = models.ForeignKey(Dealership, on_delete=models.CASCADE, related_name='+')
+    initiating_dealer = models.ForeignKey(DealerProfile, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    wholesaler = models.ForeignKey(WholesalerProfile, on_delete=models.CASCADE, related_name='+')
+    win_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('initiating_dealer', 'day', 'dealership', 'wholesaler')
+
+
+class WholesalerLeaderboard(models.Model):
+    """
+    All-time winning offer counts per wholesaler, for each dealership (initiating_dealer is null)
+    and for each initiating dealer within it. Kept current by make-winner and by deleting winning offers or won appraisals,
+    rebuilt by `manage.py rebuild_wholesaler_leaderboard`.
+    """
+    dealership = models.ForeignKey(Dealership, on_delete=models.CASCADE, related_name='+')
+    initiating_dealer = models.ForeignKey(DealerProfile, on_delete=models.CASCADE, related_name='+', null=True, blank=True)
+    wholesaler = models.ForeignKey(WholesalerProfile, on_delete=models.CASCADE, related_name='+')
+    win_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dealership', 'wholesaler'], condition=Q(initiating_dealer__isnull=True), name='leaderboard_dealership_key'),
+            models.UniqueConstraint(fields=['initiating_dealer', 'dealership', 'wholesaler'], condition=Q(initiating_dealer__isnull=False), name='leaderboard_dealer_key'),
+        ]
+        indexes = [
+            models.Index(fields=['dealership', '-win_count'], name='leaderboard_dealership_idx'),
+            models.Index(fields=['initiating_dealer', '-win_count'], name='leaderboard_dealer_idx'),
+        ]
+
+
+class OfferMarketStats(models.Model):
+    """
+    Distribution of offer amounts (adjusted where set) for one make, model, year and odometer band.
+    Refreshed by `manage.py refresh_offer_market_stats`; see core.market.
+    """
+    ODOMETER_BAND_SIZE = 25000
+    MAX_ODOMETER_BAND = 12  # Everything from 300,000 km up shares the last band
+
+    vehicle_make = models.CharField(max_length=50)  # Lower-cased
+    vehicle_model = models.CharField(max_length=50)  # Lower-cased
+    vehicle_year = models.IntegerField()
+    odometer_band = models.PositiveSmallIntegerField()
+
+    submitted_count = models.PositiveIntegerField(default=0)
+    submitted_mean = models.DecimalField(max_digits=12, decimal_places=2, null=True)
+    submitted_p25 = models.DecimalField(max_digits=12, decimal_places=2, null=True)
+    submitted_p50 = models.DecimalField(max_digits=12, decimal_places=2, null=True)
+    submitted_p75 = models.DecimalField(max_digits=12, decimal_places=2, null=True)
+    winning_count = models.PositiveIntegerField(default=0)
+    winning_mean = models.DecimalField(max_digits=12, decimal_places=2, null=True)
+    winning_p50 = models.DecimalField(max_digits=12, decimal_places=2, null=True)
+    trend = models.FloatField(null=True)  # Change in the mean submitted amount over the last 90 days against before them
+
+    offers_as_of = models.DateTimeField()  # Offers updated before this time are included
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('vehicle_make', 'vehicle_model', 'vehicle_year', 'odometer_band')
+
+
+class ChangeCounter(models.Model):
+    """
+    Single row holding the last Appraisal.change_seq handed out; see core.changes.
+    """
+    value = models.BigIntegerField(default=0)
+
+
+class ExportJob(models.Model):
+    """
+    An export written to disk in the background and downloaded once complete; see core.exports.
+    """
+    KIND_CHOICES = [
+        ('appraisals', 'Appraisals'),
+        ('offers', 'Offers'),
+        ('comments', 'Comments'),
+    ]
+    FORMAT_CHOICES = [
+        ('csv', 'CSV'),
+        ('ndjson', 'NDJSON'),
+    ]
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('complete', 'Complete'),
+        ('failed', 'Failed'),
+        ('expired', 'Expired'),
+    ]
+    ACTIVE_STATUSES = ('queued', 'running')
+
+    requested_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='export_jobs')
+    dealerships = models.ManyToManyField(Dealership, related_name='export_jobs', blank=True)  # Empty for wholesaler exports
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='appraisals')
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES, default='csv')
+    filters = models.JSONField(default=dict, blank=True)  # The download_csv query parameters the export was requested with
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    row_count = models.PositiveIntegerField(default=0)  # Rows written so far
+    file_path = models.CharField(max_length=255, blank=True)
+    file_size = models.PositiveBigIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='exportjob_status_idx'),
+            models.Index(fields=['requested_by', '-created_at'], name='exportjob_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} export #{self.id} ({self.status})"
+
+    @property
+    def filename(self):
+        return f"{self.kind}-{self.id}.{self.format}"
@@ -1,11 +1,13 @@
 from rest_framework import permissions
 from .models import *
+from .authentication import get_role_context
 
 SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'POST')
 
 
 # Leverage the filter_queryset in viewsets
 # Permissions can be boiled down to Is Dealer, Is Manager, Is Sales or Is Wholesaler
+# The user's role and dealerships come from the request's RoleContext, so no check runs a query
 
 
 class IsManagementDealerOrReadOnly(permissions.BasePermission):
@@ -17,11 +19,7 @@ class IsManagementDealerOrReadOnly(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
 
-        try:
-            dealer_profile = DealerProfile.objects.get(user=request.user)
-            return dealer_profile.role == 'M'
-        except DealerProfile.DoesNotExist:
-            return False
+        return get_role_context(request.user).is_management
 
 
 class CanManageDealerships(permissions.BasePermission):
@@ -31,12 +29,12 @@ class CanManageDealerships(permissions.BasePermission):
 
     def has_permission(self, request, view):
         # Check if the authenticated user is a management dealer ("M")
-        return request.user.dealerprofile.role == 'M'
+        return get_role_context(request.user).is_management
 
     def has_object_permission(self, request, view, obj):
         # Check if the management dealer manages the specified dealership
         if isinstance(obj, Dealership):
-            return obj in request.user.dealerprofile.managed_dealerships.all()
+            return obj.id in get_role_context(request.user).dealership_ids
         return False
 
 class SalesDealerPermission(permissions.BasePermission):
@@ -46,7 +44,7 @@ class SalesDealerPermission(permissions.BasePermission):
 
     def has_permission(self, request, view):
         if request.method == 'POST':  # Only allow creation for POST requests
-            return request.user.dealerprofile.role != 'S'
+            return not get_role_context(request.user).is_sales
         return True
 
     def has_object_permission(self, request, view, obj):
@@ -59,9 +57,9 @@ class IsDealerFromSameDealership(permissions.BasePermission):
         return request.user and request.user.is_authenticated
 
     def has_object_permission(self, request, view, obj):
-        if request.user.dealerprofile.role in ['M', 'S']:
-            user_dealership_ids = request.user.dealerprofile.dealerships.values_list('id', flat=True)
-            return obj.dealership.id in user_dealership_ids
+        context = get_role_context(request.user)
+        if context.is_dealer:
+            return obj.dealership_id in context.dealership_ids
         return False
 
 
@@ -83,18 +81,14 @@ class IsManagementDealerFromSameDealership(permissions.BasePermission):
     def has_permission(self, request, view):
         if request.method in permissions.SAFE_METHODS:
             return True
-        return request.user and request.user.is_authenticated and hasattr(request.user, 'dealerprofile')
+        return request.user and request.user.is_authenticated and get_role_context(request.user).is_dealer
 
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
             return True
 
-        try:
-            dealer_profile = DealerProfile.objects.get(user=request.user)
-            print(f"User: {request.user.username}, Role: {dealer_profile.role}, Dealerships: {dealer_profile.dealerships.all()}")
-            return dealer_profile.role == 'M' and obj in dealer_profile.dealerships.all()
-        except DealerProfile.DoesNotExist:
-            return False
+        context = get_role_context(request.user)
+        return context.is_management and obj.id in context.dealership_ids
         
 
 
@@ -106,19 +100,17 @@ class IsDealerFromSameDealershipOrWholesaler(permissions.BasePermission):
         return request.user and request.user.is_authenticated
 
     def has_object_permission(self, request, view, obj):
-        user = request.user
+        context = get_role_context(request.user)
         # Allow safe methods for everyone
         if request.method in SAFE_METHODS:
             return True
         
         # Check if the user is a dealer and belongs to the same dealership
-        if hasattr(user, 'dealerprofile'):
-            dealer_profile = user.dealerprofile
-            user_dealership_ids = dealer_profile.dealerships.values_list('id', flat=True)
-            return obj.dealership.id in user_dealership_ids
+        if context.is_dealer:
+            return obj.dealership_id in context.dealership_ids
         
         # Check if the user is a wholesaler
-        if hasattr(user, 'wholesalerprofile'):
+        if context.is_wholesaler:
             return True  # Wholesalers can read and make offers (which is a non-safe method)
         
         return False
@@ -131,10 +123,8 @@ class CanMakeOffer(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
 
-        try:
-            return request.user.wholesalerprofile.is_wholesaler
-        except WholesalerProfile.DoesNotExist:
-            return False
+        wholesaler_profile = get_role_context(request.user).wholesaler_profile
+        return wholesaler_profile is not None and wholesaler_profile.is_wholesaler
         
 
 class CanViewOffers(permissions.BasePermission):
@@ -143,9 +133,7 @@ class CanViewOffers(permissions.BasePermission):
     """
 
     def has_permission(self, request, view):
-        if request.user.dealerprofile.role == 'M':
-            return True
-        return False
+        return get_role_context(request.user).is_management
 
     def has_object_permission(self, request, view, obj):
         # Optionally, you can check object-level permissions here
@@ -159,7 +147,7 @@ class IsDealer(permissions.BasePermission):
     """
     def has_permission(self, request, view):
         # Check if the user is authenticated and has a dealer profile
-        return request.user and request.user.is_authenticated and hasattr(request.user, 'dealerprofile')
+        return request.user and request.user.is_authenticated and get_role_context(request.user).is_dealer
 
     def has_object_permission(self, request, view, obj):
         # Allow safe methods for everyone
@@ -167,9 +155,9 @@ class IsDealer(permissions.BasePermission):
             return True
         
         # Check if the user is a dealer and belongs to the same dealership as the object
-        if hasattr(request.user, 'dealerprofile'):
-            dealer_profile = request.user.dealerprofile
-            return obj.dealership == dealer_profile.dealership
+        context = get_role_context(request.user)
+        if context.is_dealer:
+            return obj.dealership_id in context.dealership_ids
         
         return False
 
@@ -179,7 +167,7 @@ class IsWholesaler(permissions.BasePermission):
     """
     def has_permission(self, request, view):
         # Check if the user is authenticated and has a wholesaler profile
-        return request.user and request.user.is_authenticated and hasattr(request.user, 'wholesalerprofile')
+        return request.user and request.user.is_authenticated and get_role_context(request.user).is_wholesaler
 
     def has_object_permission(self, request, view, obj):
         # Allow any authenticated wholesaler to perform any action
@@ -191,9 +179,7 @@ class IsSales(permissions.BasePermission):
     """
     def has_permission(self, request, view):
         # Check if the user is authenticated and has a dealer profile with sales role
-        return request.user and request.user.is_authenticated and (
-            hasattr(request.user, 'dealerprofile') and request.user.dealerprofile.role == 'S'
-        )
+        return request.user and request.user.is_authenticated and get_role_context(request.user).is_sales
 
     def has_object_permission(self, request, view, obj):
         # Mirror the permission check for the `has_permission` method
@@ -205,9 +191,7 @@ class IsManagement(permissions.BasePermission):
     """
     def has_permission(self, request, view):
         # Check if the user is authenticated and has a dealer profile with management role
-        return request.user and request.user.is_authenticated and (
-            hasattr(request.user, 'dealerprofile') and request.user.dealerprofile.role == 'M'
-        )
+        return request.user and request.user.is_authenticated and get_role_context(request.user).is_management
 
     def has_object_permission(self, request, view, obj):
         # Mirror the permission check for the `has_permission` method
@@ -0,0 +1,159 @@
+"""
+Reserve price guidance from comparable past sales.
+
+Won appraisals are held in memory as NumPy arrays: categorical codes for make, model, body type and fuel type,
+year and odometer columns, and the winning amounts. A guidance request masks the arrays to the caller's dealerships
+and the same make (and model, when there are enough), scores every candidate by distance in one vectorised pass,
+and returns quantiles of the nearest winning amounts.
+
+The index refreshes itself incrementally from appraisals whose last_updated moved past the last load,
+and rebuilds from scratch periodically to pick up deletions and offer adjustments.
+"""
+import threading
+import time
+from collections import namedtuple
+
+from django.db.models.functions import Coalesce
+
+from .models import Appraisal
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; price guidance is unavailable without it
+    np = None
+
+# Seconds between incremental refreshes, and between full rebuilds
+REFRESH_INTERVAL = 60
+REBUILD_INTERVAL = 60 * 60
+
+# Distance weights: one year apart, 20,000 km apart, or a different body/fuel type each cost about the same
+YEAR_SCALE = 1.0
+ODOMETER_SCALE = 20000.0
+CATEGORY_PENALTY = 1.0
+
+DEFAULT_NEIGHBOURS = 25
+MIN_NEIGHBOURS = 5
+
+COLUMNS = ('ids', 'dealership_ids', 'makes', 'models', 'body_types', 'fuel_types', 'years', 'odometers', 'amounts')
+
+Snapshot = namedtuple('Snapshot', COLUMNS)
+
+
+def price_guidance_available():
+    return np is not None
+
+
+class PriceGuidanceIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.vocabulary = {}
+        self.snapshot = None
+        self.watermark = None
+        self.refreshed_at = 0.0
+        self.rebuilt_at = 0.0
+
+    def code(self, value):
+        # Case-insensitive integer code for a categorical value; unseen values get a fresh code
+        key = (value or '').strip().lower()
+        if key not in self.vocabulary:
+            self.vocabulary[key] = len(self.vocabulary)
+        return self.vocabulary[key]
+
+    def load(self, appraisals):
+        """
+        Arrays for the active won appraisals in a queryset, the ids of every appraisal it held, and its latest last_updated.
+        """
+        rows = list(appraisals.values_list(
+            'id', 'dealership_id', 'vehicle_make', 'vehicle_model', 'body_type', 'fuel_type',
+            'vehicle_year', 'odometer_reading', 'winning_amount', 'is_active', 'last_updated',
+        ))
+        seen_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        won = [row for row in rows if row[8] is not None and row[9]]
+        snapshot = Snapshot(
+            ids=np.array([row[0] for row in won], dtype=np.int64),
+            dealership_ids=np.array([row[1] for row in won], dtype=np.int64),
+            makes=np.array([self.code(row[2]) for row in won], dtype=np.int32),
+            models=np.array([self.code(row[3]) for row in won], dtype=np.int32),
+            body_types=np.array([self.code(row[4]) for row in won], dtype=np.int32),
+            fuel_types=np.array([self.code(row[5]) for row in won], dtype=np.int32),
+            years=np.array([row[6] for row in won], dtype=np.float64),
+            odometers=np.array([row[7] for row in won], dtype=np.float64),
+            amounts=np.array([row[8] for row in won], dtype=np.float64),
+        )
+        watermark = max((row[10] for row in rows if row[10] is not None), default=None)
+        return snapshot, seen_ids, watermark
+
+    def queryset(self):
+        return Appraisal.objects.annotate(winning_amount=Coalesce('winner__adjusted_amount', 'winner__amount')).order_by()
+
+    def rebuild(self):
+        with self.lock:
+            snapshot, _, watermark = self.load(self.queryset().filter(is_active=True, winning_amount__isnull=False))
+            self.snapshot, self.watermark = snapshot, watermark
+            self.refreshed_at = self.rebuilt_at = time.monotonic()
+
+    def refresh(self):
+        """
+        Reload the appraisals updated since the last load; ones that lost their winner or were trashed drop out.
+        """
+        with self.lock:
+            # >= so rows saved in the same instant as the watermark are not missed; reloading a row is harmless
+            added, changed_ids, watermark = self.load(self.queryset().filter(last_updated__gte=self.watermark))
+            keep = ~np.isin(self.snapshot.ids, changed_ids)
+            self.snapshot = Snapshot(*(np.concatenate([old[keep], new]) for old, new in zip(self.snapshot, added)))
+            if watermark is not None:
+                self.watermark = watermark
+            self.refreshed_at = time.monotonic()
+
+    def ensure_fresh(self):
+        now = time.monotonic()
+        if self.snapshot is None or self.watermark is None or now - self.rebuilt_at > REBUILD_INTERVAL:
+            self.rebuild()
+        elif now - self.refreshed_at > REFRESH_INTERVAL:
+            self.refresh()
+
+    def guidance(self, dealership_ids, make, model, year=None, odometer=None, body_type=None, fuel_type=None,
+                 neighbours=DEFAULT_NEIGHBOURS):
+        """
+        p25/p50/p75 of the winning amounts of the nearest comparable sales in the given dealerships.
+        """
+        self.ensure_fresh()
+        data = self.snapshot
+
+        in_scope = np.isin(data.dealership_ids, list(dealership_ids))
+        same_make = in_scope & (data.makes == self.vocabulary.get(make.strip().lower(), -1))
+        candidates = same_make & (data.models == self.vocabulary.get(model.strip().lower(), -1))
+        match = 'model'
+        if candidates.sum() < MIN_NEIGHBOURS:
+            # Too few sales of the model, so widen to the make
+            candidates, match = same_make, 'make'
+
+        indexes = np.flatnonzero(candidates)
+        if not len(indexes):
+            return {'match': None, 'comparables': 0, 'p25': None, 'p50': None, 'p75': None}
+
+        distance = np.zeros(len(indexes))
+        if year is not None:
+            distance += np.abs(data.years[indexes] - year) / YEAR_SCALE
+        if odometer is not None:
+            distance += np.abs(data.odometers[indexes] - odometer) / ODOMETER_SCALE
+        if body_type:
+            distance += (data.body_types[indexes] != self.vocabulary.get(body_type.strip().lower(), -1)) * CATEGORY_PENALTY
+        if fuel_type:
+            distance += (data.fuel_types[indexes] != self.vocabulary.get(fuel_type.strip().lower(), -1)) * CATEGORY_PENALTY
+
+        if len(indexes) > neighbours:
+            nearest = np.argpartition(distance, neighbours - 1)[:neighbours]
+            indexes = indexes[nearest]
+
+        p25, p50, p75 = np.percentile(data.amounts[indexes], [25, 50, 75])
+        return {
+            'match': match,
+            'comparables': int(len(indexes)),
+            'p25': round(float(p25), 2),
+            'p50': round(float(p50), 2),
+            'p75': round(float(p75), 2),
+        }
+
+
+price_guidance_index = PriceGuidanceIndex()
@@ -0,0 +1,157 @@
+"""
+Per-request profiles.
+
+With PROFILING_ENABLED on, ProfilingMiddleware (core.middleware) profiles requests by staff users that ask for it
+with an `X-Profile: 1` header or a `profile=1` query parameter, sampled at PROFILING_SAMPLE_RATE. The request runs
+under cProfile with every SQL query timed, and two files are written to PROFILING_DIR: `<id>.prof` with the raw
+pstats, for snakeviz or `python -m pstats`, and `<id>.json` with a summary of the slowest functions and the SQL
+timeline. Only the newest PROFILING_MAX_PROFILES are kept. /admin/profiles/ lists the slowest per action.
+"""
+import json
+import os
+import pstats
+import re
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils import timezone
+
+# Kept in the summary: the slowest functions by cumulative time, and the start of each query's SQL
+TOP_FUNCTIONS = 40
+SQL_LENGTH = 500
+
+PROFILE_ID_PATTERN = re.compile(r'^\d{8}T\d{12}-[0-9a-f]{8}$')
+
+
+def profiling_settings():
+    return {
+        'enabled': getattr(settings, 'PROFILING_ENABLED', False),
+        'sample_rate': getattr(settings, 'PROFILING_SAMPLE_RATE', 1.0),
+        'directory': getattr(settings, 'PROFILING_DIR', os.path.join(settings.BASE_DIR, 'profiles')),
+        'max_profiles': getattr(settings, 'PROFILING_MAX_PROFILES', 500),
+    }
+
+
+class QueryTimeline:
+    """
+    Execute wrapper recording when each query started, relative to the request, and how long it took.
+    """
+    def __init__(self, started):
+        self.started = started
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'start_ms': round((started - self.started) * 1000, 3),
+                'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+                'sql': sql[:SQL_LENGTH],
+                'many': many,
+            })
+
+
+def top_functions(stats, limit=TOP_FUNCTIONS):
+    """
+    The functions with the most cumulative time in a pstats.Stats, slowest first.
+    """
+    rows = []
+    for (filename, line, function), (_, calls, total, cumulative, _) in stats.stats.items():
+        rows.append({
+            'function': f'{function} ({filename}:{line})' if line else function,
+            'calls': calls,
+            'total_ms': round(total * 1000, 3),
+            'cumulative_ms': round(cumulative * 1000, 3),
+        })
+    rows.sort(key=lambda row: row['cumulative_ms'], reverse=True)
+    return rows[:limit]
+
+
+def new_profile_id():
+    # Sorts by capture time, so rotation and listings need no other index
+    return f'{timezone.now():%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}'
+
+
+def profile_path(profile_id, extension):
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        raise ValueError(f'Invalid profile id: {profile_id}')
+    return os.path.join(profiling_settings()['directory'], f'{profile_id}.{extension}')
+
+
+def save_profile(profiler, summary):
+    """
+    Write a profiler's pstats and the request summary (with its slowest functions added), then rotate.
+    Returns the profile id.
+    """
+    options = profiling_settings()
+    os.makedirs(options['directory'], exist_ok=True)
+
+    profile_id = new_profile_id()
+    profiler.dump_stats(profile_path(profile_id, 'prof'))
+    summary = {'id': profile_id, **summary, 'top_functions': top_functions(pstats.Stats(profiler))}
+    # Written under a temporary name and renamed, so readers never see half a file
+    partial = profile_path(profile_id, 'json') + '.part'
+    with open(partial, 'w') as file:
+        json.dump(summary, file)
+    os.replace(partial, profile_path(profile_id, 'json'))
+
+    rotate_profiles(options['directory'], options['max_profiles'])
+    return profile_id
+
+
+def profile_ids(directory=None):
+    directory = directory or profiling_settings()['directory']
+    if not os.path.isdir(directory):
+        return []
+    names = (name[:-len('.json')] for name in os.listdir(directory) if name.endswith('.json'))
+    return sorted(name for name in names if PROFILE_ID_PATTERN.match(name))
+
+
+def rotate_profiles(directory, max_profiles):
+    """
+    Delete the oldest profiles beyond max_profiles.
+    """
+    ids = profile_ids(directory)
+    for profile_id in ids[:max(len(ids) - max_profiles, 0)]:
+        for extension in ('json', 'prof'):
+            try:
+                os.remove(os.path.join(directory, f'{profile_id}.{extension}'))
+            except FileNotFoundError:
+                pass  # Already rotated away by another process
+
+
+def load_profile(profile_id):
+    """
+    The JSON summary of a profile, or None if it does not exist (or was rotated away).
+    """
+    try:
+        with open(profile_path(profile_id, 'json')) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def slowest_by_action(per_action=10):
+    """
+    The slowest stored profiles of each action, as (action, profiles) pairs with the slowest actions first.
+    The SQL timeline and function list are left out.
+    """
+    by_action = defaultdict(list)
+    for profile_id in profile_ids():
+        summary = load_profile(profile_id)
+        if summary is None:
+            continue
+        summary.pop('sql', None)
+        summary.pop('top_functions', None)
+        by_action[summary['action'] or summary['path']].append(summary)
+
+    slowest = []
+    for action, summaries in by_action.items():
+        summaries.sort(key=lambda summary: summary['duration_ms'], reverse=True)
+        slowest.append((action, summaries[:per_action]))
+    slowest.sort(key=lambda pair: pair[1][0]['duration_ms'], reverse=True)
+    return slowest
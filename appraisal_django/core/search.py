@@ -0,0 +1,221 @@
+"""
+Keyword search over appraisals.
+
+The backend is picked from the `APPRAISAL_SEARCH_BACKEND` setting (a dotted path), or from the database vendor:
+SQLite uses an FTS5 index, Postgres a GIN-indexed tsvector column, and anything else falls back to icontains matching.
+Every backend annotates the matches with `search_rank`, where a lower value means a better match.
+Keywords match words by prefix ("toyo" finds Toyota), except in SUBSTRING_FIELDS: a VIN or registration is
+found from any part of it ("123" finds ABC123), as the icontains filter the index replaced did.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import BooleanField, Q, Value, FloatField
+from django.db.models.functions import Coalesce
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+# Appraisal columns covered by the search index
+SEARCH_FIELDS = (
+    'customer_first_name', 'customer_last_name', 'customer_email', 'vehicle_make', 'vehicle_model',
+    'vehicle_vin', 'vehicle_registration', 'vehicle_year',
+)
+
+# Search columns matched anywhere inside their value rather than by word prefix
+SUBSTRING_FIELDS = ('vehicle_vin', 'vehicle_registration')
+
+# Trigram indexes only answer substrings of at least this many characters
+MIN_SUBSTRING_LENGTH = 3
+
+
+def tokenize(keyword):
+    return re.findall(r'\w+', keyword)
+
+
+class BaseSearchBackend:
+    def search(self, queryset, keywords):
+        """
+        Filter the queryset to appraisals matching every keyword and annotate them with `search_rank`.
+        """
+        raise NotImplementedError
+
+    def index(self, appraisals):
+        """
+        Bring the index up to date for the given saved appraisals. Backends that search live columns need not.
+        """
+
+    def remove(self, appraisal_ids):
+        """
+        Drop deleted appraisals from the index.
+        """
+
+    def rebuild(self):
+        """
+        Re-index every appraisal from scratch.
+        """
+
+
+class IcontainsSearchBackend(BaseSearchBackend):
+    """
+    Unindexed fallback that matches each keyword against the columns with icontains.
+    """
+
+    def search(self, queryset, keywords):
+        for keyword in keywords:
+            condition = Q()
+            for field in SEARCH_FIELDS:
+                condition |= Q(**{f'{field}__icontains': keyword})
+            if keyword.isdigit():
+                condition |= Q(id=keyword)
+            queryset = queryset.filter(condition)
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+def substring_keyword(keyword):
+    """
+    The keyword to look for inside SUBSTRING_FIELDS, or None: only single words long enough for a trigram index.
+    """
+    tokens = tokenize(keyword)
+    if len(tokens) != 1 or len(tokens[0]) < MIN_SUBSTRING_LENGTH:
+        return None
+    return tokens[0]
+
+
+class SQLiteFTS5SearchBackend(BaseSearchBackend):
+    """
+    Searches the `core_appraisal_search` FTS5 table created by migration 0050, and for substrings of the VIN and
+    registration the trigram-tokenized `core_appraisal_search_trigram` table from migration 0058.
+    Appraisal.save() keeps both in sync; `manage.py rebuild_search_index` repopulates them after bulk writes.
+    """
+    table = 'core_appraisal_search'
+    trigram_table = 'core_appraisal_search_trigram'
+
+    def match_expression(self, keyword):
+        # Every token must match as a prefix, e.g. "toyo cor" -> "toyo"* AND "cor"*
+        return ' AND '.join(f'"{token}"*' for token in tokenize(keyword))
+
+    def search(self, queryset, keywords):
+        matches = []
+        for keyword in keywords:
+            match = self.match_expression(keyword)
+            if not match:
+                return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+            condition = Q(id__in=RawSQL(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s', (match,)))
+            substring = substring_keyword(keyword)
+            if substring:
+                condition |= Q(id__in=RawSQL(f'SELECT rowid FROM {self.trigram_table} WHERE {self.trigram_table} MATCH %s',
+                                             (f'"{substring}"',)))
+            if keyword.isdigit():
+                condition |= Q(id=keyword)
+            queryset = queryset.filter(condition)
+            matches.append(f'({match})')
+
+        # bm25() is negative and smaller for better matches; rows only matched by id or substring rank last
+        rank = RawSQL(
+            f'SELECT bm25({self.table}) FROM {self.table} '
+            f'WHERE {self.table} MATCH %s AND {self.table}.rowid = "core_appraisal"."id"',
+            (' OR '.join(matches),),
+            output_field=FloatField(),
+        )
+        return queryset.annotate(search_rank=Coalesce(rank, Value(0.0)))
+
+    def index(self, appraisals):
+        rows = [[appraisal.pk] + [str(getattr(appraisal, field)) for field in SEARCH_FIELDS] for appraisal in appraisals]
+        columns = ', '.join(SEARCH_FIELDS)
+        placeholders = ', '.join(['%s'] * (len(SEARCH_FIELDS) + 1))
+        substring_rows = [[appraisal.pk] + [str(getattr(appraisal, field)) for field in SUBSTRING_FIELDS] for appraisal in appraisals]
+        substring_columns = ', '.join(SUBSTRING_FIELDS)
+        with connection.cursor() as cursor:
+            for table in (self.table, self.trigram_table):
+                cursor.executemany(f'DELETE FROM {table} WHERE rowid = %s', [row[:1] for row in rows])
+            cursor.executemany(f'INSERT INTO {self.table} (rowid, {columns}) VALUES ({placeholders})', rows)
+            cursor.executemany(f'INSERT INTO {self.trigram_table} (rowid, {substring_columns}) VALUES (%s, %s, %s)', substring_rows)
+
+    def remove(self, appraisal_ids):
+        with connection.cursor() as cursor:
+            for table in (self.table, self.trigram_table):
+                cursor.executemany(f'DELETE FROM {table} WHERE rowid = %s', [[pk] for pk in appraisal_ids])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            for table, fields in ((self.table, SEARCH_FIELDS), (self.trigram_table, SUBSTRING_FIELDS)):
+                columns = ', '.join(fields)
+                cursor.execute(f'DELETE FROM {table}')
+                cursor.execute(f'INSERT INTO {table} (rowid, {columns}) SELECT id, {columns} FROM core_appraisal')
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Matches the `search_vector` column added by migration 0057 against a prefix tsquery and ranks with ts_rank.
+    The column is generated from the search columns and GIN-indexed, so Postgres keeps it in sync by itself.
+    Substrings of the VIN and registration are matched with icontains, answered by the pg_trgm indexes of migration 0058.
+    """
+    config = 'simple'  # Must match the configuration the column is generated with
+    column = '"core_appraisal"."search_vector"'
+
+    def search(self, queryset, keywords):
+        terms = []
+        for keyword in keywords:
+            # Every token must match as a prefix, e.g. "toyo cor" -> toyo:* & cor:*
+            term = ' & '.join(f'{token}:*' for token in tokenize(keyword))
+            if not term:
+                return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+            condition = Q(RawSQL(f'{self.column} @@ to_tsquery(%s::regconfig, %s)', (self.config, term),
+                                 output_field=BooleanField()))
+            substring = substring_keyword(keyword)
+            if substring:
+                for field in SUBSTRING_FIELDS:
+                    condition |= Q(**{f'{field}__icontains': substring})
+            if keyword.isdigit():
+                condition |= Q(id=keyword)
+            queryset = queryset.filter(condition)
+            terms.append(f'({term})')
+
+        # ts_rank grows with relevance, so negate it to keep "lower is better"; rows only matched by id or substring rank last
+        rank = RawSQL(
+            f'ts_rank({self.column}, to_tsquery(%s::regconfig, %s))',
+            (self.config, ' | '.join(terms)),
+            output_field=FloatField(),
+        )
+        return queryset.annotate(search_rank=-rank)
+
+
+def get_search_backend():
+    path = getattr(settings, 'APPRAISAL_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    if connection.vendor == 'sqlite':
+        return SQLiteFTS5SearchBackend()
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return IcontainsSearchBackend()
+
+
+def search_appraisals(queryset, keywords):
+    return get_search_backend().search(queryset, keywords)
+
+
+# Values of the `filter` query parameter that select a dealer or wholesaler status rather than search
+STATUS_KEYWORDS = (
+    'Trashed', 'Complete', 'Active', 'Pending - Management', 'Pending - Sales',
+    'Complete - Won', 'Complete - Lost', 'Complete - Missed', 'Complete - Priced',
+)
+
+
+def filter_appraisals(queryset, filters, status_field=None):
+    """
+    Apply the values of the `filter` query parameter: each status narrows on status_field (statuses are skipped
+    without one), and everything else goes to the search index in one lookup, ranked by relevance.
+    """
+    keywords = []
+    for keyword in filters:
+        if keyword in STATUS_KEYWORDS:
+            if status_field:
+                queryset = queryset.filter(**{status_field: keyword})
+        else:
+            keywords.append(keyword)
+
+    if keywords:
+        queryset = search_appraisals(queryset, keywords).order_by('search_rank', '-start_date')
+    return queryset
@@ -0,0 +1,318 @@
+"""
+Synthetic data at production scale.
+
+seed_synthetic_data() bulk-creates dealerships, dealers, wholesalers, appraisals, offers, damages, comments and
+friend requests with skewed distributions: a few dealerships and wholesalers carry most of the activity, popular
+vehicles dominate, and recent days are busier than old ones. The derived tables (dealer status, change feed, search
+index, rollups, leaderboard and market statistics) are rebuilt afterwards, so the data looks like it went through
+the API. Generation is seeded, so the same options always give the same dataset.
+"""
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .analytics import rebuild_leaderboard, rebuild_rollups
+from .changes import next_change_seq
+from .market import refresh_market_stats
+from .models import Appraisal, Comment, Damage, DealerProfile, Dealership, FriendRequest, Offer, WholesalerProfile
+from .search import get_search_backend
+
+SEED_PASSWORD = 'synthetic'  # Every synthetic user can log in with this
+
+# (make, model, body type, typical new price), most common first
+VEHICLES = (
+    ('Toyota', 'Corolla', 'Hatch', 30000), ('Toyota', 'HiLux', 'Ute', 55000), ('Ford', 'Ranger', 'Ute', 58000),
+    ('Mazda', 'CX-5', 'SUV', 40000), ('Toyota', 'RAV4', 'SUV', 45000), ('Hyundai', 'i30', 'Hatch', 28000),
+    ('Mitsubishi', 'Triton', 'Ute', 45000), ('Kia', 'Sportage', 'SUV', 38000), ('Mazda', '3', 'Hatch', 32000),
+    ('Isuzu', 'D-Max', 'Ute', 50000), ('Tesla', 'Model 3', 'Sedan', 60000), ('Volkswagen', 'Golf', 'Hatch', 38000),
+    ('Subaru', 'Outback', 'Wagon', 45000), ('Nissan', 'X-Trail', 'SUV', 40000), ('BMW', 'X5', 'SUV', 110000),
+    ('Holden', 'Commodore', 'Sedan', 40000), ('Mercedes-Benz', 'C-Class', 'Sedan', 75000), ('Suzuki', 'Swift', 'Hatch', 22000),
+)
+FUEL_TYPES = (('Petrol', 60), ('Diesel', 25), ('Hybrid', 10), ('Electric', 5))
+COLOURS = ('White', 'Silver', 'Black', 'Grey', 'Blue', 'Red')
+TRANSMISSIONS = (('Automatic', 85), ('Manual', 15))
+DAMAGE_LOCATIONS = ('Front bumper', 'Rear bumper', 'Bonnet', 'Driver door', 'Windscreen', 'Interior')
+FIRST_NAMES = ('Jack', 'Olivia', 'Noah', 'Charlotte', 'William', 'Amelia', 'Oliver', 'Isla', 'Thomas', 'Mia', 'Lucas', 'Chloe')
+LAST_NAMES = ('Smith', 'Jones', 'Williams', 'Brown', 'Wilson', 'Taylor', 'Nguyen', 'Johnson', 'Martin', 'White', 'Lee', 'Kelly')
+SUBURBS = (('Parramatta', 'NSW', '2150'), ('Richmond', 'VIC', '3121'), ('Fortitude Valley', 'QLD', '4006'),
+           ('Osborne Park', 'WA', '6017'), ('Adelaide', 'SA', '5000'), ('Hobart', 'TAS', '7000'), ('Fyshwick', 'ACT', '2609'))
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """
+    Let bulk_create keep the values set on auto_now/auto_now_add fields instead of stamping every row with now.
+    """
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field, _, _ in saved:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def timestamp_fields(model, *names):
+    return [model._meta.get_field(name) for name in names]
+
+
+class SyntheticDataset:
+    def __init__(self, dealerships=20, dealers=8, wholesalers=200, appraisals=20000, offers=4.0, comments=1.5,
+                 damages=1.0, friend_requests=500, days=365, prefix='synthetic', seed=0, batch_size=2000):
+        self.dealership_count = dealerships
+        self.dealers_per_dealership = dealers
+        self.wholesaler_count = wholesalers
+        self.appraisal_count = appraisals
+        self.offers_per_appraisal = offers
+        self.comments_per_appraisal = comments
+        self.damages_per_appraisal = damages
+        self.friend_request_count = friend_requests
+        self.days = days
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        self.now = timezone.now()
+        self.password = make_password(SEED_PASSWORD)  # Hashing once keeps user creation cheap
+        self.counts = {}
+
+    # Distributions
+
+    def zipf_weights(self, count, exponent=1.1):
+        # Weight of the item at each rank: the first few items get most of the picks
+        return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+    def weighted(self, options):
+        values, weights = zip(*options)
+        return self.random.choices(values, weights)[0]
+
+    def recent_datetime(self):
+        # Busier towards the present: a day in the window biased to recent ones, at a time in business hours
+        days_ago = min(int(self.random.expovariate(3 / self.days)), self.days - 1)
+        return self.now - timedelta(days=days_ago, hours=self.random.randint(0, 9), minutes=self.random.randint(0, 59))
+
+    def until_now(self, moment):
+        return min(moment, self.now)
+
+    def person(self):
+        return self.random.choice(FIRST_NAMES), self.random.choice(LAST_NAMES)
+
+    # Steps
+
+    def create_users(self, kind, count):
+        users = []
+        for number in range(count):
+            first_name, last_name = self.person()
+            users.append(User(username=f'{self.prefix}_{kind}{number}', password=self.password, first_name=first_name,
+                              last_name=last_name, email=f'{self.prefix}_{kind}{number}@example.com'))
+        return User.objects.bulk_create(users, batch_size=self.batch_size)
+
+    def create_dealerships(self):
+        dealerships = []
+        for number in range(self.dealership_count):
+            suburb, state, postcode = self.random.choice(SUBURBS)
+            dealerships.append(Dealership(
+                dealership_name=f'{self.prefix.title()} Motors {number}', street_address=f'{number + 1} Auto Way',
+                suburb=suburb, state=state, postcode=postcode, email=f'{self.prefix}{number}@example.com', phone='0290000000',
+            ))
+        self.dealerships = Dealership.objects.bulk_create(dealerships)
+        self.dealership_weights = self.zipf_weights(len(self.dealerships))
+
+    def create_dealers(self):
+        users = self.create_users('dealer', self.dealership_count * self.dealers_per_dealership)
+        profiles = []
+        for number, user in enumerate(users):
+            # One manager per dealership's worth of dealers, the rest in sales
+            role = 'M' if number % self.dealers_per_dealership == 0 else 'S'
+            profiles.append(DealerProfile(user=user, role=role, phone='0400000000'))
+        profiles = DealerProfile.objects.bulk_create(profiles, batch_size=self.batch_size)
+
+        memberships = []
+        self.dealers_by_dealership = {dealership.id: [] for dealership in self.dealerships}
+        for number, profile in enumerate(profiles):
+            dealership = self.dealerships[number // self.dealers_per_dealership]
+            member_of = {dealership}
+            if profile.role == 'M' and self.random.random() < 0.3:
+                # Some managers run a second dealership
+                member_of.add(self.random.choice(self.dealerships))
+            for each in member_of:
+                memberships.append(DealerProfile.dealerships.through(dealerprofile_id=profile.id, dealership_id=each.id))
+                self.dealers_by_dealership[each.id].append(profile)
+        DealerProfile.dealerships.through.objects.bulk_create(memberships, batch_size=self.batch_size)
+        self.counts['dealers'] = len(profiles)
+
+    def create_wholesalers(self):
+        users = self.create_users('wholesaler', self.wholesaler_count)
+        profiles = []
+        for user in users:
+            suburb, state, postcode = self.random.choice(SUBURBS)
+            profiles.append(WholesalerProfile(
+                user=user, wholesaler_name=f'{user.last_name} Wholesale {user.id}', street_address='1 Trade St',
+                suburb=suburb, state=state, postcode=postcode, email=user.email, phone='0400000000',
+            ))
+        self.wholesalers = WholesalerProfile.objects.bulk_create(profiles, batch_size=self.batch_size)
+
+        # A few wholesalers are in almost every network and most are in a handful
+        weights = self.zipf_weights(len(self.wholesalers), exponent=0.8)
+        memberships = []
+        self.network = {}
+        for dealership in self.dealerships:
+            size = min(len(self.wholesalers), max(3, int(self.random.paretovariate(1.5) * 10)))
+            chosen = {self.wholesalers[index] for index in self.random.choices(range(len(self.wholesalers)), weights, k=size)}
+            self.network[dealership.id] = sorted(chosen, key=lambda profile: profile.id)
+            memberships.extend(Dealership.wholesalers.through(dealership_id=dealership.id, wholesalerprofile_id=profile.id)
+                               for profile in chosen)
+        Dealership.wholesalers.through.objects.bulk_create(memberships, batch_size=self.batch_size)
+        self.wholesaler_weights = {profile.id: weight for profile, weight in zip(self.wholesalers, weights)}
+        self.counts['wholesalers'] = len(self.wholesalers)
+
+    def build_appraisal(self):
+        dealership = self.random.choices(self.dealerships, self.dealership_weights)[0]
+        dealer = self.random.choice(self.dealers_by_dealership[dealership.id])
+        make, model, body_type, new_price = self.random.choices(VEHICLES, self.zipf_weights(len(VEHICLES), 0.9))[0]
+        age = min(int(self.random.expovariate(1 / 5)), 20)
+        odometer = max(100, int(self.random.lognormvariate(9.6, 0.5) * max(age, 0.3)))
+        value = new_price * (0.85 ** age) * self.random.uniform(0.85, 1.1)
+        started = self.recent_datetime()
+        first_name, last_name = self.person()
+        return Appraisal(
+            dealership=dealership, initiating_dealer=dealer, last_updating_dealer=dealer,
+            start_date=started, last_updated=self.until_now(started + timedelta(hours=self.random.randint(0, 72))),
+            is_active=self.random.random() > 0.03, ready_for_management=self.random.random() < 0.8,
+            customer_first_name=first_name, customer_last_name=last_name,
+            customer_email=f'{first_name}.{last_name}@example.com'.lower(), customer_phone='0400000000',
+            vehicle_make=make, vehicle_model=model, vehicle_year=self.now.year - age,
+            vehicle_vin=f'{self.random.getrandbits(64):017X}'[:17], vehicle_registration=f'{self.random.getrandbits(24):06X}',
+            color=self.random.choice(COLOURS), odometer_reading=odometer, engine_type='2.0L',
+            transmission=self.weighted(TRANSMISSIONS), body_type=body_type, fuel_type=self.weighted(FUEL_TYPES),
+            reserve_price=Decimal(int(value)),
+        )
+
+    def build_offers(self, appraisal):
+        network = self.network[appraisal.dealership_id]
+        if not network or not appraisal.ready_for_management:
+            return []
+        count = min(len(network), int(self.random.expovariate(1 / self.offers_per_appraisal))) if self.offers_per_appraisal else 0
+        weights = [self.wholesaler_weights[profile.id] for profile in network]
+        chosen = set()
+        while len(chosen) < count:
+            chosen.add(self.random.choices(network, weights)[0])
+
+        offers = []
+        for profile in sorted(chosen, key=lambda each: each.id):
+            invited = self.until_now(appraisal.start_date + timedelta(hours=self.random.randint(1, 24)))
+            offer = Offer(appraisal=appraisal, user=profile, created_at=invited, updated_at=invited)
+            outcome = self.random.random()
+            if outcome < 0.7:
+                # Priced around the reserve, most a little under it
+                offer.amount = (appraisal.reserve_price * Decimal(self.random.gauss(0.95, 0.08))).quantize(Decimal('1'))
+                offer.offer_made_at = offer.updated_at = self.until_now(invited + timedelta(minutes=int(self.random.expovariate(1 / 240))))
+                if self.random.random() < 0.1:
+                    offer.adjusted_amount = offer.amount - Decimal(self.random.randint(1, 10) * 100)
+            elif outcome < 0.85:
+                offer.passed = True
+            offers.append(offer)
+        return offers
+
+    def build_comments(self, appraisal):
+        count = int(self.random.expovariate(1 / self.comments_per_appraisal)) if self.comments_per_appraisal else 0
+        return [
+            Comment(appraisal=appraisal, user_id=appraisal.initiating_dealer.user_id, is_private=self.random.random() < 0.3,
+                    comment=self.random.choice(('Clean car', 'Needs tyres', 'Service history in glovebox', 'Minor scratches')),
+                    comment_date_time=self.until_now(appraisal.start_date + timedelta(minutes=self.random.randint(1, 600))))
+            for _ in range(count)
+        ]
+
+    def build_damages(self, appraisal):
+        count = int(self.random.expovariate(1 / self.damages_per_appraisal)) if self.damages_per_appraisal else 0
+        return [
+            Damage(appraisal=appraisal, location=self.random.choice(DAMAGE_LOCATIONS), description='Synthetic damage',
+                   repair_cost_estimate=Decimal(int(self.random.lognormvariate(6, 0.8))))
+            for _ in range(count)
+        ]
+
+    def create_appraisal_batch(self, size):
+        appraisals = [self.build_appraisal() for _ in range(size)]
+        with transaction.atomic():
+            first_seq = next_change_seq(len(appraisals)) - len(appraisals) + 1
+            for offset, appraisal in enumerate(appraisals):
+                appraisal.change_seq = first_seq + offset
+            with explicit_timestamps(*timestamp_fields(Appraisal, 'start_date', 'last_updated')):
+                Appraisal.objects.bulk_create(appraisals, batch_size=self.batch_size)
+
+            offers = [offer for appraisal in appraisals for offer in self.build_offers(appraisal)]
+            comments = [comment for appraisal in appraisals for comment in self.build_comments(appraisal)]
+            with explicit_timestamps(*timestamp_fields(Offer, 'created_at', 'updated_at'), *timestamp_fields(Comment, 'comment_date_time')):
+                Offer.objects.bulk_create(offers, batch_size=self.batch_size)
+                Comment.objects.bulk_create(comments, batch_size=self.batch_size)
+            damages = [damage for appraisal in appraisals for damage in self.build_damages(appraisal)]
+            Damage.objects.bulk_create(damages, batch_size=self.batch_size)
+
+            # Most appraisals with priced offers have a winner, usually the best offer
+            offers_by_appraisal = {}
+            for offer in offers:
+                if offer.amount is not None:
+                    offers_by_appraisal.setdefault(offer.appraisal_id, []).append(offer)
+            won = []
+            for appraisal in appraisals:
+                priced = offers_by_appraisal.get(appraisal.id)
+                if priced and self.random.random() < 0.6:
+                    ranked = sorted(priced, key=lambda offer: offer.amount, reverse=True)
+                    appraisal.winner = ranked[0] if self.random.random() < 0.85 else self.random.choice(ranked)
+                    won.append(appraisal)
+            Appraisal.objects.bulk_update(won, ['winner'], batch_size=500)
+            Appraisal.objects.filter(pk__in=[appraisal.id for appraisal in appraisals]).refresh_dealer_status()
+
+        for name, rows in (('appraisals', appraisals), ('offers', offers), ('comments', comments), ('damages', damages)):
+            self.counts[name] = self.counts.get(name, 0) + len(rows)
+
+    def create_friend_requests(self):
+        requests = []
+        for _ in range(self.friend_request_count):
+            sender = self.random.choice(self.wholesalers)
+            request = FriendRequest(sender=sender, created_at=self.recent_datetime(),
+                                    status=self.weighted((('pending', 50), ('accepted', 35), ('rejected', 15))))
+            if self.random.random() < 0.8:
+                request.dealership = self.random.choices(self.dealerships, self.dealership_weights)[0]
+            else:
+                request.recipient_wholesaler = self.random.choice(self.wholesalers)
+            requests.append(request)
+        with explicit_timestamps(*timestamp_fields(FriendRequest, 'created_at')):
+            FriendRequest.objects.bulk_create(requests, batch_size=self.batch_size)
+        self.counts['friend_requests'] = len(requests)
+
+    def rebuild_derived(self):
+        for _ in rebuild_rollups():
+            pass
+        rebuild_leaderboard()
+        get_search_backend().rebuild()
+        refresh_market_stats(full=True)
+
+    def run(self, progress=None):
+        progress = progress or (lambda message: None)
+        self.create_dealerships()
+        self.create_dealers()
+        self.create_wholesalers()
+        progress(f'Created {self.dealership_count} dealerships, {self.counts["dealers"]} dealers and {self.counts["wholesalers"]} wholesalers.')
+
+        for start in range(0, self.appraisal_count, self.batch_size):
+            self.create_appraisal_batch(min(self.batch_size, self.appraisal_count - start))
+            progress(f'Created {self.counts["appraisals"]} of {self.appraisal_count} appraisals.')
+
+        self.create_friend_requests()
+        self.rebuild_derived()
+        self.counts['dealerships'] = self.dealership_count
+        return self.counts
+
+
+def seed_synthetic_data(progress=None, **options):
+    """
+    Create a synthetic dataset; see SyntheticDataset for the options. Returns the number of rows created per model.
+    """
+    return SyntheticDataset(**options).run(progress)
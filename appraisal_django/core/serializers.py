@@ -2,10 +2,51 @@ from rest_framework import serializers
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
 from .models import *
+from .market import compare_to_market, market_stats_for
+from .authentication import get_role_context
 from datetime import timezone, datetime
 from django.db import transaction
 from django.db.models import Q
 from rest_framework.exceptions import PermissionDenied
+from rest_framework.reverse import reverse
+from collections import defaultdict
+
+
+def get_sparse_fieldset(request):
+    """
+    Parse the `fields` and `omit` query parameters into two sets of field names.
+    Both take comma separated names and may be repeated.
+    """
+    def parse(param):
+        return {name.strip() for value in request.query_params.getlist(param) for name in value.split(',') if name.strip()}
+
+    return parse('fields'), parse('omit')
+
+
+class SparseFieldsetMixin:
+    """
+    Trims the top-level fields of a read to `?fields=` and drops any listed in `?omit=`.
+    Runs alongside role-based field rules, so it can only narrow what the user may already see.
+    Nested serializers share the view's context but are left untouched.
+    """
+
+    def is_view_serializer(self):
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        return parent is None
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method not in ('GET', 'HEAD') or not self.is_view_serializer():
+            return fields
+
+        requested, omitted = get_sparse_fieldset(request)
+        for field_name in list(fields):
+            if (requested and field_name not in requested) or field_name in omitted:
+                fields.pop(field_name)
+        return fields
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -43,7 +84,7 @@ class UserLoginSerializer(serializers.Serializer):
     username = serializers.CharField()
     password = serializers.CharField()
 
-class DealershipSerializer(serializers.ModelSerializer):
+class DealershipSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     dealers = serializers.SerializerMethodField()
 
     class Meta:
@@ -84,8 +125,7 @@ class DealershipNestedSerializer(serializers.ModelSerializer):
 class DealershipCurrentUserFKSerializer(serializers.PrimaryKeyRelatedField):
     def get_queryset(self):
         request = self.context.get('request', None)
-        user = request.user
-        return user.dealerprofile.dealerships.all()
+        return Dealership.objects.filter(id__in=get_role_context(request.user).dealership_ids)
     
     def to_internal_value(self, data):
         queryset = self.get_queryset()
@@ -93,7 +133,7 @@ class DealershipCurrentUserFKSerializer(serializers.PrimaryKeyRelatedField):
             raise serializers.ValidationError("You are not associated with this dealership.")
         return super().to_internal_value(data)
 
-class DealerProfileSerializer(serializers.ModelSerializer):
+class DealerProfileSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """
     Serializer for DealerProfile model.
     """
@@ -207,46 +247,75 @@ class WholesalerInviteSerializer(serializers.Serializer):
     def validate_wholesalers(self, value):
         if not value:
             raise serializers.ValidationError("No wholesalers provided")
-        return value
+        # Keep the first occurrence of each id, in the order given
+        return list(dict.fromkeys(value))
 
     def validate(self, data):
         dealership = self.context['dealership']
-        wholesaler_ids = data['wholesalers']
 
-        # Check if all provided wholesaler IDs are associated with the dealership
-        dealership_wholesaler_ids = dealership.wholesalers.values_list('id', flat=True)
-        for wholesaler_id in wholesaler_ids:
-            if wholesaler_id not in dealership_wholesaler_ids:
-                raise serializers.ValidationError(f"Wholesaler {wholesaler_id} is not associated with the dealership")
+        # Check all the wholesalers against the dealership's network in one query
+        unknown = set(data['wholesalers']) - set(dealership.wholesalers.values_list('id', flat=True))
+        if unknown:
+            raise serializers.ValidationError(f"Wholesaler {min(unknown)} is not associated with the dealership")
         return data
 
     def create_invites(self):
-        data = self.validated_data
-        dealership = self.context['dealership']
-        wholesaler_ids = data['wholesalers']
-
-        invited_wholesalers = []
-        for wholesaler_id in wholesaler_ids:
-            try:
-                wholesaler = WholesalerProfile.objects.get(id=wholesaler_id)
-                # Create or get the invite
-                offer, created = Offer.objects.get_or_create(
-                    appraisal=self.context['appraisal'],
-                    user=wholesaler,
-                    defaults={'passed': False, 'amount': None}
-                )
-                invited_wholesalers.append(wholesaler_id)
-            except WholesalerProfile.DoesNotExist:
-                continue  # Skip wholesaler ID if it does not exist
-        
-        return invited_wholesalers
-    
+        wholesaler_ids = self.validated_data['wholesalers']
+        Offer.bulk_invite([self.context['appraisal'].id], wholesaler_ids)
+        return wholesaler_ids
+
+
+class BulkWholesalerInviteSerializer(WholesalerInviteSerializer):
+    """
+    Invites the same wholesalers to several appraisals at once, e.g. for an auction batch.
+    """
+    MAX_APPRAISALS = 500
+
+    appraisals = serializers.ListField(
+        child=serializers.IntegerField(),
+        write_only=True
+    )
+
+    def validate_appraisals(self, value):
+        if not value:
+            raise serializers.ValidationError("No appraisals provided")
+        value = list(dict.fromkeys(value))
+        if len(value) > self.MAX_APPRAISALS:
+            raise serializers.ValidationError(f"At most {self.MAX_APPRAISALS} appraisals can be invited to at once")
+        return value
+
+    def validate(self, data):
+        # The appraisals must be visible to the user (context['appraisals'] is their queryset)
+        dealership_ids = dict(self.context['appraisals'].filter(id__in=data['appraisals']).values_list('id', 'dealership_id'))
+        missing = set(data['appraisals']) - set(dealership_ids)
+        if missing:
+            raise serializers.ValidationError(f"Appraisal {min(missing)} not found")
+
+        # Every wholesaler must be in the network of every appraisal's dealership
+        networks = defaultdict(set)
+        memberships = Dealership.wholesalers.through.objects.filter(
+            dealership_id__in=set(dealership_ids.values()), wholesalerprofile_id__in=data['wholesalers'],
+        ).values_list('dealership_id', 'wholesalerprofile_id')
+        for dealership_id, wholesaler_id in memberships:
+            networks[dealership_id].add(wholesaler_id)
+        for dealership_id in sorted(set(dealership_ids.values())):
+            unknown = set(data['wholesalers']) - networks[dealership_id]
+            if unknown:
+                raise serializers.ValidationError(f"Wholesaler {min(unknown)} is not associated with dealership {dealership_id}")
+        return data
+
+    def create_invites(self):
+        wholesaler_ids = self.validated_data['wholesalers']
+        Offer.bulk_invite(self.validated_data['appraisals'], wholesaler_ids)
+        return wholesaler_ids
+
+
 class SearchResultSerializer(serializers.Serializer):
     id = serializers.IntegerField()
     name = serializers.CharField()
     type = serializers.CharField()  # 'dealership' or 'wholesaler'
 
-class WholesalerProfileSerializer(serializers.ModelSerializer):
+class WholesalerProfileSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     user = UserSerializer()
     friends = serializers.SerializerMethodField()
     # dealerships = serializers.SerializerMethodField()
@@ -342,14 +411,26 @@ class CommentSerializer(serializers.ModelSerializer):
         }
 
 
-class OfferSerializer(serializers.ModelSerializer):
+class OfferSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     user = serializers.SerializerMethodField()
+    vs_market = serializers.SerializerMethodField()
 
     class Meta:
         model = Offer
-        fields = ['id', 'user', 'amount', 'adjusted_amount', 'passed', 'created_at', 'offer_made_at']
+        fields = ['id', 'user', 'amount', 'adjusted_amount', 'passed', 'created_at', 'offer_made_at', 'vs_market']
         read_only_fields = ['user', 'adjusted_amount', 'offer_created_at']
 
+    def get_fields(self):
+        fields = super().get_fields()
+        # Only shown when the view supplies market statistics, as {appraisal_id: stats}
+        if 'market_stats' not in self.context:
+            fields.pop('vs_market', None)
+        return fields
+
+    def get_vs_market(self, obj):
+        amount = obj.adjusted_amount if obj.adjusted_amount is not None else obj.amount
+        return compare_to_market(amount, self.context['market_stats'].get(obj.appraisal_id))
+
     def get_user(self, obj):
         user = obj.user
         return {
@@ -364,8 +445,7 @@ class OfferSerializer(serializers.ModelSerializer):
 
     # TODO: This can be done in the viewset
     def validate(self, attrs):
-        user = self.context['request'].user
-        if not hasattr(user, 'wholesalerprofile'):
+        if not get_role_context(self.context['request'].user).is_wholesaler:
             raise serializers.ValidationError("Only wholesalers can make an offer.")
         return attrs
 
@@ -401,7 +481,7 @@ class DamageSerializer(serializers.ModelSerializer):
 
     
 
-class AppraisalSerializer(serializers.ModelSerializer):
+class AppraisalSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     initiating_dealer = DealerProfileNestedSerializer(read_only=True)
     last_updating_dealer = DealerProfileNestedSerializer(read_only=True)
     dealership = DealershipCurrentUserFKSerializer()  
@@ -413,6 +493,7 @@ class AppraisalSerializer(serializers.ModelSerializer):
     offers = serializers.SerializerMethodField()
     invites = serializers.SerializerMethodField()
     status = serializers.SerializerMethodField() 
+    market_stats = serializers.SerializerMethodField()
 
     class Meta:
         model = Appraisal
@@ -422,9 +503,43 @@ class AppraisalSerializer(serializers.ModelSerializer):
             'customer_email', 'customer_phone', 'vehicle_make', 'vehicle_model', 'vehicle_year', 
             'vehicle_vin', 'vehicle_registration', 'color', 'odometer_reading', 'engine_type', 
             'transmission', 'body_type', 'fuel_type', 'reserve_price', 'damages', 'vehicle_photos',
-            'private_comments', 'general_comments', 'winner', 'status', 'offers', 'invites',
+            'private_comments', 'general_comments', 'winner', 'status', 'offers', 'invites', 'market_stats',
         ]
 
+    # Fields hidden from each role. They are removed before serialization, so they are never computed.
+    sales_hidden_fields = ('offers', 'invites')
+    wholesaler_hidden_fields = (
+        'invites', 'private_comments', 'reserve_price', 'winner', 'customer_phone', 'customer_email',
+        'customer_first_name', 'customer_last_name', 'ready_for_management', 'market_stats',
+    )
+
+    def get_hidden_fields(self):
+        request = self.context.get('request')
+        context = get_role_context(request.user if request else None)
+
+        if context.is_wholesaler:
+            return self.wholesaler_hidden_fields
+        if context.is_sales:
+            return self.sales_hidden_fields
+        return ()
+
+    def get_fields(self):
+        fields = super().get_fields()
+        for field_name in self.get_hidden_fields():
+            fields.pop(field_name, None)
+
+        # Market statistics are opt-in with ?market=true
+        request = self.context.get('request')
+        if request is None or request.query_params.get('market') not in ('1', 'true'):
+            fields.pop('market_stats', None)
+        return fields
+
+    def get_market_stats(self, obj):
+        # AppraisalViewSet annotates the statistics; fall back to looking them up
+        if not hasattr(obj, 'market_stats_data'):
+            obj.market_stats_data = market_stats_for(obj)
+        return obj.market_stats_data
+
     def get_winner(self, obj):
         # Check if the winner field is not None
         if obj.winner:
@@ -437,22 +552,28 @@ class AppraisalSerializer(serializers.ModelSerializer):
             }
         return None
     
+    # The *_list attributes are filled by AppraisalViewSet.apply_query_plan; fall back to querying without them
+
     def get_general_comments(self, obj):
-        comments = obj.comments.filter(is_private=False)
+        comments = getattr(obj, 'general_comment_list', None)
+        if comments is None:
+            comments = obj.comments.filter(is_private=False)
         return CommentSerializer(comments, many=True).data
 
     def get_private_comments(self, obj):
-        comments = obj.comments.filter(is_private=True)
+        comments = getattr(obj, 'private_comment_list', None)
+        if comments is None:
+            comments = obj.comments.filter(is_private=True)
         return CommentSerializer(comments, many=True).data
 
     def get_status(self, obj):
         request = self.context.get('request')
-        user = request.user if request else None
+        context = get_role_context(request.user if request else None)
 
-        if hasattr(user, 'dealerprofile'):
+        if context.is_dealer:
             return obj.get_dealer_status()
-        elif hasattr(user, 'wholesalerprofile'):
-            return obj.get_wholesaler_status(user.wholesalerprofile)
+        elif context.is_wholesaler:
+            return obj.get_wholesaler_status(context.wholesaler_profile)
         return "Not authorized"
     
     # def get_offers(self, obj):
@@ -463,66 +584,60 @@ class AppraisalSerializer(serializers.ModelSerializer):
 
     def get_offers(self, obj):
         request = self.context.get('request')
-        user = request.user
+        role_context = get_role_context(request.user)
+        offer_list = getattr(obj, 'offer_list', None)
         
         # Check if the user is a wholesaler and filter offers accordingly
-        if hasattr(user, 'wholesalerprofile'):
+        if role_context.is_wholesaler:
             # Show only the offers made by the wholesaler
-            offers = obj.offers.filter(user=user.wholesalerprofile)
-        elif hasattr(user, 'dealerprofile'):
+            if offer_list is None:
+                offers = obj.offers.filter(user_id=role_context.wholesaler_profile_id)
+            else:
+                offers = [offer for offer in offer_list if offer.user_id == role_context.wholesaler_profile_id]
+        elif role_context.is_dealer:
             # Show all offers for dealers
-            offers = obj.offers.filter(
-                Q(amount__isnull=False) | Q(passed=True)
-            )
+            if offer_list is None:
+                offers = obj.offers.filter(
+                    Q(amount__isnull=False) | Q(passed=True)
+                )
+            else:
+                offers = [offer for offer in offer_list if offer.amount is not None or offer.passed]
         else:
             # If the user is neither a wholesaler nor a dealer, deny access
             raise PermissionDenied("You are not authorized to view offers.")
 
-        return OfferSerializer(offers, many=True).data
+        context = {}
+        if 'market_stats' in self.fields:
+            context['market_stats'] = {obj.id: self.get_market_stats(obj)}
+        return OfferSerializer(offers, many=True, context=context).data
     
     def get_invites(self, obj):
-        invites = obj.offers.filter(amount__isnull=True, passed=False)
+        offer_list = getattr(obj, 'offer_list', None)
+        if offer_list is None:
+            invites = obj.offers.filter(amount__isnull=True, passed=False)
+        else:
+            invites = [offer for offer in offer_list if offer.amount is None and not offer.passed]
         return InviteSerializer(invites, many=True).data
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        request = self.context.get('request')
-        user = request.user
 
         # Include detailed dealership information
-        dealership = instance.dealership
-        if dealership:
-            dealership_serializer = DealershipNestedSerializer(dealership)
+        if 'dealership' in representation and instance.dealership:
+            dealership_serializer = DealershipNestedSerializer(instance.dealership)
             representation['dealership'] = dealership_serializer.data
 
-        # Exclude fields based on user role
-        if hasattr(user, 'dealerprofile') and user.dealerprofile.role == 'S':
-            # Exclude fields for Sales Dealers
-            representation.pop('offers', None)
-            representation.pop('invites', None)
-
-        if hasattr(user, 'wholesalerprofile'):
-            representation.pop('invites', None)
-            representation.pop('private_comments', None)
-            representation.pop('reserve_price', None)
-            representation.pop('winner', None)
-            representation.pop('customer_phone', None)
-            representation.pop('customer_email', None)
-            representation.pop('customer_first_name', None)
-            representation.pop('customer_last_name', None)
-            representation.pop('ready_for_management', None)
-
-
         return representation
     
     def create(self, validated_data):
         request = self.context.get('request')
         user = request.user
-        dealer_profile = user.dealerprofile
+        role_context = get_role_context(user)
+        dealer_profile = role_context.dealer_profile
         
         # Validate if the dealer works for the given dealership
         dealership = validated_data.get('dealership')
-        if dealership and not dealer_profile.dealerships.filter(id=dealership.id).exists():
+        if dealership and dealership.id not in role_context.dealership_ids:
             raise serializers.ValidationError("You are not associated with this dealership.")
         
         validated_data['initiating_dealer'] = dealer_profile
@@ -555,7 +670,30 @@ class AppraisalSerializer(serializers.ModelSerializer):
 
         return instance
 
-class SimpleAppraisalSerializer(serializers.ModelSerializer):
+class DamageImportSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Damage
+        fields = ('location', 'description', 'repair_cost_estimate')
+
+
+class AppraisalImportSerializer(serializers.ModelSerializer):
+    """
+    One row of a bulk import (see core.imports). The dealership and initiating dealer are set for the whole file.
+    """
+    start_date = serializers.DateTimeField(required=False)  # Keeps the original date of historical appraisals
+    damages = DamageImportSerializer(many=True, required=False)
+
+    class Meta:
+        model = Appraisal
+        fields = [
+            'start_date', 'is_active', 'ready_for_management', 'customer_first_name', 'customer_last_name',
+            'customer_email', 'customer_phone', 'vehicle_make', 'vehicle_model', 'vehicle_year',
+            'vehicle_vin', 'vehicle_registration', 'color', 'odometer_reading', 'engine_type',
+            'transmission', 'body_type', 'fuel_type', 'reserve_price', 'damages',
+        ]
+
+
+class SimpleAppraisalSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     status = serializers.SerializerMethodField()
     
     class Meta:
@@ -568,15 +706,15 @@ class SimpleAppraisalSerializer(serializers.ModelSerializer):
 
     def get_status(self, obj):
         request = self.context.get('request')
-        user = request.user if request else None
+        context = get_role_context(request.user if request else None)
 
-        if hasattr(user, 'dealerprofile'):
+        if context.is_dealer:
             return obj.get_dealer_status()
-        elif hasattr(user, 'wholesalerprofile'):
-            return obj.get_wholesaler_status(user.wholesalerprofile)
+        elif context.is_wholesaler:
+            return obj.get_wholesaler_status(context.wholesaler_profile)
         return "Not authorized"
     
-class SimpleWholesalerAppraisalSerializer(serializers.ModelSerializer):
+class SimpleWholesalerAppraisalSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     status = serializers.SerializerMethodField()
     last_updating_dealer = DealerProfileNestedSerializer(read_only=True)
     dealership = DealershipNestedSerializer(read_only=True)
@@ -587,31 +725,13 @@ class SimpleWholesalerAppraisalSerializer(serializers.ModelSerializer):
 
     def get_status(self, obj):
         request = self.context.get('request')
-        user = request.user if request else None
+        context = get_role_context(request.user if request else None)
 
-        if hasattr(user, 'wholesalerprofile'):
-            return obj.get_wholesaler_status(user.wholesalerprofile)
+        if context.is_wholesaler:
+            return obj.get_wholesaler_status(context.wholesaler_profile)
         return "Not authorized"
     
 
-class AppraisalStatusSerializer(serializers.Serializer):
-    status = serializers.SerializerMethodField()
-
-    class Meta:
-        model = Appraisal
-        fields = ['status', 'start_date']
-
-    def get_status(self, obj):
-        request = self.context.get('request')
-        user = request.user if request else None
-
-        if hasattr(user, 'dealerprofile'):
-            return obj.get_dealer_status()
-        elif hasattr(user, 'wholesalerprofile'):
-            return obj.get_wholesaler_status(user.wholesalerprofile)
-        return "Not authorized"
-
-
 class SelectWinnerSerializer(serializers.Serializer):
     offer_id = serializers.IntegerField()
 
@@ -648,10 +768,8 @@ class FriendRequestSerializer(serializers.ModelSerializer):
         if data.get('recipient_wholesaler') and data.get('dealership'):
             raise serializers.ValidationError("Cannot specify both recipient wholesaler and dealership.")
         
-        user = self.context.get('request').user
-        try:
-            wholesaler_profile = user.wholesalerprofile
-        except WholesalerProfile.DoesNotExist:
+        wholesaler_profile = get_role_context(self.context.get('request').user).wholesaler_profile
+        if wholesaler_profile is None:
             raise serializers.ValidationError("Only wholesalers can send friend requests.")
         
         # Check for existing pending friend requests
@@ -666,9 +784,50 @@ class FriendRequestSerializer(serializers.ModelSerializer):
         return data
     
     def create(self, validated_data):
-        user = self.context.get('request').user
-        wholesaler_profile = user.wholesalerprofile
-
-        validated_data['sender'] = wholesaler_profile
+        validated_data['sender'] = get_role_context(self.context.get('request').user).wholesaler_profile
 
         return FriendRequest.objects.create(**validated_data)
+
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    # The download_csv filters, stored on the job as `filters`
+    start_date = serializers.DateTimeField(write_only=True, required=False)
+    end_date = serializers.DateTimeField(write_only=True, required=False)
+    dealership_id = serializers.IntegerField(write_only=True, required=False)
+    user_id = serializers.IntegerField(write_only=True, required=False)
+    filter = serializers.ListField(child=serializers.CharField(), write_only=True, required=False)
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ExportJob
+        fields = [
+            'id', 'kind', 'format', 'filters', 'status', 'row_count', 'file_size', 'error',
+            'created_at', 'started_at', 'finished_at', 'download_url',
+            'start_date', 'end_date', 'dealership_id', 'user_id', 'filter',
+        ]
+        read_only_fields = ['filters', 'status', 'row_count', 'file_size', 'error', 'created_at', 'started_at', 'finished_at']
+
+    def get_download_url(self, obj):
+        if obj.status != 'complete':
+            return None
+        return reverse('export-job-download', args=[obj.id], request=self.context.get('request'))
+
+    def validate(self, data):
+        context = get_role_context(self.context['request'].user)
+
+        if data.get('kind') == 'offers' and context.is_dealer and not context.is_management:
+            raise serializers.ValidationError("Only management can export offers.")
+
+        dealership_id = data.get('dealership_id')
+        if dealership_id and context.is_dealer and dealership_id not in context.dealership_ids:
+            raise serializers.ValidationError("You are not a member of this dealership.")
+
+        filters = {}
+        for name in ('start_date', 'end_date'):
+            if data.get(name):
+                filters[name] = data.pop(name).isoformat()
+        for name in ('dealership_id', 'user_id', 'filter'):
+            if data.get(name):
+                filters[name] = data.pop(name)
+        data['filters'] = filters
+        return data
@@ -1,3 +1,285 @@
-from django.test import TestCase
+import io
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .analytics import rebuild_leaderboard
+from .authentication import CachedTokenAuthentication, token_cache
+from .imports import import_appraisals
+from .models import (Appraisal, Comment, DealerProfile, Dealership, Offer, OfferMarketStats, WholesalerLeaderboard,
+                     WholesalerProfile)
+
+
+def create_dealership(name='Dealership'):
+    return Dealership.objects.create(dealership_name=name, street_address='1 Main St', suburb='Sydney', state='NSW',
+                                     postcode='2000', email='dealer@example.com', phone='0200000000')
+
+
+def create_dealer(username, dealership, role='M'):
+    user = User.objects.create_user(username=username, password='password')
+    profile = DealerProfile.objects.create(user=user, role=role, phone='0400000000')
+    profile.dealerships.add(dealership)
+    return profile
+
+
+def create_wholesaler(username, dealership):
+    user = User.objects.create_user(username=username, password='password')
+    profile = WholesalerProfile.objects.create(user=user, wholesaler_name=username, street_address='1 Side St',
+                                               suburb='Sydney', state='NSW', postcode='2000',
+                                               email='wholesaler@example.com', phone='0200000000')
+    dealership.wholesalers.add(profile)
+    return profile
+
+
+def create_appraisal(dealership, dealer, **fields):
+    values = dict(dealership=dealership, initiating_dealer=dealer, last_updating_dealer=dealer,
+                  customer_first_name='John', customer_last_name='Smith', customer_email='john@example.com',
+                  customer_phone='0400000000', vehicle_make='Toyota', vehicle_model='Corolla', vehicle_year=2018,
+                  vehicle_vin='VIN123', vehicle_registration='ABC123', color='Red', odometer_reading=50000,
+                  engine_type='1.8L', transmission='Automatic', body_type='Sedan', fuel_type='Petrol',
+                  reserve_price=Decimal('10000'))
+    values.update(fields)
+    return Appraisal.objects.create(**values)
+
+
+class WholesalerLeaderboardTests(TestCase):
+    def setUp(self):
+        self.dealership = create_dealership()
+        self.manager = create_dealer('manager', self.dealership)
+        self.wholesalers = [create_wholesaler(f'wholesaler{i}', self.dealership) for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.manager.user)
+
+    def make_winner(self, offer):
+        response = self.client.post(f'/api/offer/{offer.pk}/make-winner/')
+        self.assertEqual(response.status_code, 200)
+
+    def offers(self, appraisal):
+        return [Offer.objects.create(appraisal=appraisal, user=wholesaler, amount=Decimal('11000'))
+                for wholesaler in self.wholesalers]
+
+    def leaderboard(self):
+        rows = WholesalerLeaderboard.objects.filter(win_count__gt=0).order_by('dealership', 'initiating_dealer', 'wholesaler')
+        return list(rows.values_list('dealership_id', 'initiating_dealer_id', 'wholesaler_id', 'win_count'))
+
+    def assertLeaderboardMatchesRebuild(self):
+        incremental = self.leaderboard()
+        rebuild_leaderboard()
+        self.assertEqual(incremental, self.leaderboard())
+
+    def test_make_winner_and_replace_winner(self):
+        first, second, _ = self.offers(create_appraisal(self.dealership, self.manager))
+        self.make_winner(first)
+        self.make_winner(second)
+        self.assertLeaderboardMatchesRebuild()
+
+    def test_delete_winning_offer(self):
+        winning, _, _ = self.offers(create_appraisal(self.dealership, self.manager))
+        other, _, _ = self.offers(create_appraisal(self.dealership, self.manager))
+        self.make_winner(winning)
+        self.make_winner(other)
+        winning.delete()
+        self.assertLeaderboardMatchesRebuild()
+
+    def test_delete_won_appraisal(self):
+        appraisal = create_appraisal(self.dealership, self.manager)
+        offer, _, _ = self.offers(appraisal)
+        self.make_winner(offer)
+        Appraisal.objects.get(pk=appraisal.pk).delete()
+        self.assertLeaderboardMatchesRebuild()
+        self.assertEqual(self.leaderboard(), [])
+
+
+class AppraisalImportTests(TestCase):
+    header = 'customer_first_name,customer_last_name,customer_email,customer_phone,vehicle_make,vehicle_model,' \
+             'vehicle_year,vehicle_vin,vehicle_registration,color,odometer_reading,engine_type,transmission,' \
+             'body_type,fuel_type,reserve_price\n'
+
+    def setUp(self):
+        self.dealership = create_dealership()
+        self.manager = create_dealer('manager', self.dealership)
+
+    def csv(self, first_names):
+        rows = ''.join(f'{name},Smith,john@example.com,0400000000,Toyota,Corolla,2018,VIN123,ABC123,Red,50000,1.8L,'
+                       f'Automatic,Sedan,Petrol,10000\n' for name in first_names)
+        return self.header + rows
+
+    def test_file_not_utf8_is_reported(self):
+        # Latin-1, as saved by some spreadsheet programs
+        content = self.csv(['John'] * 300 + ['Ren\u00e9e']).encode('latin-1')
+        report = import_appraisals(io.BytesIO(content), self.dealership, self.manager, batch_size=50)
+
+        self.assertGreater(report['imported'], 0)
+        self.assertLess(report['imported'], 301)
+        self.assertEqual(Appraisal.objects.count(), report['imported'])
+        self.assertEqual(report['errors'][-1]['row'], None)
+        self.assertIn('UTF-8', report['errors'][-1]['errors']['non_field_errors'][0])
+
+    def test_upload_not_utf8_returns_report(self):
+        client = APIClient()
+        client.force_authenticate(user=self.manager.user)
+        upload = SimpleUploadedFile('appraisals.csv', self.csv(['Ren\u00e9e']).encode('latin-1'), content_type='text/csv')
+        response = client.post('/api/appraisals/import/', {'file': upload, 'dealership_id': self.dealership.pk}, format='multipart')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['imported'], 0)
+        self.assertEqual(response.data['errors'][0]['row'], None)
+
+    def test_command_rejects_dealer_outside_dealership(self):
+        other = create_dealership('Other')
+        with self.assertRaisesMessage(CommandError, 'does not belong'):
+            call_command('import_appraisals', 'appraisals.csv', dealership=other.pk, dealer='manager')
+        self.assertEqual(Appraisal.objects.count(), 0)
+
+
+class AppraisalSearchTests(TestCase):
+    def setUp(self):
+        self.dealership = create_dealership()
+        self.manager = create_dealer('manager', self.dealership)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.manager.user)
+
+    def search(self, keyword):
+        response = self.client.get('/api/appraisals/', {'filter': keyword})
+        self.assertEqual(response.status_code, 200)
+        return [appraisal['id'] for appraisal in response.data['results']]
+
+    def test_word_prefix(self):
+        corolla = create_appraisal(self.dealership, self.manager, vehicle_make='Toyota', vehicle_model='Corolla')
+        create_appraisal(self.dealership, self.manager, vehicle_make='Mazda', vehicle_model='CX5')
+        self.assertEqual(self.search('toyo cor'), [corolla.pk])
+
+    def test_vin_and_registration_substring(self):
+        appraisal = create_appraisal(self.dealership, self.manager, vehicle_vin='JTDBR32E530012345', vehicle_registration='ABC123')
+        create_appraisal(self.dealership, self.manager, vehicle_vin='WVWZZZ1JZXW000001', vehicle_registration='XYZ789')
+        self.assertEqual(self.search('E53001'), [appraisal.pk])
+        self.assertEqual(self.search('c123'), [appraisal.pk])
+
+    def test_substring_index_follows_updates(self):
+        appraisal = create_appraisal(self.dealership, self.manager, vehicle_registration='ABC123')
+        appraisal.vehicle_registration = 'QRS456'
+        appraisal.save()
+        self.assertEqual(self.search('c123'), [])
+        self.assertEqual(self.search('rs45'), [appraisal.pk])
+
+
+class OfferMarketComparisonTests(TestCase):
+    def setUp(self):
+        self.dealership = create_dealership()
+        self.manager = create_dealer('manager', self.dealership)
+        self.wholesaler = create_wholesaler('wholesaler', self.dealership)
+        self.appraisal = create_appraisal(self.dealership, self.manager, vehicle_make='Toyota', vehicle_model='Corolla',
+                                          vehicle_year=2018, odometer_reading=50000)
+        self.offer = Offer.objects.create(appraisal=self.appraisal, user=self.wholesaler, amount=Decimal('11000'))
+        OfferMarketStats.objects.create(vehicle_make='toyota', vehicle_model='corolla', vehicle_year=2018, odometer_band=2,
+                                        submitted_count=4, submitted_p25=Decimal('9000'), submitted_p50=Decimal('10000'),
+                                        submitted_p75=Decimal('10500'), offers_as_of=timezone.now())
+
+    def client_for(self, profile):
+        client = APIClient()
+        client.force_authenticate(user=profile.user)
+        return client
+
+    def get(self, profile, url, params=None):
+        response = self.client_for(profile).get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_with_market_stats(self):
+        url = f'/api/appraisals/{self.appraisal.pk}/offers/'
+        offer = self.get(self.manager, url)['results'][0]
+        self.assertEqual(offer['vs_market']['position'], 'above')
+
+        offer = self.get(self.manager, url, {'fields': 'id,vs_market'})['results'][0]
+        self.assertEqual(set(offer), {'id', 'vs_market'})
+
+        for params in ({'fields': 'id,amount'}, {'omit': 'vs_market'}):
+            offer = self.get(self.manager, url, params)['results'][0]
+            self.assertNotIn('vs_market', offer)
+            self.assertEqual(offer['id'], self.offer.pk)
+
+    def test_without_market_stats(self):
+        for url in ('/api/appraisals/list_invites/', f'/api/offer/{self.offer.pk}/'):
+            for params in ({}, {'fields': 'id,amount'}, {'fields': 'id'}, {'omit': 'vs_market'}):
+                data = self.get(self.wholesaler, url, params)
+                offer = data['results'][0] if 'results' in data else data
+                self.assertNotIn('vs_market', offer)
+                self.assertEqual(offer['id'], self.offer.pk)
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+        self.manager = create_dealer('manager', create_dealership())
+        self.token = Token.objects.create(user=self.manager.user)
+        self.authentication = CachedTokenAuthentication()
+
+    def test_warm_token_runs_no_queries(self):
+        self.authentication.authenticate_credentials(self.token.key)
+        with self.assertNumQueries(0):
+            user, _ = self.authentication.authenticate_credentials(self.token.key)
+        self.assertEqual(user.pk, self.manager.user_id)
+
+    def test_changes_in_this_process_are_seen_at_once(self):
+        self.authentication.authenticate_credentials(self.token.key)
+        self.manager.role = 'S'
+        self.manager.save()
+        user, _ = self.authentication.authenticate_credentials(self.token.key)
+        self.assertTrue(user.role_context.is_sales)
+
+        self.manager.user.is_active = False
+        self.manager.user.save()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authentication.authenticate_credentials(self.token.key)
+
+
+@override_settings(QUERY_BUDGET_ENABLED=True, QUERY_BUDGET_STRICT=True)
+class AppraisalQueryBudgetTests(TestCase):
+    """
+    The AppraisalViewSet budgets under strict mode, authenticated with real tokens on a cold token cache.
+    """
+
+    def setUp(self):
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+        self.dealership = create_dealership()
+        self.manager = create_dealer('manager', self.dealership)
+        self.sales = create_dealer('sales', self.dealership, role='S')
+        self.wholesalers = [create_wholesaler(f'wholesaler{i}', self.dealership) for i in range(2)]
+        self.appraisals = [create_appraisal(self.dealership, dealer) for dealer in (self.manager, self.sales) * 3]
+        for appraisal in self.appraisals:
+            for wholesaler in self.wholesalers:
+                Offer.objects.create(appraisal=appraisal, user=wholesaler, amount=Decimal('11000'))
+            Comment.objects.create(appraisal=appraisal, user=self.manager.user, comment='Clean car')
+            Comment.objects.create(appraisal=appraisal, user=self.manager.user, comment='Check tyres', is_private=True)
+
+    def get(self, profile, url, params=None):
+        # A new token on a cold cache: the request pays for authentication too
+        Token.objects.filter(user=profile.user).delete()
+        token_cache.clear()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=profile.user).key)
+        response = client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_within_budgets(self):
+        appraisal = self.appraisals[0]
+        for profile in (self.manager, self.sales, self.wholesalers[0]):
+            for url, params in (
+                ('/api/appraisals/', {}),
+                ('/api/appraisals/', {'market': 'true'}),
+                (f'/api/appraisals/{appraisal.pk}/', {}),
+                ('/api/appraisals/changes/', {}),
+                ('/api/appraisals/status-list/', {}),
+            ):
+                with self.subTest(user=profile.user.username, url=url, params=params):
+                    self.get(profile, url, params)
@@ -7,31 +7,254 @@ from rest_framework.authtoken.models import Token
 from .models import *
 from .serializers import *
 from .permissions import *
-from django.db.models import Q
-from django.http import HttpResponse
-import csv
+from .authentication import get_role_context
+from .search import filter_appraisals
+from .exports import export_settings, export_slots_taken, stream_appraisal_csv, submit_export_job
+from .analytics import record_winner_change
+from .imports import IMPORT_FORMATS, detect_format, import_appraisals
+from .changes import DEFAULT_CHANGE_LIMIT, MAX_CHANGE_LIMIT, change_record, changed_appraisals
+from .market import market_stats_for, market_stats_subquery
+from .pricing import DEFAULT_NEIGHBOURS, price_guidance_available, price_guidance_index
+from django.db.models import Q, Prefetch
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
+from django.http import FileResponse
 from django.db import IntegrityError
 from rest_framework import status
-from django.db import transaction
-from rest_framework.pagination import PageNumberPagination
+from django.db import transaction, connection, connections
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from rest_framework.pagination import PageNumberPagination, BasePagination
+from rest_framework.utils.urls import replace_query_param
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+import json
+import os
 from django.utils.dateparse import parse_datetime
-from django.db.models import Count
+from django.db.models import Avg, Case, Count, DateField, DecimalField, DurationField, ExpressionWrapper, F, FloatField, Max, Sum, Value, When, Window
+from django.db.models.functions import Cast, Coalesce, Rank, RowNumber, Trunc
+from datetime import datetime, time, timedelta
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.exceptions import NotFound
 from django.utils.dateparse import parse_date
-from collections import Counter
 from collections import defaultdict
-from decimal import Decimal, InvalidOperation
+from decimal import Decimal
 from rest_framework.exceptions import ValidationError
 
 
+# Granularities accepted by the `bucket` query parameter of the analytics actions
+DATE_BUCKETS = ('day', 'week', 'month')
+
+# Columns each `group_by` option of profit_loss groups on
+PROFIT_LOSS_GROUPS = {
+    'dealership': ('dealership_id', 'dealership__dealership_name'),
+    'dealer': ('initiating_dealer_id', 'initiating_dealer__user__first_name', 'initiating_dealer__user__last_name'),
+}
+
+
+def profit_loss_group(row, group_by):
+    if group_by == 'dealership':
+        group = {'id': row['dealership_id'], 'name': row['dealership__dealership_name'] or ''}
+    else:
+        name = f"{row['initiating_dealer__user__first_name'] or ''} {row['initiating_dealer__user__last_name'] or ''}"
+        group = {'id': row['initiating_dealer_id'], 'name': name.strip()}
+    group['profit_or_loss'] = float(row['profit_or_loss'])
+    return group
+
+
+# An offer's final price, after any adjustment by management
+OFFER_AMOUNT = Coalesce('adjusted_amount', 'amount')
+
+# Time from an offer being created (the invite) to the wholesaler making it
+OFFER_RESPONSE_TIME = ExpressionWrapper(F('offer_made_at') - F('created_at'), output_field=DurationField())
+
+
+def sort_status_counts(counts):
+    # Sort statuses by count (highest to lowest) and then by status name alphabetically
+    return [{'status': name, 'count': count} for name, count in sorted(counts, key=lambda x: (-x[1], x[0]))]
+
+
+def parse_bound(value):
+    """
+    Parse an ISO 8601 datetime or date query parameter; a bare date means midnight.
+    """
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        parsed = datetime.combine(day, time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def run_concurrently(tasks):
+    """
+    Call each of a dict of independent callables and return their results under the same keys.
+    The calls run on worker threads, each with its own database connection, unless the database is SQLite
+    (which serialises access anyway) or a transaction is open (other connections could not see its writes).
+    The workers' connections get the calling thread's execute wrappers, so their queries are counted and profiled
+    with the request's.
+    """
+    if connection.vendor == 'sqlite' or connection.in_atomic_block:
+        return {name: task() for name, task in tasks.items()}
+
+    wrappers = {each.alias: list(each.execute_wrappers) for each in connections.all()}
+
+    def run(task):
+        try:
+            with ExitStack() as stack:
+                for each in connections.all():
+                    for wrapper in wrappers.get(each.alias, ()):
+                        stack.enter_context(each.execute_wrapper(wrapper))
+                return task()
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+        futures = {name: executor.submit(run, task) for name, task in tasks.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def rollup_day_range(date_from, date_to):
+    """
+    Rollup filter matching start_date__range=[date_from, date_to] for dates, which compares against midnight of date_to.
+    """
+    return {'day__gte': date_from, 'day__lt': date_to}
+
+
+def is_day_boundary(value):
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.time() == time.min
+
+
+def wholesaler_win_row(row):
+    # Keys the best-performing wholesalers response has always used
+    return {
+        'winner__user_id': row['wholesaler_id'],
+        'winner__user__wholesaler_name': row['wholesaler__wholesaler_name'],
+        'winner__user__user__username': row['wholesaler__user__username'],
+        'count': row['count'],
+    }
+
+
+def truncate_date(value, bucket):
+    """
+    Python counterpart of Trunc(..., bucket) for a datetime or date, returning the first day of its bucket.
+    """
+    if isinstance(value, datetime):
+        value = (timezone.localtime(value) if timezone.is_aware(value) else value).date()
+    if bucket == 'week':
+        return value - timedelta(days=value.weekday())
+    if bucket == 'month':
+        return value.replace(day=1)
+    return value
+
+
+def date_buckets(start, end, bucket):
+    """
+    Every bucket start date from start to end inclusive.
+    """
+    if start is None or end is None:
+        return
+    current = start
+    while current <= end:
+        yield current
+        if bucket == 'month':
+            current = (current.replace(day=28) + timedelta(days=4)).replace(day=1)
+        else:
+            current += timedelta(days=7 if bucket == 'week' else 1)
+
+
 class CustomPagination(PageNumberPagination):
     page_size = 10  
     page_size_query_param = 'page_size'
     max_page_size = 1000
 
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a (timestamp, id) key, newest first.
+    Each page seeks past the last row of the previous one, so deep pages cost the same as the first and no COUNT(*) runs.
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+
+    def __init__(self, ordering):
+        self.field, self.tiebreaker = ordering
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def encode_cursor(self, row):
+        position = [getattr(row, self.field).isoformat(), getattr(row, self.tiebreaker)]
+        return urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            value, pk = json.loads(urlsafe_b64decode(cursor.encode()))
+            value, pk = parse_datetime(value), int(pk)
+        except (TypeError, ValueError):
+            value = None
+        if value is None:
+            raise NotFound('Invalid cursor')
+        return value, pk
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+
+        # Rows without a key value have no position in the sequence
+        queryset = queryset.filter(**{f'{self.field}__isnull': False})
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            value, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__lt': value}) | Q(**{self.field: value, f'{self.tiebreaker}__lt': pk})
+            )
+
+        # Fetch one extra row to learn whether there is a next page
+        rows = list(queryset.order_by(f'-{self.field}', f'-{self.tiebreaker}')[:page_size + 1])
+        self.next_cursor = self.encode_cursor(rows[page_size - 1]) if len(rows) > page_size else None
+        return rows[:page_size]
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+
+class KeysetPaginationMixin:
+    """
+    Lets clients opt in to KeysetPagination with `?paginate=cursor` on the actions listed in keyset_ordering_by_action.
+    Every other request keeps the viewset's page-number pagination.
+    """
+    keyset_ordering_by_action = {}
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            ordering = self.keyset_ordering_by_action.get(self.action)
+            if ordering and self.request.query_params.get('paginate') == 'cursor':
+                self._paginator = KeysetPagination(ordering)
+            elif self.pagination_class is None:
+                self._paginator = None
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+
 class PaginationMixin:
     pagination_class = CustomPagination
 
@@ -44,7 +267,29 @@ class PaginationMixin:
         return paginator.get_paginated_response(data)
 
 
-class DealershipViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.UpdateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin):
+class SparseFieldsetQueryMixin:
+    """
+    Narrows the SELECT to the columns behind the fields a `?fields=`/`?omit=` read renders.
+    Requests without either parameter load full rows as before.
+    """
+    # Serializer fields that read model columns under another name
+    sparse_field_columns = {}
+
+    def apply_sparse_fieldset(self, queryset, fields):
+        if not any(get_sparse_fieldset(self.request)):
+            return queryset
+
+        opts = queryset.model._meta
+        concrete = {field.name for field in opts.concrete_fields}
+        columns = {opts.pk.name}
+        for field_name in fields:
+            columns.update(self.sparse_field_columns.get(field_name, ()))
+            if field_name in concrete:
+                columns.add(field_name)
+        return queryset.only(*columns)
+
+
+class DealershipViewSet(SparseFieldsetQueryMixin, viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.UpdateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin):
     queryset = Dealership.objects.all()
     serializer_class = DealershipSerializer
     serializer_classes = {
@@ -67,11 +312,14 @@ class DealershipViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins
         queryset = Dealership.objects.none()  # Start with an empty queryset
         
         if user.is_authenticated:
-            try:
-                dealer_profile = user.dealerprofile
-                queryset = dealer_profile.dealerships.all()  # Only dealerships associated with the dealer
-            except DealerProfile.DoesNotExist:
-                pass  # Return empty queryset if dealer profile doesn't exist
+            # Only dealerships associated with the dealer; none for anyone else
+            queryset = Dealership.objects.filter(id__in=get_role_context(user).dealership_ids)
+
+        if self.action in ('list', 'retrieve'):
+            fields = self.get_serializer().fields
+            if 'wholesalers' in fields:
+                queryset = queryset.prefetch_related('wholesalers')
+            queryset = self.apply_sparse_fieldset(queryset, fields)
        
         return queryset
     
@@ -153,8 +401,7 @@ class DealershipViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins
         queryset = DealerProfile.objects.filter(dealerships=dealership, is_active=True)
         filtered_queryset = self.filter_queryset(queryset)
 
-        dealer_profile = request.user.dealerprofile  # Directly access the dealer profile
-        if dealership not in dealer_profile.dealerships.all():
+        if not get_role_context(request.user).in_dealership(dealership.id):
             return Response({'detail': 'Not authorized to view dealers of this dealership.'}, status=403)
 
         # Serialize the entire filtered queryset without pagination
@@ -233,9 +480,9 @@ class DealerProfileViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mix
         queryset = super().get_queryset()
         user = self.request.user
 
-        if hasattr(user, 'dealerprofile'):
-            dealer_profile = user.dealerprofile
-            queryset = queryset.filter(dealerships__in=dealer_profile.dealerships.all())
+        context = get_role_context(user)
+        if context.is_dealer:
+            queryset = queryset.filter(dealerships__in=context.dealership_ids)
         
         return queryset
     
@@ -244,9 +491,9 @@ class DealerProfileViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mix
         """
         Retrieve the dealer profile of the currently authenticated user.
         """
-        user = request.user
-        if hasattr(user, 'dealerprofile'):
-            serializer = self.get_serializer(user.dealerprofile)
+        dealer_profile = get_role_context(request.user).dealer_profile
+        if dealer_profile is not None:
+            serializer = self.get_serializer(dealer_profile)
             return Response(serializer.data)
         return Response({'detail': 'Dealer profile not found'}, status=status.HTTP_404_NOT_FOUND)
     
@@ -260,7 +507,7 @@ class DealerProfileViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mix
         """
         user = request.user
 
-        if not hasattr(user, 'dealerprofile'):
+        if not get_role_context(user).is_dealer:
             return Response({'error': 'User does not have a dealer profile'}, status=status.HTTP_403_FORBIDDEN)
 
         try:
@@ -289,13 +536,14 @@ class DealerProfileViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mix
         Only Management Dealers can deactivate their own account.
         """
         user = request.user
+        context = get_role_context(user)
 
-        if not hasattr(user, 'dealerprofile'):
+        if not context.is_dealer:
             return Response({'error': 'User does not have a dealer profile'}, status=status.HTTP_403_FORBIDDEN)
 
         try:
             # Fetch the dealer profile associated with the authenticated user
-            dealer_profile_to_deactivate = user.dealerprofile
+            dealer_profile_to_deactivate = context.dealer_profile
 
             # Deactivate the dealer profile
             dealer_profile_to_deactivate.is_active = False
@@ -393,20 +641,27 @@ class WholesalerProfileViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin,
         """
         Retrieve the wholesaler profile of the currently authenticated user.
         """
-        serializer = self.get_serializer(request.user.wholesalerprofile)
+        serializer = self.get_serializer(get_role_context(request.user).wholesaler_profile)
         return Response(serializer.data)
 
 
-class AppraisalViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.UpdateModelMixin, mixins.ListModelMixin):
+class AppraisalViewSet(KeysetPaginationMixin, SparseFieldsetQueryMixin, viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.UpdateModelMixin, mixins.ListModelMixin):
     queryset = Appraisal.objects.all()
     serializer_class = AppraisalSerializer
     pagination_class = CustomPagination
+    keyset_ordering_by_action = {
+        'list': ('start_date', 'id'),
+        'download_csv': ('start_date', 'id'),
+        'list_offers': ('created_at', 'id'),
+        'list_invites': ('created_at', 'id'),
+    }
+    sparse_field_columns = {'status': ('dealer_status',)}
+    # Queries per action, including the two a cold token costs (see core.middleware)
+    query_budgets = {'list': 8, 'retrieve': 7, 'changes': 4, 'status_list': 3, 'status': 3}
 
     def get_serializer_class(self):
         if self.action == 'simple_list':
             return SimpleAppraisalSerializer
-        elif self.action == 'status_list':
-            return AppraisalStatusSerializer
         elif self.action == 'wholesaler_dashboard_list':
             return SimpleWholesalerAppraisalSerializer
         return AppraisalSerializer
@@ -422,7 +677,9 @@ class AppraisalViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.
     @action(detail=False, methods=['get'], url_path='wholesaler-dashboard-list', permission_classes=[IsWholesaler])
     def wholesaler_dashboard_list(self, request, *args, **kwargs):
         # Get the latest 8 appraisals
-        queryset = self.filter_queryset(self.get_queryset()).order_by('-start_date')[:8]
+        queryset = (self.filter_queryset(self.get_queryset())
+                    .select_related('dealership', 'last_updating_dealer__user')
+                    .order_by('-start_date')[:8])
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
     
@@ -442,6 +699,11 @@ class AppraisalViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.
         from_date = request.query_params.get('from', None)
         to_date = request.query_params.get('to', None)
 
+        # Optional breakdown of the counts by day, week or month
+        bucket = request.query_params.get('bucket', None)
+        if bucket and bucket not in DATE_BUCKETS:
+            return Response({"detail": f"Invalid bucket. Use one of: {', '.join(DATE_BUCKETS)}."}, status=status.HTTP_400_BAD_REQUEST)
+
         # Filter queryset based on date range if provided
         queryset = self.filter_queryset(self.get_queryset())
 
@@ -453,36 +715,91 @@ class AppraisalViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.
             except ValueError:
                 return Response({"detail": "Invalid date format. Use ISO 8601 format."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Order by start_date or use any default ordering you need
-        queryset = queryset.order_by('-start_date')
-
-        # Serialize data
-        serializer = self.get_serializer(queryset, many=True)
-        
-        # Extract status from the serialized data
-        statuses = [item['status'] for item in serializer.data]
-        
-        # Count occurrences of each status
-        status_counts = Counter(statuses)
-        
-        # Sort statuses by count (highest to lowest) and then by status name alphabetically
-        sorted_statuses = sorted(status_counts.items(), key=lambda x: (-x[1], x[0]))
-        
-        # Convert to desired output format
-        result = [{'status': status, 'count': count} for status, count in sorted_statuses]
-        
+        # The status is a stored column for dealers and a SQL annotation for wholesalers
+        status_field = get_role_context(request.user).status_field
+        if status_field is None:
+            return Response([])
+
+        # Count every status in a single GROUP BY (clear the ordering so it does not leak into the grouping)
+        group_by = [status_field]
+        if bucket:
+            queryset = queryset.annotate(bucket=Trunc('start_date', bucket, output_field=DateField()))
+            group_by = ['bucket', status_field]
+        rows = queryset.order_by().values(*group_by).annotate(count=Count('id'))
+
+        if not bucket:
+            return Response(sort_status_counts((row[status_field], row['count']) for row in rows))
+
+        buckets = defaultdict(list)
+        for row in rows:
+            buckets[row['bucket']].append((row[status_field], row['count']))
+
+        result = [
+            {
+                'date': day.isoformat(),
+                'total': sum(count for _, count in counts),
+                'statuses': sort_status_counts(counts),
+            }
+            for day, counts in sorted(buckets.items())
+        ]
         return Response(result)
     
+    # Read actions that render AppraisalSerializer and should load its related rows up front
+    query_plan_actions = ('list', 'retrieve', 'download_csv')
+
+    def apply_query_plan(self, queryset):
+        """
+        Join and prefetch everything AppraisalSerializer reads, so a page costs a fixed number of queries.
+        Relations behind fields the serializer drops for the user's role or a sparse fieldset are not loaded at all.
+        """
+        context = get_role_context(self.request.user)
+        fields = AppraisalSerializer(context=self.get_serializer_context()).fields
+        comments = Comment.objects.select_related('user')
+
+        related = []
+        if 'dealership' in fields:
+            related.append('dealership')
+        if 'initiating_dealer' in fields:
+            related.append('initiating_dealer__user')
+        if 'last_updating_dealer' in fields:
+            related.append('last_updating_dealer__user')
+        if 'winner' in fields:
+            related.append('winner__user__user')
+
+        prefetches = []
+        if 'damages' in fields:
+            prefetches.append('damages')
+        if 'general_comments' in fields:
+            prefetches.append(Prefetch('comments', queryset=comments.filter(is_private=False), to_attr='general_comment_list'))
+        if 'private_comments' in fields:
+            prefetches.append(Prefetch('comments', queryset=comments.filter(is_private=True), to_attr='private_comment_list'))
+        if 'offers' in fields or 'invites' in fields:
+            if context.is_wholesaler:
+                # Wholesalers only ever see their own offer
+                offers = Offer.objects.filter(user_id=context.wholesaler_profile_id)
+            else:
+                offers = Offer.objects.all()
+            prefetches.append(Prefetch('offers', queryset=offers.select_related('user__user'), to_attr='offer_list'))
+
+        if 'market_stats' in fields:
+            queryset = queryset.annotate(market_stats_data=market_stats_subquery())
+
+        if related:
+            # select_related() with no arguments would follow every foreign key
+            queryset = queryset.select_related(*related)
+        queryset = queryset.prefetch_related(*prefetches)
+        return self.apply_sparse_fieldset(queryset, fields)
+
     def get_queryset(self):
-        user = self.request.user
+        context = get_role_context(self.request.user)
 
-        if hasattr(user, 'wholesalerprofile'):
-            # Fetch appraisals that the wholesaler has made offers on
-            queryset = Appraisal.objects.filter(offers__user=user.wholesalerprofile).distinct()
+        if context.is_wholesaler:
+            # Fetch appraisals that the wholesaler has made offers on, with their status computed in SQL
+            queryset = Appraisal.objects.with_wholesaler_status(context.wholesaler_profile).filter(own_offer_id__isnull=False)
 
-        elif hasattr(user, 'dealerprofile'):
-            user_dealership_ids = user.dealerprofile.dealerships.values_list('id', flat=True)
-            queryset = Appraisal.objects.filter(dealership_id__in=user_dealership_ids)
+        elif context.is_dealer:
+            # The dealership ids are known already, so this is a literal IN list rather than a subquery
+            queryset = Appraisal.objects.filter(dealership_id__in=context.dealership_ids)
 
         else:
             queryset = Appraisal.objects.none()
@@ -490,6 +807,9 @@ class AppraisalViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.
         queryset = self.filter_queryset(queryset)
         queryset = self.filter_queryset_by_keyword(queryset)
 
+        if self.action in self.query_plan_actions and self.request.method == 'GET':
+            queryset = self.apply_query_plan(queryset)
+
         return queryset
 
     def filter_queryset(self, queryset):
@@ -508,47 +828,9 @@ class AppraisalViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.
 
     def filter_queryset_by_keyword(self, queryset):
         filters = self.request.query_params.getlist('filter')  # Use getlist to get multiple filter values
-        user = self.request.user  # Get the current user
 
         if filters:
-            status_map = {
-                'Trashed': 'Trashed',
-                'Complete': 'Complete',
-                'Active': 'Active',
-                'Pending - Management': 'Pending - Management',
-                'Pending - Sales': 'Pending - Sales',
-                'Complete - Won': 'Complete - Won',
-                'Complete - Lost': 'Complete - Lost',
-                'Complete - Missed': 'Complete - Missed',
-                'Complete - Priced': 'Complete - Priced',
-                # Add more status mappings if needed
-            }
-
-            for keyword in filters:
-                # Filter queryset based on the status keyword
-                if keyword in status_map:
-                    status = status_map[keyword]
-                    if hasattr(user, 'wholesalerprofile'):
-                        queryset = queryset.filter(
-                            Q(id__in=[appraisal.id for appraisal in queryset if appraisal.get_wholesaler_status(user.wholesalerprofile) == status])
-                        )
-                    elif hasattr(user, 'dealerprofile'):
-                        queryset = queryset.filter(
-                            Q(id__in=[appraisal.id for appraisal in queryset if appraisal.get_dealer_status() == status])
-                        )
-                else:
-                    # Fallback to the existing keyword search if status does not match
-                    queryset = queryset.filter(
-                        Q(customer_email__icontains=keyword) |
-                        Q(vehicle_make__icontains=keyword) |
-                        Q(vehicle_model__icontains=keyword) |
-                        Q(vehicle_year__icontains=keyword) |
-                        Q(customer_last_name__icontains=keyword) |
-                        Q(vehicle_vin__icontains=keyword) |
-                        Q(customer_first_name__icontains=keyword) |
-                        Q(vehicle_registration__icontains=keyword) |
-                        Q(id__icontains=keyword)
-                    )
+            queryset = filter_appraisals(queryset, filters, get_role_context(self.request.user).status_field)
 
         return queryset
 
@@ -614,52 +896,10 @@ class AppraisalViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.
             
             if start_date and end_date:
                 queryset = queryset.filter(start_date__range=(start_date, end_date))
-            
-            queryset = self.filter_queryset_by_keyword(queryset)
-
-            # Create a response object for CSV
-            response = HttpResponse(content_type='text/csv')
-            response['Content-Disposition'] = 'attachment; filename="appraisals.csv"'
-
-            # Use pipe character as delimiter
-            writer = csv.writer(response, delimiter=',')
-            # Write headers
-            writer.writerow(['ID', 'Start Date', 'Last Updated', 'Is Active', 'Dealership', 'Initiating Dealer',
-                            'Last Updating Dealer', 'Customer First Name', 'Customer Last Name', 'Customer Email',
-                            'Customer Phone', 'Make', 'Model', 'Year', 'VIN', 'Registration', 'Color',
-                            'Odometer Reading', 'Engine Type', 'Transmission', 'Body Type', 'Fuel Type', 
-                            'Reserve Price'])
-
-            # Write data rows
-            for appraisal in queryset:
-                writer.writerow([
-                    appraisal.id,
-                    appraisal.start_date.isoformat() if appraisal.start_date else '',
-                    appraisal.last_updated.isoformat() if appraisal.last_updated else '',
-                    appraisal.is_active,
-                    appraisal.dealership.dealership_name,
-                    f"{appraisal.initiating_dealer.user.first_name} {appraisal.initiating_dealer.user.last_name}",
-                    f"{appraisal.last_updating_dealer.user.first_name} {appraisal.last_updating_dealer.user.last_name}",
-                    appraisal.customer_first_name,
-                    appraisal.customer_last_name,
-                    appraisal.customer_email,
-                    appraisal.customer_phone,
-                    appraisal.vehicle_make,
-                    appraisal.vehicle_model,
-                    appraisal.vehicle_year,
-                    appraisal.vehicle_vin,
-                    appraisal.vehicle_registration,
-                    appraisal.color,
-                    appraisal.odometer_reading,
-                    appraisal.engine_type,
-                    appraisal.transmission,
-                    appraisal.body_type,
-                    appraisal.fuel_type,
-                    appraisal.reserve_price
-                ])
 
-            
-            return response
+            # Stream the rows out in chunks instead of building the whole file in memory
+            compress = request.query_params.get('compress') == 'gzip'
+            return stream_appraisal_csv(queryset, compress=compress)
 
         else:
             # Handle GET request (filtering and returning JSON)
@@ -674,10 +914,12 @@ class AppraisalViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.
             
             if start_date and end_date:
                 queryset = queryset.filter(start_date__range=(start_date, end_date))
-            
-            queryset = self.filter_queryset_by_keyword(queryset)
 
-            queryset = queryset.order_by('-start_date')
+            # Keyword searches (applied in get_queryset) list the best matches first
+            if 'search_rank' in queryset.query.annotations:
+                queryset = queryset.order_by('search_rank', '-start_date')
+            else:
+                queryset = queryset.order_by('-start_date')
 
             # Paginate the queryset
             page = self.paginate_queryset(queryset)
@@ -689,11 +931,63 @@ class AppraisalViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.
             return Response(serializer.data)
 
     
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[IsDealer], parser_classes=[MultiPartParser, FormParser])
+    def import_appraisals(self, request, *args, **kwargs):
+        """
+        Create appraisals in bulk from an uploaded CSV or NDJSON `file` into `dealership_id`.
+        Valid rows are imported and the rest are reported by row number.
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"detail": "Upload the appraisals as `file`."}, status=status.HTTP_400_BAD_REQUEST)
+
+        file_format = request.data.get('format') or detect_format(upload.name)
+        if file_format not in IMPORT_FORMATS:
+            return Response({"detail": f"Invalid format. Use one of: {', '.join(IMPORT_FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        context = get_role_context(request.user)
+        dealership_id = request.data.get('dealership_id')
+        if not context.in_dealership(dealership_id):
+            return Response({"detail": "You are not associated with this dealership."}, status=status.HTTP_403_FORBIDDEN)
+        dealership = Dealership.objects.get(id=dealership_id)
+        dealer_profile = context.dealer_profile
+
+        report = import_appraisals(upload.file, dealership, dealer_profile, file_format)
+        return Response(report, status=status.HTTP_201_CREATED if report['imported'] else status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['get'], url_path='changes', permission_classes=[IsDealer | IsWholesaler])
+    def changes(self, request, *args, **kwargs):
+        """
+        Incremental export: the appraisals changed after `cursor` (a change_seq), oldest change first.
+        Pass the returned next_cursor on the next sync; trashed appraisals come back as tombstones.
+        A first sync may start from `since` (an ISO 8601 datetime matched against last_updated) instead of a cursor.
+        """
+        try:
+            cursor = int(request.query_params.get('cursor', 0))
+            limit = int(request.query_params.get('limit', DEFAULT_CHANGE_LIMIT))
+            since = parse_bound(request.query_params.get('since'))
+        except ValueError:
+            return Response({"detail": "cursor and limit must be integers and since an ISO 8601 datetime."}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, MAX_CHANGE_LIMIT))
+
+        queryset = self.get_queryset()
+        if since and 'cursor' not in request.query_params:
+            queryset = queryset.filter(last_updated__gte=since)
+
+        # Fetch one extra row to learn whether there is more to sync
+        rows = changed_appraisals(queryset, request.user, cursor, limit + 1)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return Response({
+            'results': [change_record(appraisal, request.user) for appraisal in rows],
+            'next_cursor': rows[-1].change_seq if rows else cursor,
+            'has_more': has_more,
+        })
+
     @action(detail=True, methods=['POST'], url_path='make-offer', permission_classes=[IsWholesaler])
     def make_offer(self, request, pk=None):
         appraisal = self.get_object()
-        user = request.user
-        wholesaler_profile = user.wholesalerprofile
+        wholesaler_profile = get_role_context(request.user).wholesaler_profile
         data = request.data
         amount = data.get('amount')
 
@@ -722,9 +1016,7 @@ class AppraisalViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.
     @action(detail=True, methods=['POST'], url_path='pass', permission_classes=[IsWholesaler])
     def pass_offer(self, request, pk=None):
         appraisal = self.get_object()
-        user = request.user
-
-        wholesaler_profile = user.wholesalerprofile
+        wholesaler_profile = get_role_context(request.user).wholesaler_profile
         # Check if an offer already exists
         offer, created = Offer.objects.get_or_create(
             appraisal=appraisal, user=wholesaler_profile,
@@ -761,15 +1053,19 @@ class AppraisalViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.
         offers = Offer.objects.filter(
             Q(amount__isnull=False) | Q(passed=True),
             appraisal=appraisal  # This should be before keyword arguments if any.
-        )
+        ).select_related('user__user')
+
+        # Each offer is compared with the appraisal's precomputed market bucket
+        context = self.get_serializer_context()
+        context['market_stats'] = {appraisal.id: market_stats_for(appraisal)}
 
         # Apply Pagination
         page = self.paginate_queryset(offers)
         if page is not None:
-            serializer = OfferSerializer(page, many=True)
+            serializer = OfferSerializer(page, many=True, context=context)
             return self.get_paginated_response(serializer.data)
 
-        serializer = OfferSerializer(offers, many=True)
+        serializer = OfferSerializer(offers, many=True, context=context)
         return Response(serializer.data, status=status.HTTP_200_OK)
     
 
@@ -777,7 +1073,7 @@ class AppraisalViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.
     def duplicate(self, request, pk=None):
         instance = self.get_object()
 
-        dealer_profile = request.user.dealerprofile
+        dealer_profile = get_role_context(request.user).dealer_profile
 
         # Duplicate the appraisal instance
         instance.id = None  # Reset ID to create a new instance
@@ -814,47 +1110,71 @@ class AppraisalViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+    @action(detail=False, methods=['post'], url_path='bulk-invite', permission_classes=[IsManagement])
+    def bulk_invite_wholesalers(self, request, *args, **kwargs):
+        """
+        Invite the same wholesalers to many appraisals in one call: {"appraisals": [...], "wholesalers": [...]}.
+        Pairs that are already invited are left as they are.
+        """
+        serializer = BulkWholesalerInviteSerializer(data=request.data, context={'appraisals': self.get_queryset()})
+        if serializer.is_valid():
+            invited_wholesalers = serializer.create_invites()
+            return Response({"appraisals": serializer.validated_data['appraisals'], "invited_wholesalers": invited_wholesalers},
+                            status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
     # Pagination Applied => api/offers/list_invites/?page={}
     @action(detail=False, methods=['get'], url_path='list_invites', permission_classes=[permissions.IsAuthenticated])
     def list_invites(self, request):
-        if not hasattr(request.user, 'wholesalerprofile'):
+        context = get_role_context(request.user)
+        if not context.is_wholesaler:
             return Response({"detail": "Not authorized"}, status=status.HTTP_403_FORBIDDEN)
 
-        invites = Offer.objects.filter(user=request.user.wholesalerprofile)
+        invites = Offer.objects.filter(user_id=context.wholesaler_profile_id).select_related('user__user')
 
         # Apply pagination
         page = self.paginate_queryset(invites)
         if page is not None:
-            serializer = OfferSerializer(page, many=True)
+            serializer = OfferSerializer(page, many=True, context=self.get_serializer_context())
             return self.get_paginated_response(serializer.data)
 
 
-        serializer = OfferSerializer(invites, many=True)
+        serializer = OfferSerializer(invites, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
 
     @action(detail=True, methods=['get'])
     def status(self, request, pk=None):
         appraisal = self.get_object()
-        user = request.user
+        context = get_role_context(request.user)
 
         # Check for Dealer profile
-        if hasattr(user, 'dealerprofile'):
-            status = self.get_dealer_status(appraisal)
+        if context.is_dealer:
+            appraisal_status = appraisal.get_dealer_status()
         
-        # Check for Wholesaler profile
-        elif hasattr(user, 'wholesalerprofile'):
-            status = self.get_wholesaler_status(appraisal, user.wholesalerprofile)
+        # Check for Wholesaler profile (annotated by get_queryset)
+        elif context.is_wholesaler:
+            appraisal_status = appraisal.get_wholesaler_status(context.wholesaler_profile)
         
         else:
             return Response({"detail": "Not authorized"}, status=status.HTTP_403_FORBIDDEN)
 
-        # Debug output
-        print(f"Appraisal ID: {appraisal.id}")
-        print(f"Offers: {appraisal.offers.all()}")
-        print(f"Invites: {appraisal.invites.all()}")
-        print(f"Status: {status}")
+        return Response({'status': appraisal_status})
 
-        return Response({'status': status})
+    def get_rollup_queryset(self):
+        """
+        The DailyAppraisalRollup rows covering what get_queryset() would return, or None when the
+        user is not a dealer or the request filters on something the rollups do not record.
+        """
+        context = get_role_context(self.request.user)
+        params = self.request.query_params
+        if not context.is_dealer or params.getlist('filter') or params.get('user_id'):
+            return None
+
+        queryset = DailyAppraisalRollup.objects.filter(dealership_id__in=context.dealership_ids)
+        dealership_id = params.get('dealership_id')
+        if dealership_id:
+            queryset = queryset.filter(dealership_id=dealership_id)
+        return queryset
 
     def _parse_date_range(self, request):
         date_from = request.query_params.get('from')
@@ -881,18 +1201,20 @@ class AppraisalViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.
             return error_response
 
         date_from, date_to = date_range
-        user = request.user
+        context = get_role_context(request.user)
 
-        if hasattr(user, 'dealerprofile'):
-            dealer_id = user.dealerprofile.id
-            queryset = Appraisal.objects.filter(initiating_dealer_id=dealer_id, start_date__range=[date_from, date_to])
-            serializer = self.get_serializer(queryset, many=True)
+        if context.is_dealer:
+            dealer_id = context.dealer_profile_id
+            queryset = self.apply_query_plan(Appraisal.objects.filter(initiating_dealer_id=dealer_id, start_date__range=[date_from, date_to]))
 
-            page = self.paginate_queryset(serializer.data)
+            # Paginate before serializing so only the requested page is loaded
+            page = self.paginate_queryset(queryset.order_by('-start_date', '-id'))
             if page is not None:
-                return self.get_paginated_response(page)
+                serializer = self.get_serializer(page, many=True)
+                return self.get_paginated_response(serializer.data)
 
-            appraisal_count = queryset.count()
+            serializer = self.get_serializer(queryset, many=True)
+            appraisal_count = len(serializer.data)
 
             return Response({
                 "appraisal_count": appraisal_count,
@@ -911,20 +1233,20 @@ class AppraisalViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.
         date_from = parse_date(date_from) if date_from else None
         date_to = parse_date(date_to) if date_to else None
 
-        user = request.user
+        context = get_role_context(request.user)
 
-        if hasattr(user, 'dealerprofile'):
-            dealer_id = user.dealerprofile.id
-            queryset = Appraisal.objects.filter(initiating_dealer_id=dealer_id)
+        if context.is_dealer:
+            dealer_id = context.dealer_profile_id
+            queryset = DailyVehicleRollup.objects.filter(initiating_dealer_id=dealer_id)
 
             # Apply date range filter if both dates are provided
             if date_from and date_to:
-                queryset = queryset.filter(start_date__range=[date_from, date_to])
+                queryset = queryset.filter(**rollup_day_range(date_from, date_to))
 
-            # Aggregate the counts of cars by make and model
+            # Sum the daily counts of cars by make and model
             car_counts = (queryset
                         .values('vehicle_make', 'vehicle_model')
-                        .annotate(count=Count('id'))
+                        .annotate(count=Sum('appraisal_count'))
                         .order_by('-count'))
             
             # Paginate the results
@@ -949,51 +1271,71 @@ class AppraisalViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.
         date_from = parse_date(date_from) if date_from else None
         date_to = parse_date(date_to) if date_to else None
 
-        user = request.user
-        dealer_id = user.dealerprofile.id  # Assuming the permission class ensures that dealerprofile exists
+        context = get_role_context(request.user)
+        dealer_id = context.dealer_profile_id  # The permission class ensures the user is a dealer
 
-        queryset = Appraisal.objects.filter(
-            initiating_dealer_id=dealer_id
-        ).select_related('winner')  # Optimize query to fetch related 'winner'
+        # Rank the wholesalers across one of the user's dealerships instead of their own appraisals
+        dealership_id = request.query_params.get('dealership_id')
+        if dealership_id and not context.in_dealership(dealership_id):
+            return Response({"detail": "You do not have access to this dealership."}, status=status.HTTP_403_FORBIDDEN)
 
-        # Apply date range filter if both dates are provided
         if date_from and date_to:
-            queryset = queryset.filter(start_date__range=[date_from, date_to])
+            # Date windows are summed from the daily rollups
+            queryset = DailyWholesalerRollup.objects.filter(**rollup_day_range(date_from, date_to))
+            if dealership_id:
+                queryset = queryset.filter(dealership_id=dealership_id)
+            else:
+                queryset = queryset.filter(initiating_dealer_id=dealer_id)
+        else:
+            # All-time rankings are read straight off the leaderboard
+            if dealership_id:
+                queryset = WholesalerLeaderboard.objects.filter(dealership_id=dealership_id, initiating_dealer__isnull=True)
+            else:
+                queryset = WholesalerLeaderboard.objects.filter(initiating_dealer_id=dealer_id)
 
-        # Count by winner's profile ID and get username
+        # A dealer in several dealerships has a row per dealership, so sum them per wholesaler
         top_wholesalers = (queryset
-                        .values('winner__user_id', 'winner__user__wholesaler_name', 'winner__user__user__username')  # Access winner's profile ID and username
-                        .annotate(count=Count('winner__user_id'))  # Count how many times each ID appears
-                        .filter(winner__user_id__isnull=False)  # Exclude entries with null winner__user_id
+                        .values('wholesaler_id', 'wholesaler__wholesaler_name', 'wholesaler__user__username')
+                        .annotate(count=Sum('win_count'))
+                        .filter(count__gt=0)
                         .order_by('-count'))  # Order by count in descending order
 
         # Paginate the results
         paginator = self.pagination_class()
         page = paginator.paginate_queryset(top_wholesalers, request)
         if page is not None:
-            return paginator.get_paginated_response(page)
+            return paginator.get_paginated_response([wholesaler_win_row(row) for row in page])
 
         return Response({
-            "top_wholesalers": list(top_wholesalers)  # Convert queryset to list
+            "top_wholesalers": [wholesaler_win_row(row) for row in top_wholesalers]
         }, status=status.HTTP_200_OK)
         
     @action(detail=False, methods=['get'], url_path='top-wholesaler')
     def top_wholesaler(self, request, *args, **kwargs):
-        user = request.user
+        context = get_role_context(request.user)
 
-        if hasattr(user, 'dealerprofile'):
-            dealer_id = user.dealerprofile.id
-            queryset = Appraisal.objects.filter(
-                initiating_dealer_id=dealer_id
-            ).select_related('winner')  # Optimize query to fetch related 'winner'
+        if context.is_dealer:
+            dealer_id = context.dealer_profile_id
 
-            # Count by winner's profile ID and get username
-            top_wholesaler = (queryset
-                            .values('winner__user_id', 'winner__user__wholesaler_name')  # Access winner's profile ID and username
-                            .annotate(count=Count('winner__user_id'))  # Count how many times each ID appears
+            # Read the dealer's all-time leader off the leaderboard
+            top_wholesaler = (WholesalerLeaderboard.objects
+                            .filter(initiating_dealer_id=dealer_id)
+                            .values('wholesaler_id', 'wholesaler__wholesaler_name')
+                            .annotate(count=Sum('win_count'))
+                            .filter(count__gt=0)
                             .order_by('-count')
                             .first())  # Get only the top result
 
+            if top_wholesaler:
+                top_wholesaler = {
+                    'winner__user_id': top_wholesaler['wholesaler_id'],
+                    'winner__user__wholesaler_name': top_wholesaler['wholesaler__wholesaler_name'],
+                    'count': top_wholesaler['count'],
+                }
+            elif DailyAppraisalRollup.objects.filter(initiating_dealer_id=dealer_id).exists():
+                # Appraisals without any winner yet
+                top_wholesaler = {'winner__user_id': None, 'winner__user__wholesaler_name': None, 'count': 0}
+
             if top_wholesaler:
                 return Response({
                     "top_wholesaler": top_wholesaler
@@ -1005,16 +1347,16 @@ class AppraisalViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.
         
     @action(detail=False, methods=['get'], url_path='top-car')
     def top_car(self, request, *args, **kwargs):
-        user = request.user
+        context = get_role_context(request.user)
 
-        if hasattr(user, 'dealerprofile'):
-            dealer_id = user.dealerprofile.id
+        if context.is_dealer:
+            dealer_id = context.dealer_profile_id
             # Fetch the most common car across all appraisals
-            queryset = Appraisal.objects.filter(initiating_dealer_id=dealer_id)
+            queryset = DailyVehicleRollup.objects.filter(initiating_dealer_id=dealer_id)
             
             car_counts = (queryset
                         .values('vehicle_make', 'vehicle_model')
-                        .annotate(count=Count('id'))
+                        .annotate(count=Sum('appraisal_count'))
                         .order_by('-count'))
 
             if car_counts:
@@ -1041,6 +1383,16 @@ class AppraisalViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.
         if end_date:
             end_date = parse_date(end_date)
 
+        # Dealers without extra filters are answered from the daily rollups
+        rollups = self.get_rollup_queryset()
+        if rollups is not None:
+            if start_date:
+                rollups = rollups.filter(day__gte=start_date)
+            if end_date:
+                rollups = rollups.filter(day__lt=end_date)
+            appraisal_count = rollups.aggregate(count=Coalesce(Sum('appraisal_count'), 0))['count']
+            return Response({"count": appraisal_count}, status=status.HTTP_200_OK)
+
         # Filter queryset based on provided dates
         queryset = self.get_queryset()
         if start_date and end_date:
@@ -1073,58 +1425,252 @@ class AppraisalViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.
         if from_date and to_date and from_date > to_date:
             return Response({"detail": "The 'from' date cannot be after the 'to' date."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Get the queryset
-        queryset = self.filter_queryset(self.get_queryset())
+        bucket = request.query_params.get('bucket', 'day')
+        if bucket not in DATE_BUCKETS:
+            return Response({"detail": f"Invalid bucket. Use one of: {', '.join(DATE_BUCKETS)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Optional breakdown of each bucket by dealership or by initiating dealer
+        group_by = request.query_params.get('group_by', None)
+        if group_by and group_by not in PROFIT_LOSS_GROUPS:
+            return Response({"detail": f"Invalid group_by. Use one of: {', '.join(PROFIT_LOSS_GROUPS)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        group_fields = PROFIT_LOSS_GROUPS[group_by] if group_by else ()
+        rollups = self.get_rollup_queryset()
+
+        if rollups is not None and all(is_day_boundary(value) for value in (from_date, to_date) if value):
+            # Whole-day ranges are answered from the daily rollups, which hold the summed margin per day
+            if from_date:
+                rollups = rollups.filter(day__gte=truncate_date(from_date, 'day'))
+            if to_date:
+                rollups = rollups.filter(day__lt=truncate_date(to_date, 'day'))
+            rows = (rollups.filter(won_count__gt=0)
+                    .order_by()
+                    .annotate(period=Trunc('day', bucket, output_field=DateField()))
+                    .values('period', *group_fields)
+                    .annotate(profit_or_loss=Sum('margin')))
+        else:
+            # Get the queryset
+            queryset = self.filter_queryset(self.get_queryset())
 
-        # Apply date range filters if provided
-        if from_date and to_date:
-            queryset = queryset.filter(start_date__range=(from_date, to_date))
-        elif from_date:
-            queryset = queryset.filter(start_date__gte=from_date)
-        elif to_date:
-            queryset = queryset.filter(start_date__lte=to_date)
+            # Apply date range filters if provided
+            if from_date and to_date:
+                queryset = queryset.filter(start_date__range=(from_date, to_date))
+            elif from_date:
+                queryset = queryset.filter(start_date__gte=from_date)
+            elif to_date:
+                queryset = queryset.filter(start_date__lte=to_date)
+
+            rows = self.get_profit_loss_rows(queryset, bucket, group_fields)
+
+        response_data = self.summarize_profit_loss(rows, bucket, group_by, from_date, to_date)
+        return Response(response_data, status=status.HTTP_200_OK)
 
-        # Initialize profit/loss tracking
-        daily_profit = defaultdict(Decimal)
-        total_profit_or_loss = Decimal('0.0')
-
-        # Iterate over each appraisal to calculate profit/loss
-        for appraisal in queryset:
-            winner = appraisal.winner
-
-            # Check if winner and necessary fields are present
-            if winner and appraisal.reserve_price is not None:
-                try:
-                    # Use adjusted_amount if it's not None; otherwise, use amount
-                    winning_price = (
-                        Decimal(winner.adjusted_amount)
-                        if winner.adjusted_amount is not None
-                        else Decimal(winner.amount)
-                    )
-                    reserve_price = Decimal(appraisal.reserve_price)
-                    
-                    # Calculate profit/loss as Winning Price - Reserve Price
-                    profit_loss = winning_price - reserve_price
-                except (InvalidOperation, TypeError):
-                    return Response(
-                        {"detail": "Invalid adjusted amount, amount, or reserve price value."},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-
-                # Add the profit/loss to the total and daily calculations
-                total_profit_or_loss += profit_loss
-                day = appraisal.start_date.strftime('%Y-%m-%d')  # Format date as 'YYYY-MM-DD'
-                daily_profit[day] += profit_loss
+    def get_profit_loss_rows(self, queryset, bucket, group_fields=()):
+        """
+        Profit/loss per bucket (and group) of an appraisal queryset, as `period` / `profit_or_loss` rows.
+        """
+        # Profit/loss is the winning price (adjusted if set) minus the reserve, summed per bucket in SQL
+        period = Trunc('start_date', bucket, output_field=DateField())
+        profit = ExpressionWrapper(
+            Coalesce('winner__adjusted_amount', 'winner__amount') - F('reserve_price'),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        )
+        return (queryset.filter(winner__isnull=False, reserve_price__isnull=False)
+                .order_by()
+                .annotate(period=period)
+                .values('period', *group_fields)
+                .annotate(profit_or_loss=Sum(profit))
+                .filter(profit_or_loss__isnull=False))
+
+    def summarize_profit_loss(self, rows, bucket, group_by=None, from_date=None, to_date=None):
+        totals = defaultdict(Decimal)
+        breakdowns = defaultdict(list)
+        for row in rows:
+            totals[row['period']] += row['profit_or_loss']
+            if group_by:
+                breakdowns[row['period']].append(profit_loss_group(row, group_by))
+
+        # Gap-fill the series so every bucket between the bounds is present, even without sales
+        start = truncate_date(from_date, bucket) if from_date else min(totals, default=None)
+        end = truncate_date(to_date, bucket) if to_date else max(totals, default=None)
+        series = []
+        for day in date_buckets(start, end, bucket):
+            entry = {'date': day.isoformat(), 'profit_or_loss': float(totals.get(day, 0))}
+            if group_by:
+                entry['breakdown'] = sorted(breakdowns.get(day, []), key=lambda group: group['name'])
+            series.append(entry)
 
         # Prepare the final response
         response_data = {
-            'total_profit_or_loss': float(total_profit_or_loss),
-            'daily_profit': [{'date': day, 'profit_or_loss': float(profit)} for day, profit in sorted(daily_profit.items())]
+            'total_profit_or_loss': float(sum(totals.values(), Decimal('0.0'))),
+            'bucket': bucket,
+            'series': series,
+        }
+        if bucket == 'day':
+            # Shape the analytics page reads
+            response_data['daily_profit'] = series
+        return response_data
+
+    def get_status_counts(self, queryset, status_field):
+        rows = queryset.order_by().values(status_field).annotate(count=Count('id'))
+        return sort_status_counts((row[status_field], row['count']) for row in rows)
+
+    def get_top_car(self, queryset):
+        return (queryset.order_by()
+                .values('vehicle_make', 'vehicle_model')
+                .annotate(count=Count('id'))
+                .order_by('-count')
+                .first())
+
+    def get_top_wholesaler(self, queryset):
+        return (queryset.filter(winner__user__isnull=False)
+                .order_by()
+                .values('winner__user_id', 'winner__user__wholesaler_name')
+                .annotate(count=Count('id'))
+                .order_by('-count')
+                .first())
+
+    def get_rollup_days(self, from_date=None, to_date=None):
+        """
+        Rollup day filter matching start_date between from_date and to_date, or None when a bound falls inside a day.
+        """
+        if not all(is_day_boundary(value) for value in (from_date, to_date) if value):
+            return None
+        days = {}
+        if from_date:
+            days['day__gte'] = truncate_date(from_date, 'day')
+        if to_date:
+            days['day__lt'] = truncate_date(to_date, 'day')
+        return days
+
+    def get_dealer_conditions(self):
+        # The requesting dealer's own appraisals, as the top-car and top-wholesaler endpoints count them
+        conditions = {'initiating_dealer_id': get_role_context(self.request.user).dealer_profile_id}
+        dealership_id = self.request.query_params.get('dealership_id')
+        if dealership_id:
+            conditions['dealership_id'] = dealership_id
+        return conditions
+
+    def get_rollup_top_car(self, conditions, days):
+        return (DailyVehicleRollup.objects.filter(**conditions, **days)
+                .values('vehicle_make', 'vehicle_model')
+                .annotate(count=Sum('appraisal_count'))
+                .order_by('-count')
+                .first())
+
+    def get_rollup_top_wholesaler(self, conditions, days):
+        if days:
+            entries = DailyWholesalerRollup.objects.filter(**conditions, **days)
+        else:
+            # All time: read off the leaderboard, as top-wholesaler does
+            entries = WholesalerLeaderboard.objects.filter(**conditions)
+        top = (entries
+               .values('wholesaler_id', 'wholesaler__wholesaler_name')
+               .annotate(count=Sum('win_count'))
+               .filter(count__gt=0)
+               .order_by('-count')
+               .first())
+        if top is None:
+            return None
+        return {
+            'winner__user_id': top['wholesaler_id'],
+            'winner__user__wholesaler_name': top['wholesaler__wholesaler_name'],
+            'count': top['count'],
         }
 
-        return Response(response_data, status=status.HTTP_200_OK)
+    def get_recent_appraisals(self, queryset, limit=8):
+        recent = queryset.order_by('-start_date')[:limit]
+        return SimpleAppraisalSerializer(recent, many=True, context=self.get_serializer_context()).data
 
-class RequestViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.UpdateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin):
+    @action(detail=False, methods=['get'], url_path='price-guidance', permission_classes=[IsDealer])
+    def price_guidance(self, request, *args, **kwargs):
+        """
+        Suggested reserve price range (p25/p50/p75 of winning amounts) from comparable past sales in the user's dealerships.
+        """
+        if not price_guidance_available():
+            return Response({"detail": "Price guidance is not available on this server."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        params = request.query_params
+        make = params.get('vehicle_make')
+        model = params.get('vehicle_model')
+        if not make or not model:
+            return Response({"detail": "vehicle_make and vehicle_model are required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            year = int(params['vehicle_year']) if params.get('vehicle_year') else None
+            odometer = int(params['odometer_reading']) if params.get('odometer_reading') else None
+            neighbours = max(1, min(int(params.get('neighbours', DEFAULT_NEIGHBOURS)), 200))
+        except ValueError:
+            return Response({"detail": "vehicle_year, odometer_reading and neighbours must be whole numbers."}, status=status.HTTP_400_BAD_REQUEST)
+
+        dealership_ids = get_role_context(request.user).dealership_ids
+        guidance = price_guidance_index.guidance(
+            dealership_ids, make, model, year=year, odometer=odometer,
+            body_type=params.get('body_type'), fuel_type=params.get('fuel_type'), neighbours=neighbours,
+        )
+        return Response(guidance, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='dashboard', permission_classes=[IsDealer])
+    def dashboard(self, request, *args, **kwargs):
+        """
+        Every dealer dashboard widget in one response.
+        Takes the usual dealership_id, user_id and filter parameters plus optional from/to bounds and a profit/loss bucket.
+
+        count, status_list, simple_list and profit_loss cover the appraisals of the user's dealerships, narrowed by those
+        parameters. top_car and top_wholesaler cover the requesting dealer's own appraisals, as the top-car and
+        top-wholesaler endpoints do, narrowed by dealership_id and the bounds. Without a keyword or user_id filter and
+        with whole-day bounds, count, top_car and top_wholesaler are read from the daily rollups and the leaderboard,
+        like their standalone endpoints; otherwise every widget is computed from one shared queryset, and with a
+        keyword or user_id filter top_car and top_wholesaler describe those filtered appraisals.
+        """
+        try:
+            from_date = parse_bound(request.query_params.get('from'))
+            to_date = parse_bound(request.query_params.get('to'))
+        except ValueError:
+            return Response({"detail": "Invalid date format. Use ISO 8601 format."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if from_date and to_date and from_date > to_date:
+            return Response({"detail": "The 'from' date cannot be after the 'to' date."}, status=status.HTTP_400_BAD_REQUEST)
+
+        bucket = request.query_params.get('bucket', 'day')
+        if bucket not in DATE_BUCKETS:
+            return Response({"detail": f"Invalid bucket. Use one of: {', '.join(DATE_BUCKETS)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.get_queryset()
+        if from_date:
+            queryset = queryset.filter(start_date__gte=from_date)
+        if to_date:
+            queryset = queryset.filter(start_date__lte=to_date)
+
+        rollups = self.get_rollup_queryset()
+        days = self.get_rollup_days(from_date, to_date) if rollups is not None else None
+        if days is not None:
+            conditions = self.get_dealer_conditions()
+            count = lambda: rollups.filter(**days).aggregate(count=Coalesce(Sum('appraisal_count'), 0))['count']
+            top_car = lambda: self.get_rollup_top_car(conditions, days)
+            top_wholesaler = lambda: self.get_rollup_top_wholesaler(conditions, days)
+        else:
+            dealer_queryset = queryset
+            if rollups is not None:
+                # Only the bounds kept the rollups out: still the dealer's own appraisals
+                dealer_queryset = queryset.filter(**self.get_dealer_conditions())
+            count = queryset.count
+            top_car = lambda: self.get_top_car(dealer_queryset)
+            top_wholesaler = lambda: self.get_top_wholesaler(dealer_queryset)
+
+        # Each widget is one independent query
+        widgets = run_concurrently({
+            'count': count,
+            'top_car': top_car,
+            'top_wholesaler': top_wholesaler,
+            'status_list': lambda: self.get_status_counts(queryset, 'dealer_status'),
+            'simple_list': lambda: self.get_recent_appraisals(queryset),
+            'profit_loss': lambda: self.summarize_profit_loss(
+                self.get_profit_loss_rows(queryset, bucket), bucket, from_date=from_date, to_date=to_date),
+        })
+        return Response(widgets, status=status.HTTP_200_OK)
+
+class RequestViewSet(KeysetPaginationMixin, viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.UpdateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin):
     queryset = FriendRequest.objects.all()
     serializer_class = FriendRequestSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -1134,25 +1680,33 @@ class RequestViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.Up
         'list_received_requests': [IsManagement],
     }
     pagination_class = CustomPagination
+    keyset_ordering_by_action = {
+        'list': ('created_at', 'id'),
+        'list_sent_requests': ('created_at', 'id'),
+        'list_received_requests': ('created_at', 'id'),
+    }
+    query_budgets = {'list': 4, 'retrieve': 3, 'list_sent_requests': 4, 'list_received_requests': 5}
 
     def get_queryset(self):
-        user = self.request.user
+        context = get_role_context(self.request.user)
 
-        if hasattr(user, 'wholesalerprofile'):
+        if context.is_wholesaler:
             # User is a wholesaler
-            return FriendRequest.objects.filter(
-                Q(sender=user.wholesalerprofile) |
-                Q(recipient_wholesaler=user.wholesalerprofile)
+            queryset = FriendRequest.objects.filter(
+                Q(sender_id=context.wholesaler_profile_id) |
+                Q(recipient_wholesaler_id=context.wholesaler_profile_id)
             )
-        elif hasattr(user, 'dealerprofile'):
+        elif context.is_dealer:
             # User is a dealer, filter based on their dealerships
-            dealerships = user.dealerprofile.dealerships.all()
-            return FriendRequest.objects.filter(
-                Q(dealership__in=dealerships)
+            queryset = FriendRequest.objects.filter(
+                Q(dealership_id__in=context.dealership_ids)
             )
         else:
             return FriendRequest.objects.none()
 
+        # Everything FriendRequestSerializer reads about the sender, dealership and recipient
+        return queryset.select_related('sender__user', 'dealership', 'recipient_wholesaler__user')
+
 
     @action(detail=True, methods=['put'], url_path='respond')
     def respond_to_friend_request(self, request, pk=None):
@@ -1162,13 +1716,14 @@ class RequestViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.Up
         if response_status not in ['accepted', 'rejected']:
             return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
 
-        if hasattr(request.user, 'wholesalerprofile'):
+        context = get_role_context(request.user)
+        if context.is_wholesaler:
             # Check if the friend request is for this wholesaler
-            if friend_request.recipient_wholesaler != request.user.wholesalerprofile:
+            if friend_request.recipient_wholesaler_id != context.wholesaler_profile_id:
                 return Response({'error': 'You can only respond to requests sent to you'}, status=status.HTTP_403_FORBIDDEN)
-        elif hasattr(request.user, 'dealerprofile'):
+        elif context.is_dealer:
             # Check if the friend request is related to the dealer's dealership
-            if friend_request.dealership not in request.user.dealerprofile.dealerships.all():
+            if friend_request.dealership_id not in context.dealership_ids:
                 return Response({'error': 'Dealer does not belong to the specified dealership.'}, status=status.HTTP_403_FORBIDDEN)
         else:
             return Response({'error': 'Invalid request'}, status=status.HTTP_400_BAD_REQUEST)
@@ -1179,9 +1734,9 @@ class RequestViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.Up
 
         # Handle acceptance logic
         if response_status == 'accepted':
-            if hasattr(request.user, 'wholesalerprofile'):
+            if context.is_wholesaler:
                 pass
-            elif hasattr(request.user, 'dealerprofile'):
+            elif context.is_dealer:
                 # For dealers, update the dealership's wholesalers list
                 dealership = friend_request.dealership
                 wholesaler_profile = friend_request.sender
@@ -1196,9 +1751,10 @@ class RequestViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.Up
     @action(detail=False, methods=['get'], url_path='sent', permission_classes=[IsWholesaler])
     def list_sent_requests(self, request):
         queryset = self.get_queryset()
+        context = get_role_context(request.user)
         
-        if hasattr(request.user, 'wholesalerprofile'):
-            sent_requests = queryset.filter(sender=request.user.wholesalerprofile)
+        if context.is_wholesaler:
+            sent_requests = queryset.filter(sender_id=context.wholesaler_profile_id)
         else:
             return Response({'error': 'User does not have a wholesaler profile.'}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -1214,27 +1770,25 @@ class RequestViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.Up
 
     @action(detail=False, methods=['get'], url_path='received', permission_classes=[IsWholesaler | IsManagement])
     def list_received_requests(self, request):
-        user = request.user
+        context = get_role_context(request.user)
         queryset = self.get_queryset()  # Use the optimized queryset from get_queryset
 
-        if hasattr(user, 'dealerprofile'):
+        if context.is_dealer:
             # If the user is a dealer, handle dealership filtering
-            dealer_profile = user.dealerprofile
-
             dealership_id = request.query_params.get('dealership')
             if not dealership_id:
                 return Response({'error': 'Dealership ID must be provided.'}, status=status.HTTP_400_BAD_REQUEST)
 
             dealership = get_object_or_404(Dealership, id=dealership_id)
-            if dealership not in dealer_profile.dealerships.all():
+            if dealership.id not in context.dealership_ids:
                 return Response({'error': 'Dealer does not belong to the specified dealership.'}, status=status.HTTP_403_FORBIDDEN)
 
             # Filter requests related to the specified dealership
             received_requests = queryset.filter(dealership=dealership)
 
-        elif hasattr(user, 'wholesalerprofile'):
+        elif context.is_wholesaler:
             # If the user is a wholesaler, list all requests received by this wholesaler
-            received_requests = queryset.filter(recipient_wholesaler=user.wholesalerprofile)
+            received_requests = queryset.filter(recipient_wholesaler_id=context.wholesaler_profile_id)
 
         else:
             return Response({'error': 'User must be a dealer or wholesaler.'}, status=status.HTTP_403_FORBIDDEN)
@@ -1254,57 +1808,221 @@ class RequestViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.Up
         return Response(serializer.data)
 
 
-class OfferViewSet(viewsets.GenericViewSet, viewsets.mixins.RetrieveModelMixin):
+class OfferViewSet(SparseFieldsetQueryMixin, viewsets.GenericViewSet, viewsets.mixins.RetrieveModelMixin):
     serializer_class = OfferSerializer
     permission_classes = [IsWholesaler | IsManagement]
+    query_budgets = {'retrieve': 3, 'analytics': 3}
 
 
     def get_queryset(self):
-        user = self.request.user
+        context = get_role_context(self.request.user)
 
-        if hasattr(user, 'wholesalerprofile'):
-            wholesalerprofile = user.wholesalerprofile
+        if context.is_wholesaler:
             # If the user has a wholesaler profile, filter offers by the user's instance
-            return Offer.objects.filter(user=wholesalerprofile.id)
+            queryset = Offer.objects.filter(user_id=context.wholesaler_profile_id)
 
-        if hasattr(user, 'dealerprofile'):
+        elif context.is_dealer:
             # If the user has a dealer profile, filter offers by dealerships related to appraisals created
-            dealerships = user.dealerprofile.dealerships.all()
-            return Offer.objects.filter(appraisal__dealership__in=dealerships)
+            queryset = Offer.objects.filter(appraisal__dealership_id__in=context.dealership_ids)
 
-        # Default: return no offers if the user does not match any role
-        return Offer.objects.none()
+        else:
+            # Default: return no offers if the user does not match any role
+            return Offer.objects.none()
+
+        if self.action == 'retrieve':
+            fields = self.get_serializer().fields
+            if 'user' in fields:
+                queryset = queryset.select_related('user__user')
+            queryset = self.apply_sparse_fieldset(queryset, fields)
+
+        return queryset
 
     def filter_queryset(self, queryset):
-        user = self.request.user
+        context = get_role_context(self.request.user)
 
-        if hasattr(user, 'wholesalerprofile'):
+        if context.is_wholesaler:
             # Filter offers by the wholesaler's user instance
-            wholesalerprofile = user.wholesalerprofile
-            return queryset.filter(user=wholesalerprofile)
+            return queryset.filter(user_id=context.wholesaler_profile_id)
 
-        if hasattr(user, 'dealerprofile'):
+        if context.is_dealer:
             # Filter offers by appraisals created by the management dealer's dealerships
-            dealerships = user.dealerprofile.dealerships.all()
-            return queryset.filter(appraisal__dealership__in=dealerships)
+            return queryset.filter(appraisal__dealership_id__in=context.dealership_ids)
 
         # Default: return no offers if the user does not match any role
         return queryset.none()
     
+    @action(detail=False, methods=['get'], url_path='analytics', permission_classes=[IsWholesaler])
+    def analytics(self, request, *args, **kwargs):
+        """
+        Win rate, margin over reserve, standing against the other offers and response time for the wholesaler's offers,
+        with a bucketed series of running totals. Two queries, however many offers the wholesaler has made.
+        """
+        try:
+            from_date = parse_bound(request.query_params.get('from'))
+            to_date = parse_bound(request.query_params.get('to'))
+        except ValueError:
+            return Response({"detail": "Invalid date format. Use ISO 8601 format."}, status=status.HTTP_400_BAD_REQUEST)
+
+        bucket = request.query_params.get('bucket', 'month')
+        if bucket not in DATE_BUCKETS:
+            return Response({"detail": f"Invalid bucket. Use one of: {', '.join(DATE_BUCKETS)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        wholesaler = get_role_context(request.user).wholesaler_profile
+        date_filter = {}
+        if from_date:
+            date_filter['created_at__gte'] = from_date
+        if to_date:
+            date_filter['created_at__lte'] = to_date
+
+        return Response({
+            'summary': self.get_offer_summary(wholesaler, date_filter),
+            'bucket': bucket,
+            'series': self.get_offer_series(wholesaler, date_filter, bucket, from_date, to_date),
+        }, status=status.HTTP_200_OK)
+
+    def get_offer_summary(self, wholesaler, date_filter):
+        # Every offer on the appraisals the wholesaler was invited to, so the windows can rank against competitors
+        own_appraisal_filter = {f'appraisal__offers__{lookup}': value for lookup, value in date_filter.items()}
+        offers = Offer.objects.filter(appraisal__offers__user=wholesaler, **own_appraisal_filter)
+
+        per_appraisal = {'partition_by': [F('appraisal_id')]}
+        offers = offers.annotate(effective_amount=OFFER_AMOUNT).annotate(
+            # Ordered as floats; SQLite cannot sort a window by a CAST decimal
+            offer_rank=Window(Rank(), order_by=Coalesce('adjusted_amount', 'amount', output_field=FloatField()).desc(nulls_last=True), **per_appraisal),
+            top_amount=Window(Max('effective_amount'), **per_appraisal),
+            # A single-row window, so this filter runs after the windows instead of narrowing them to own offers
+            offer_user_id=Window(Max('user_id'), partition_by=[F('id')]),
+        ).filter(offer_user_id=wholesaler.id)
+
+        priced = Q(amount__isnull=False)
+        won = Q(appraisal__winner_id=F('id'))
+        lost = Q(priced, appraisal__winner__isnull=False) & ~won
+        winning_amount = Coalesce('appraisal__winner__adjusted_amount', 'appraisal__winner__amount')
+        summary = offers.aggregate(
+            invited=Count('id'),
+            priced=Count('id', filter=priced),
+            passed=Count('id', filter=Q(passed=True)),
+            won=Count('id', filter=won),
+            average_rank=Avg('offer_rank', filter=priced),
+            average_gap_to_top=Avg(F('top_amount') - F('effective_amount'), filter=priced, output_field=FloatField()),
+            average_gap_to_winner=Avg(winning_amount - F('effective_amount'), filter=lost, output_field=FloatField()),
+            average_margin=Avg(F('effective_amount') - F('appraisal__reserve_price'), filter=won, output_field=FloatField()),
+            average_response_time=Avg(OFFER_RESPONSE_TIME, filter=Q(offer_made_at__isnull=False)),
+        )
+
+        summary['win_rate'] = summary['won'] / summary['priced'] if summary['priced'] else None
+        response_time = summary.pop('average_response_time')
+        summary['average_response_seconds'] = response_time.total_seconds() if response_time is not None else None
+        return summary
+
+    def get_offer_series(self, wholesaler, date_filter, bucket, from_date=None, to_date=None):
+        offers = Offer.objects.filter(user=wholesaler, **date_filter).annotate(
+            period=Trunc('created_at', bucket, output_field=DateField()))
+
+        won = Case(When(appraisal__winner_id=F('id'), then=Value(1)), default=Value(0))
+        priced = Case(When(amount__isnull=False, then=Value(1)), default=Value(0))
+        margin = Case(
+            When(appraisal__winner_id=F('id'), then=Cast(OFFER_AMOUNT - F('appraisal__reserve_price'), FloatField())),
+            default=Value(0.0),
+        )
+        per_bucket = {'partition_by': [F('period')]}
+        running = {'order_by': [F('created_at').asc(), F('id').asc()]}
+
+        # Totals per bucket and running totals up to each row; the last row of a bucket carries both for the bucket
+        rows = (offers.annotate(
+                    bucket_row=Window(RowNumber(), order_by=[F('created_at').desc(), F('id').desc()], **per_bucket),
+                    offers=Window(Count('id'), **per_bucket),
+                    priced=Window(Sum(priced), **per_bucket),
+                    won=Window(Sum(won), **per_bucket),
+                    margin=Window(Sum(margin), **per_bucket),
+                    running_offers=Window(Count('id'), **running),
+                    running_won=Window(Sum(won), **running),
+                    running_margin=Window(Sum(margin), **running),
+                )
+                .filter(bucket_row=1)
+                .values('period', 'offers', 'priced', 'won', 'margin', 'running_offers', 'running_won', 'running_margin'))
+        rows = {row.pop('period'): row for row in rows}
+
+        # Gap-fill, carrying the running totals through buckets without offers
+        start = truncate_date(from_date, bucket) if from_date else min(rows, default=None)
+        end = truncate_date(to_date, bucket) if to_date else max(rows, default=None)
+        series = []
+        previous = {'running_offers': 0, 'running_won': 0, 'running_margin': 0.0}
+        for day in date_buckets(start, end, bucket):
+            row = rows.get(day) or {'offers': 0, 'priced': 0, 'won': 0, 'margin': 0.0, **previous}
+            previous = {key: row[key] for key in previous}
+            series.append({'date': day.isoformat(), **row})
+        return series
+
     @action(detail=True, methods=['POST'], url_path='make-winner', permission_classes=[IsManagement])
     def make_winner(self, request, pk=None):
         offer = self.get_object()
         appraisal = offer.appraisal
 
-        user = request.user
-        if hasattr(user, 'dealerprofile'):
-            dealerships = user.dealerprofile.dealerships.all()
-            if appraisal.dealership not in dealerships:
-                return Response({"detail": "You do not have permission to select a winner for this appraisal."}, status=status.HTTP_403_FORBIDDEN)
-        else:
+        if appraisal.dealership_id not in get_role_context(request.user).dealership_ids:
             return Response({"detail": "You do not have permission to select a winner for this appraisal."}, status=status.HTTP_403_FORBIDDEN)
 
-        appraisal.winner = offer
-        appraisal.save()
+        # Move the win on the leaderboards in the same transaction as the winner change
+        with transaction.atomic():
+            previous_winner = appraisal.winner
+            appraisal.winner = offer
+            appraisal.save()
+            record_winner_change(appraisal, previous_winner, offer)
+
+        return Response({"message": "Winning offer selected successfully"}, status=status.HTTP_200_OK)
+
+class ExportJobViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin):
+    """
+    Background exports of appraisals, offers or comments. Create a job with the download_csv filters,
+    poll it until its status is complete, then fetch the file from its download_url.
+    """
+    serializer_class = ExportJobSerializer
+    pagination_class = CustomPagination
+    permission_classes = [IsDealer | IsWholesaler]
+    query_budgets = {'list': 4, 'retrieve': 3}
+
+    def get_queryset(self):
+        return ExportJob.objects.filter(requested_by=self.request.user).order_by('-created_at')
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = request.user
+        context = get_role_context(user)
+        limit = export_settings()['per_dealership']
+
+        with transaction.atomic():
+            if context.is_dealer:
+                dealership_ids = context.dealership_ids
+                dealership_id = serializer.validated_data['filters'].get('dealership_id')
+                if dealership_id:
+                    dealership_ids = dealership_ids & {dealership_id}
+                # Lock the dealerships so concurrent requests cannot both take the last slot
+                dealership_ids = list(Dealership.objects.select_for_update().filter(id__in=dealership_ids).values_list('id', flat=True))
+                if not dealership_ids:
+                    return Response({"detail": "You are not a member of any dealership."}, status=status.HTTP_400_BAD_REQUEST)
+
+                busy = sorted(dealership_id for dealership_id, taken in export_slots_taken(dealership_ids).items() if taken >= limit)
+                if busy:
+                    return Response({"detail": f"Dealerships can run at most {limit} exports at a time. Try again once one finishes.",
+                                     "dealership_ids": busy}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+            else:
+                # Wholesaler exports are not tied to a dealership, so the cap applies to the wholesaler
+                dealership_ids = []
+                if ExportJob.objects.filter(requested_by=user, status__in=ExportJob.ACTIVE_STATUSES).count() >= limit:
+                    return Response({"detail": f"You can run at most {limit} exports at a time. Try again once one finishes."},
+                                    status=status.HTTP_429_TOO_MANY_REQUESTS)
+
+            job = serializer.save(requested_by=user, dealerships=dealership_ids)
+            transaction.on_commit(lambda: submit_export_job(job))
+
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['get'], url_path='download')
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != 'complete' or not os.path.exists(job.file_path):
+            return Response({"detail": f"The export is not ready to download (status: {job.status})."}, status=status.HTTP_409_CONFLICT)
 
-        return Response({"message": "Winning offer selected successfully"}, status=status.HTTP_200_OK)
\ No newline at end of file
+        content_type = 'text/csv' if job.format == 'csv' else 'application/x-ndjson'
+        return FileResponse(open(job.file_path, 'rb'), as_attachment=True, filename=job.filename, content_type=content_type)